@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import functools
+import heapq
+import itertools
+import logging
+import time
+
+from cache_memoria import CacheMemoria
+from metricas import Contador, Histograma, Medidor, registro
+from utilitarios import LimitadorTaxa
+
+# Controle de admissão na frente dos handlers.
+#
+# Todo handler ocupa uma das `vagas` enquanto executa. As chamadas aos
+# modelos da OpenAI (Whisper/ChatGPT) ocupam, além disso, uma das `vagas_llm`,
+# tomada pelo handler com `chamada_modelo` só em volta da chamada de fato:
+# respostas da tabela local ou de um cache não passam por ela. Quem não
+# encontra vaga espera numa fila limitada, em que a entrada dos handlers passa
+# na frente das chamadas aos modelos. Com a fila cheia, a atualização é
+# respondida na hora com um "tente novamente". `chamada_modelo` também cobra a
+# chamada do token bucket do usuário.
+#
+# As vagas são deste processo: com TRABALHADORES > 1, o total de chamadas
+# simultâneas aos modelos é TRABALHADORES x vagas_llm.
+
+logger = logging.getLogger(__name__)
+
+ADMISSAO_ESPERA = Histograma(registro, 'macrobot_admissao_espera_segundos', 'Tempo na fila de admissão.', ['tipo'])
+ADMISSAO_RECUSADAS = Contador(registro, 'macrobot_admissao_recusadas_total', 'Atualizações recusadas pela admissão.', ['tipo', 'motivo'])
+ADMISSAO_EM_USO = Medidor(registro, 'macrobot_admissao_em_uso', 'Vagas de execução em uso.', ['tipo'])
+ADMISSAO_FILA = Medidor(registro, 'macrobot_admissao_fila', 'Atualizações na fila de admissão.')
+
+PRIORIDADE_HANDLER = 0
+PRIORIDADE_LLM = 1
+
+
+# Levantada por ControleAdmissao.cobrar; o envoltório responde ao usuário
+class LimiteExcedido(Exception):
+    pass
+
+
+# Levantada por ControleAdmissao.chamada_modelo quando a fila está cheia
+class FilaCheia(Exception):
+    pass
+
+
+# `entrar(False)` ocupa uma vaga de execução; `entrar(True)` ocupa uma vaga de
+# modelo, pedida por quem já está executando
+class FilaAdmissao:
+    def __init__(self, vagas=16, vagas_llm=4, limite_fila=64):
+        self.vagas = vagas
+        self.vagas_llm = vagas_llm
+        self.limite_fila = limite_fila
+        self._em_uso = 0
+        self._em_uso_llm = 0
+        self._espera = []
+        self._sequencia = itertools.count()
+
+    def _cabe(self, llm):
+        return self._em_uso_llm < self.vagas_llm if llm else self._em_uso < self.vagas
+
+    def _atualizar_medidores(self):
+        ADMISSAO_EM_USO.definir(self._em_uso, 'handler')
+        ADMISSAO_EM_USO.definir(self._em_uso_llm, 'llm')
+        ADMISSAO_FILA.definir(len(self._espera))
+
+    def _ocupar(self, llm):
+        if llm:
+            self._em_uso_llm += 1
+        else:
+            self._em_uso += 1
+
+    # Espera uma vaga; devolve False se a fila estiver cheia (ou se o lugar na
+    # fila for cedido a um handler)
+    async def entrar(self, llm):
+        # Quando sobra vaga ninguém do mesmo tipo está esperando: `sair` já o teria liberado
+        if self._cabe(llm):
+            self._ocupar(llm)
+            self._atualizar_medidores()
+            return True
+        if len(self._espera) >= self.limite_fila and (llm or not self._ceder_lugar()):
+            return False
+
+        futuro = asyncio.get_running_loop().create_future()
+        entrada = (PRIORIDADE_LLM if llm else PRIORIDADE_HANDLER, next(self._sequencia), futuro, llm)
+        heapq.heappush(self._espera, entrada)
+        ADMISSAO_FILA.definir(len(self._espera))
+        try:
+            return await futuro
+        except asyncio.CancelledError:
+            if futuro.done() and not futuro.cancelled() and futuro.result():
+                self.sair(llm)
+            elif entrada in self._espera:
+                self._espera.remove(entrada)
+                heapq.heapify(self._espera)
+            raise
+
+    def sair(self, llm):
+        if llm:
+            self._em_uso_llm -= 1
+        else:
+            self._em_uso -= 1
+        # Libera, em ordem de prioridade, quem couber nas vagas abertas; a
+        # lista tirada do heap em ordem continua sendo um heap
+        restantes = []
+        while self._espera:
+            entrada = heapq.heappop(self._espera)
+            _, _, futuro, llm_espera = entrada
+            if futuro.done():
+                continue
+            if self._cabe(llm_espera):
+                self._ocupar(llm_espera)
+                futuro.set_result(True)
+            else:
+                restantes.append(entrada)
+        self._espera = restantes
+        self._atualizar_medidores()
+
+    # Recusa a chamada a modelo que entrou por último na fila, abrindo lugar para um handler
+    def _ceder_lugar(self):
+        candidatos = [entrada for entrada in self._espera if entrada[3] and not entrada[2].done()]
+        if not candidatos:
+            return False
+        entrada = max(candidatos, key=lambda entrada: entrada[1])
+        self._espera.remove(entrada)
+        heapq.heapify(self._espera)
+        entrada[2].set_result(False)
+        return True
+
+
+class ControleAdmissao:
+    # `taxa_usuario` e `capacidade_usuario` definem o token bucket de cada
+    # usuário para as chamadas aos modelos
+    def __init__(self, vagas=16, vagas_llm=4, limite_fila=64, taxa_usuario=0.2,
+                 capacidade_usuario=5, usuarios=100000, mensagem_ocupado="", mensagem_limite=""):
+        self.fila = FilaAdmissao(vagas, vagas_llm, limite_fila)
+        self.taxa_usuario = taxa_usuario
+        self.capacidade_usuario = capacidade_usuario
+        self.mensagem_ocupado = mensagem_ocupado
+        self.mensagem_limite = mensagem_limite
+        self._limitadores = CacheMemoria(usuarios)
+
+    # Cobra do usuário uma chamada aos modelos; sem ficha, levanta LimiteExcedido
+    def cobrar(self, user_id):
+        limitador = self._limitadores.obter(user_id)
+        if limitador is None:
+            limitador = LimitadorTaxa(self.taxa_usuario, self.capacidade_usuario)
+            self._limitadores.guardar(user_id, limitador)
+        if not limitador.tentar_adquirir():
+            raise LimiteExcedido(user_id)
+
+    # Em volta de cada chamada aos modelos: cobra do usuário e segura uma das
+    # `vagas_llm` até a chamada terminar
+    @contextlib.asynccontextmanager
+    async def chamada_modelo(self, user_id):
+        self.cobrar(user_id)
+        inicio = time.perf_counter()
+        if not await self.fila.entrar(True):
+            raise FilaCheia()
+        ADMISSAO_ESPERA.observar(time.perf_counter() - inicio, 'llm')
+        try:
+            yield
+        finally:
+            self.fila.sair(True)
+
+    async def _recusar(self, update, texto):
+        if update.callback_query:
+            await update.callback_query.answer(texto)
+        elif update.effective_message:
+            await update.effective_message.reply_text(texto)
+
+    # Para usar com metricas.envolver_handlers
+    def envolver(self, nome, callback):
+        @functools.wraps(callback)
+        async def envoltorio(update, context):
+            inicio = time.perf_counter()
+            if not await self.fila.entrar(False):
+                ADMISSAO_RECUSADAS.inc('handler', 'fila_cheia')
+                logger.warning("Atualização recusada: fila de admissão cheia", extra={"handler": nome})
+                await self._recusar(update, self.mensagem_ocupado)
+                return None
+            ADMISSAO_ESPERA.observar(time.perf_counter() - inicio, 'handler')
+            try:
+                return await callback(update, context)
+            except FilaCheia:
+                ADMISSAO_RECUSADAS.inc('llm', 'fila_cheia')
+                logger.warning("Chamada ao modelo recusada: fila de admissão cheia", extra={"handler": nome})
+                await self._recusar(update, self.mensagem_ocupado)
+                return None
+            except LimiteExcedido:
+                ADMISSAO_RECUSADAS.inc('llm', 'limite_usuario')
+                await self._recusar(update, self.mensagem_limite)
+                return None
+            finally:
+                self.fila.sair(False)
+        return envoltorio
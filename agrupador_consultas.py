@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from metricas import Contador, Histograma, registro
+
+# Agrupa consultas caras (ex.: nutrientes no ChatGPT) feitas ao mesmo tempo.
+#
+# Consultas iguais em andamento compartilham uma única requisição (single
+# flight). Consultas diferentes que chegam dentro de uma janela curta, ou até
+# completar `tamanho_maximo` itens, seguem juntas em uma só chamada de
+# `consultar_lote(itens)`, que devolve uma resposta por item, na mesma ordem.
+# O opcional `guardar(itens, respostas)` roda depois que as respostas já foram
+# entregues a quem esperava; uma falha nele só vai para o log.
+
+logger = logging.getLogger(__name__)
+
+AGRUPADOR_CONSULTAS = Contador(registro, 'macrobot_agrupador_consultas_total', 'Consultas recebidas pelo agrupador, por destino.', ['agrupador', 'tipo'])
+AGRUPADOR_LOTE = Histograma(registro, 'macrobot_agrupador_lote_itens', 'Itens por lote enviado.', ['agrupador'], baldes=(1, 2, 4, 8, 16, 32))
+
+
+class AgrupadorConsultas:
+    def __init__(self, nome, consultar_lote, normalizar=None, janela=0.05, tamanho_maximo=8, guardar=None):
+        self.nome = nome
+        self.consultar_lote = consultar_lote
+        self.guardar = guardar
+        self.normalizar = normalizar or (lambda item: item)
+        self.janela = janela
+        self.tamanho_maximo = tamanho_maximo
+        self._em_andamento = {}
+        self._pendentes = []
+        self._temporizador = None
+        self._tarefas = set()
+
+    async def consultar(self, item):
+        chave = self.normalizar(item)
+        futuro = self._em_andamento.get(chave)
+        if futuro is not None:
+            AGRUPADOR_CONSULTAS.inc(self.nome, 'coalescida')
+            return await asyncio.shield(futuro)
+
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._em_andamento[chave] = futuro
+        self._pendentes.append((chave, item, futuro))
+        AGRUPADOR_CONSULTAS.inc(self.nome, 'enviada')
+        if len(self._pendentes) >= self.tamanho_maximo:
+            self._despachar()
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self.janela, self._despachar)
+        # Quem desiste de esperar não cancela a consulta dos demais
+        return await asyncio.shield(futuro)
+
+    def _despachar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        lote, self._pendentes = self._pendentes, []
+        if not lote:
+            return
+        AGRUPADOR_LOTE.observar(len(lote), self.nome)
+        tarefa = asyncio.ensure_future(self._executar(lote))
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _executar(self, lote):
+        try:
+            respostas = await self.consultar_lote([item for _, item, _ in lote])
+            if len(respostas) != len(lote):
+                raise ValueError(f"Lote com {len(lote)} itens recebeu {len(respostas)} respostas")
+        except Exception as e:
+            logger.exception("Erro na consulta em lote", extra={"agrupador": self.nome, "itens": len(lote)})
+            for _, _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+                    # Evita o aviso de exceção não lida quando ninguém mais espera
+                    futuro.exception()
+        else:
+            for (_, _, futuro), resposta in zip(lote, respostas):
+                if not futuro.done():
+                    futuro.set_result(resposta)
+            # Até aqui a chave continua em andamento, com o futuro já resolvido:
+            # quem pedir o mesmo item enquanto isso recebe a resposta pronta
+            if self.guardar is not None:
+                try:
+                    await self.guardar([item for _, item, _ in lote], respostas)
+                except Exception:
+                    logger.exception("Erro ao guardar as respostas do lote", extra={"agrupador": self.nome, "itens": len(lote)})
+        finally:
+            for chave, _, _ in lote:
+                self._em_andamento.pop(chave, None)
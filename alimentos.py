@@ -0,0 +1,164 @@
+import csv
+import difflib
+import re
+from collections import namedtuple
+
+from cache_nutrientes import normalizar_alimento
+
+# Tabela local de alimentos (valores por 100 g, no estilo da tabela TACO) e
+# interpretação de mensagens como "2 pães e um copo de café com leite" em
+# itens de (quantidade, unidade, alimento).
+
+Alimento = namedtuple('Alimento', 'nome proteinas carboidratos gorduras calorias porcao_g')
+
+# Peso em gramas (ou ml) de cada unidade caseira; None usa a porção típica do
+# alimento (porcao_g), como nas fatias e pedaços, que variam muito de um
+# alimento para outro
+UNIDADES = {
+    'g': 1, 'gr': 1, 'grama': 1, 'gramas': 1,
+    'kg': 1000, 'quilo': 1000, 'quilos': 1000,
+    'ml': 1, 'l': 1000, 'litro': 1000, 'litros': 1000,
+    'copo': 200, 'copos': 200,
+    'xicara': 240, 'xicaras': 240,
+    'colher de sopa': 15, 'colheres de sopa': 15,
+    'colher de cha': 5, 'colheres de cha': 5,
+    'colher': 15, 'colheres': 15,
+    'concha': 120, 'conchas': 120,
+    'fatia': None, 'fatias': None,
+    'pedaco': None, 'pedacos': None,
+    'prato': 250, 'pratos': 250,
+    'porcao': 100, 'porcoes': 100,
+    'lata': 350, 'latas': 350,
+    'taca': 150, 'tacas': 150,
+    'unidade': None, 'unidades': None,
+}
+
+NUMEROS = {
+    'um': 1, 'uma': 1, 'dois': 2, 'duas': 2, 'tres': 3, 'quatro': 4, 'cinco': 5,
+    'seis': 6, 'sete': 7, 'oito': 8, 'nove': 9, 'dez': 10, 'meio': 0.5, 'meia': 0.5,
+}
+
+# A vírgula entre dígitos é decimal ("0,5 xícara"), não separa itens
+_SEPARADORES = re.compile(r'\s*(?:(?<!\d),|,(?!\d)|[;+\n]|\s\be\b\s)\s*', re.IGNORECASE)
+_FRACAO = re.compile(r'(\d+)\s*/\s*(\d+)')
+_ITEM = re.compile(
+    r'^(?:(?P<quantidade>\d+(?:[.,]\d+)?|(?:' + '|'.join(NUMEROS) + r')\b)\s*)?'
+    r'(?:(?P<unidade>' + '|'.join(sorted(UNIDADES, key=len, reverse=True)) + r')\b\s*)?'
+    r'(?:(?:de|da|do|das|dos)\s+)?'
+    r'(?P<nome>.+)$'
+)
+_PLURAIS = [('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('ns', 'm'), ('res', 'r'), ('s', '')]
+
+
+def _singular(palavra):
+    if len(palavra) <= 3:
+        return palavra
+    for final, troca in _PLURAIS:
+        if palavra.endswith(final):
+            return palavra[:-len(final)] + troca
+    return palavra
+
+
+def _chave(nome):
+    return ' '.join(_singular(palavra) for palavra in normalizar_alimento(nome).split())
+
+
+# Divide a mensagem em itens nos separadores ",", ";", "+", quebras de linha e " e "
+# (a vírgula de números decimais não conta)
+def separar_itens(mensagem):
+    return [parte for parte in _SEPARADORES.split(mensagem.strip()) if parte]
+
+
+# Interpreta um item em (quantidade, gramas por unidade, nome do alimento)
+def interpretar_item(texto):
+    texto = _FRACAO.sub(lambda m: str(int(m.group(1)) / int(m.group(2))), texto)
+    correspondencia = _ITEM.match(normalizar_alimento(texto))
+    if correspondencia is None:
+        return None
+
+    quantidade = correspondencia.group('quantidade')
+    if quantidade is None:
+        quantidade = 1
+    elif quantidade in NUMEROS:
+        quantidade = NUMEROS[quantidade]
+    else:
+        quantidade = float(quantidade.replace(',', '.'))
+
+    unidade = correspondencia.group('unidade')
+    gramas_unidade = UNIDADES[unidade] if unidade else None
+    return quantidade, gramas_unidade, correspondencia.group('nome')
+
+
+class TabelaAlimentos:
+    def __init__(self, alimentos, corte_similaridade=0.8):
+        self.corte_similaridade = corte_similaridade
+        self._por_chave = {}
+        self._por_palavra = {}
+        for alimento, nomes in alimentos:
+            for nome in nomes:
+                chave = _chave(nome)
+                self._por_chave.setdefault(chave, alimento)
+                for palavra in chave.split():
+                    self._por_palavra.setdefault(palavra, set()).add(chave)
+
+    # Carrega o CSV (separado por ";") com os valores por 100 g e a porção típica
+    @classmethod
+    def carregar(cls, caminho):
+        alimentos = []
+        with open(caminho, encoding='utf-8', newline='') as arquivo:
+            for linha in csv.DictReader(arquivo, delimiter=';'):
+                alimento = Alimento(
+                    linha['alimento'],
+                    float(linha['proteinas']),
+                    float(linha['carboidratos']),
+                    float(linha['gorduras']),
+                    float(linha['calorias']),
+                    float(linha['porcao_g']),
+                )
+                sinonimos = [sinonimo for sinonimo in linha['sinonimos'].split('|') if sinonimo]
+                alimentos.append((alimento, [alimento.nome] + sinonimos))
+        return cls(alimentos)
+
+    # Busca exata pela chave normalizada e, se não achar, aproximada só entre os
+    # nomes que contêm todas as palavras procuradas (cada uma igual ou com erro
+    # de digitação). Assim "feijão branco" não vira "queijo branco" e "pão de
+    # mel" não vira "pão": sem correspondência segura, o item vai para o modelo
+    def buscar(self, nome):
+        chave = _chave(nome)
+        alimento = self._por_chave.get(chave)
+        if alimento is not None:
+            return alimento
+
+        candidatos = None
+        for palavra in chave.split():
+            if palavra in self._por_palavra:
+                parecidas = [palavra]
+            else:
+                parecidas = difflib.get_close_matches(palavra, self._por_palavra, n=3, cutoff=self.corte_similaridade)
+            chaves = set().union(*(self._por_palavra[parecida] for parecida in parecidas))
+            candidatos = chaves if candidatos is None else candidatos & chaves
+            if not candidatos:
+                return None
+
+        melhores = difflib.get_close_matches(chave, candidatos, n=1, cutoff=self.corte_similaridade)
+        return self._por_chave[melhores[0]] if melhores else None
+
+    # Calcula os nutrientes de um item da mensagem, ou None se não houver correspondência local
+    def calcular(self, texto):
+        interpretado = interpretar_item(texto)
+        if interpretado is None:
+            return None
+        quantidade, gramas_unidade, nome = interpretado
+
+        alimento = self.buscar(nome)
+        if alimento is None:
+            return None
+
+        fator = quantidade * (gramas_unidade or alimento.porcao_g) / 100
+        return {
+            "alimento": texto,
+            "proteinas": round(alimento.proteinas * fator, 2),
+            "carboidratos": round(alimento.carboidratos * fator, 2),
+            "gorduras": round(alimento.gorduras * fator, 2),
+            "calorias": round(alimento.calorias * fator, 2),
+        }
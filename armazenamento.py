@@ -0,0 +1,487 @@
+import asyncio
+import datetime
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import medir
+
+# Camada de acesso ao SQLite fora do event loop.
+#
+# Todas as escritas passam por uma única tarefa escritora, que agrupa as
+# operações pendentes em uma só transação (group commit) executada em uma
+# thread dedicada. As leituras usam um pequeno pool de conexões somente
+# leitura em modo WAL, cada uma presa a uma thread do pool de leitura.
+
+
+class Armazenamento:
+    def __init__(self, caminho, leitores=4, tamanho_lote=128):
+        self.caminho = caminho
+        self.leitores = leitores
+        self.tamanho_lote = tamanho_lote
+        self._fila = None
+        self._tarefa_escritora = None
+        self._conexao_escrita = None
+        self._executor_escrita = None
+        self._executor_leitura = None
+        self._local = threading.local()
+        self._conexoes_leitura = []
+        self._trava_conexoes = threading.Lock()
+
+    # Abre a conexão de escrita, cria as tabelas e inicia a tarefa escritora.
+    # Pode ser chamado mais de uma vez: a persistência do bot abre o banco antes do post_init
+    async def iniciar(self):
+        if self._tarefa_escritora is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._executor_escrita = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-escrita')
+        self._executor_leitura = ThreadPoolExecutor(max_workers=self.leitores, thread_name_prefix='sqlite-leitura')
+        await loop.run_in_executor(self._executor_escrita, self._abrir_escrita)
+        self._fila = asyncio.Queue()
+        self._tarefa_escritora = asyncio.create_task(self._escritor())
+
+    # Espera as escritas pendentes serem gravadas e fecha todas as conexões
+    async def fechar(self):
+        if self._tarefa_escritora is None:
+            return
+        await self._fila.put(None)
+        await self._tarefa_escritora
+        self._tarefa_escritora = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor_leitura.shutdown)
+        with self._trava_conexoes:
+            for conexao in self._conexoes_leitura:
+                conexao.close()
+            self._conexoes_leitura.clear()
+
+        await loop.run_in_executor(self._executor_escrita, self._conexao_escrita.close)
+        self._executor_escrita.shutdown()
+
+    def _abrir_escrita(self):
+        conexao = sqlite3.connect(self.caminho, isolation_level=None, check_same_thread=False)
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute('PRAGMA synchronous=NORMAL')
+        conexao.execute('PRAGMA busy_timeout=5000')
+        self._criar_tabelas(conexao)
+        self._migrar(conexao)
+        self._conexao_escrita = conexao
+
+    def _criar_tabelas(self, conexao):
+        conexao.execute('''
+        CREATE TABLE IF NOT EXISTS info_nutricional (
+            user_id INTEGER,
+            alimento TEXT,
+            proteinas REAL,
+            carboidratos REAL,
+            gorduras REAL,
+            calorias REAL,
+            data_hora TEXT
+        )
+        ''')
+        conexao.execute('''
+        CREATE TABLE IF NOT EXISTS user_preferences (
+            user_id INTEGER PRIMARY KEY,
+            receber_relatorio INTEGER DEFAULT 1
+        )
+        ''')
+
+    # Aplica, em ordem, as migrações ainda não registradas em PRAGMA user_version
+    def _migrar(self, conexao):
+        versao = conexao.execute('PRAGMA user_version').fetchone()[0]
+        for numero, migracao in enumerate(MIGRACOES[versao:], start=versao + 1):
+            conexao.execute('BEGIN IMMEDIATE')
+            try:
+                migracao(conexao)
+                conexao.execute(f'PRAGMA user_version = {numero}')
+                conexao.execute('COMMIT')
+            except Exception:
+                conexao.execute('ROLLBACK')
+                raise
+
+    # Cada thread do pool de leitura mantém sua própria conexão somente leitura
+    def _conexao_leitura(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(f'file:{self.caminho}?mode=ro', uri=True, check_same_thread=False)
+            conexao.execute('PRAGMA query_only=1')
+            conexao.execute('PRAGMA busy_timeout=5000')
+            self._local.conexao = conexao
+            with self._trava_conexoes:
+                self._conexoes_leitura.append(conexao)
+        return conexao
+
+    # Tarefa escritora: junta tudo o que estiver na fila em um único commit
+    async def _escritor(self):
+        loop = asyncio.get_running_loop()
+        encerrar = False
+        while not encerrar:
+            operacao = await self._fila.get()
+            if operacao is None:
+                break
+            lote = [operacao]
+            while len(lote) < self.tamanho_lote:
+                try:
+                    proxima = self._fila.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if proxima is None:
+                    encerrar = True
+                    break
+                lote.append(proxima)
+
+            resultados = await loop.run_in_executor(
+                self._executor_escrita, self._executar_lote, [funcao for funcao, _ in lote]
+            )
+            for (_, futuro), (sucesso, valor) in zip(lote, resultados):
+                if futuro.done():
+                    continue
+                if sucesso:
+                    futuro.set_result(valor)
+                else:
+                    futuro.set_exception(valor)
+
+    # Executa o lote em uma transação; cada operação fica em um savepoint
+    # para que a falha de uma não desfaça as demais
+    def _executar_lote(self, funcoes):
+        conexao = self._conexao_escrita
+        resultados = []
+        try:
+            conexao.execute('BEGIN IMMEDIATE')
+            for funcao in funcoes:
+                conexao.execute('SAVEPOINT operacao')
+                try:
+                    resultados.append((True, funcao(conexao)))
+                except Exception as e:
+                    conexao.execute('ROLLBACK TO operacao')
+                    resultados.append((False, e))
+                conexao.execute('RELEASE operacao')
+            conexao.execute('COMMIT')
+        except Exception as e:
+            if conexao.in_transaction:
+                conexao.execute('ROLLBACK')
+            return [(False, e)] * len(funcoes)
+        return resultados
+
+    # Agenda uma função `funcao(conexao)` na tarefa escritora e espera o commit
+    async def executar_escrita(self, funcao):
+        futuro = asyncio.get_running_loop().create_future()
+        async with medir('sqlite', 'escrita'):
+            await self._fila.put((funcao, futuro))
+            return await futuro
+
+    # Executa uma função `funcao(conexao)` em uma conexão do pool de leitura
+    async def executar_leitura(self, funcao):
+        loop = asyncio.get_running_loop()
+        async with medir('sqlite', 'leitura'):
+            return await loop.run_in_executor(self._executor_leitura, lambda: funcao(self._conexao_leitura()))
+
+    async def escrever(self, sql, parametros=()):
+        return await self.executar_escrita(lambda conexao: conexao.execute(sql, parametros).rowcount)
+
+    async def ler(self, sql, parametros=()):
+        return await self.executar_leitura(lambda conexao: conexao.execute(sql, parametros).fetchall())
+
+    async def ler_um(self, sql, parametros=()):
+        return await self.executar_leitura(lambda conexao: conexao.execute(sql, parametros).fetchone())
+
+    # Função para registrar o usuário na tabela de preferências
+    async def registrar_usuario(self, user_id):
+        await self.escrever('INSERT OR IGNORE INTO user_preferences (user_id) VALUES (?)', (user_id,))
+
+    # Função para ligar ou desligar o relatório diário do usuário
+    async def definir_relatorio(self, user_id, receber):
+        await self.escrever('UPDATE user_preferences SET receber_relatorio = ? WHERE user_id = ?', (int(receber), user_id))
+
+    # Função para salvar os itens de uma refeição, um registro por item,
+    # mantendo o total do dia em daily_totals na mesma transação
+    async def salvar_itens(self, user_id, itens):
+        agora = datetime.datetime.now()
+        data_hora_atual = agora.strftime("%Y-%m-%d %H:%M:%S")
+        dia = agora.strftime("%Y-%m-%d")
+
+        def salvar(conexao):
+            conexao.executemany('''
+            INSERT INTO info_nutricional (user_id, alimento, proteinas, carboidratos, gorduras, calorias, data_hora)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (user_id, item["alimento"], item["proteinas"], item["carboidratos"], item["gorduras"], item["calorias"], data_hora_atual)
+                for item in itens
+            ])
+            conexao.execute('''
+            INSERT INTO daily_totals (user_id, day, protein, carbs, fat, kcal, n_items)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                protein = protein + excluded.protein,
+                carbs = carbs + excluded.carbs,
+                fat = fat + excluded.fat,
+                kcal = kcal + excluded.kcal,
+                n_items = n_items + excluded.n_items
+            ''', (
+                user_id, dia,
+                sum(item["proteinas"] for item in itens),
+                sum(item["carboidratos"] for item in itens),
+                sum(item["gorduras"] for item in itens),
+                sum(item["calorias"] for item in itens),
+                len(itens),
+            ))
+            _incrementar_versao(conexao, user_id)
+
+        await self.executar_escrita(salvar)
+
+    # Função para resetar informações nutricionais
+    async def resetar_info_nutricional(self, user_id):
+        def resetar(conexao):
+            conexao.execute('DELETE FROM info_nutricional WHERE user_id = ?', (user_id,))
+            conexao.execute('DELETE FROM daily_totals WHERE user_id = ?', (user_id,))
+            conexao.execute('DELETE FROM monthly_totals WHERE user_id = ?', (user_id,))
+            _incrementar_versao(conexao, user_id)
+
+        await self.executar_escrita(resetar)
+
+    # Função para consultar o total diário do usuário
+    async def consultar_totais_diarios(self, user_id, data_consulta):
+        inicio, fim = intervalo_do_dia(data_consulta)
+
+        def consultar(conexao):
+            # Alimentos consumidos na data fornecida (intervalo no índice user_id, data_hora)
+            alimentos_consumidos = conexao.execute('''
+            SELECT alimento, proteinas, carboidratos, gorduras, calorias, data_hora
+            FROM info_nutricional
+            WHERE user_id = ? AND data_hora >= ? AND data_hora < ?
+            ''', (user_id, inicio, fim)).fetchall()
+
+            # Totais já somados na tabela daily_totals
+            resultado = conexao.execute('''
+            SELECT protein, carbs, fat, kcal
+            FROM daily_totals
+            WHERE user_id = ? AND day = ?
+            ''', (user_id, data_consulta)).fetchone()
+            return alimentos_consumidos, resultado
+
+        alimentos_consumidos, resultado = await self.executar_leitura(consultar)
+
+        # Se houver algum resultado, retorna os valores, caso contrário, retorna 0 para cada nutriente
+        resultado = resultado or (0, 0, 0, 0)
+        totais = {
+            "proteinas": resultado[0] or 0,
+            "carboidratos": resultado[1] or 0,
+            "gorduras": resultado[2] or 0,
+            "calorias": resultado[3] or 0
+        }
+
+        return alimentos_consumidos, totais
+
+    # Busca em uma só consulta os alimentos do dia de todos os usuários que
+    # recebem o relatório; devolve {user_id: (alimentos_consumidos, totais)}
+    async def consultar_relatorios_do_dia(self, data_consulta):
+        inicio, fim = intervalo_do_dia(data_consulta)
+        linhas = await self.ler('''
+        SELECT p.user_id, i.alimento, i.proteinas, i.carboidratos, i.gorduras, i.calorias, i.data_hora
+        FROM user_preferences p
+        LEFT JOIN info_nutricional i
+            ON i.user_id = p.user_id AND i.data_hora >= ? AND i.data_hora < ?
+        WHERE p.receber_relatorio = 1
+        ORDER BY p.user_id, i.data_hora
+        ''', (inicio, fim))
+
+        relatorios = {}
+        for user_id, *alimento in linhas:
+            alimentos_consumidos, totais = relatorios.setdefault(user_id, ([], {
+                "proteinas": 0, "carboidratos": 0, "gorduras": 0, "calorias": 0
+            }))
+            if alimento[0] is None:
+                continue
+            alimentos_consumidos.append(tuple(alimento))
+            totais["proteinas"] += alimento[1] or 0
+            totais["carboidratos"] += alimento[2] or 0
+            totais["gorduras"] += alimento[3] or 0
+            totais["calorias"] += alimento[4] or 0
+        return relatorios
+
+    # Último dia em que uma tarefa diária (ex.: o relatório) foi concluída
+    async def ultima_execucao(self, tarefa):
+        linha = await self.ler_um('SELECT dia FROM execucoes_diarias WHERE tarefa = ?', (tarefa,))
+        return linha[0] if linha else None
+
+    async def registrar_execucao(self, tarefa, dia):
+        await self.escrever('INSERT OR REPLACE INTO execucoes_diarias (tarefa, dia) VALUES (?, ?)', (tarefa, dia))
+
+    # Versão dos dados do usuário; muda a cada alimento salvo ou reset
+    async def versao_dados(self, user_id):
+        linha = await self.ler_um('SELECT version FROM user_data_version WHERE user_id = ?', (user_id,))
+        return linha[0] if linha else 0
+
+    # Totais de cada dia a partir de `inicio` (dias sem registro ficam de fora),
+    # junto com a versão dos dados do usuário
+    async def consultar_serie_diaria(self, user_id, inicio):
+        def consultar(conexao):
+            linhas = conexao.execute('''
+            SELECT day, protein, carbs, fat, kcal
+            FROM daily_totals
+            WHERE user_id = ? AND day >= ?
+            ORDER BY day
+            ''', (user_id, inicio)).fetchall()
+            versao = conexao.execute('SELECT version FROM user_data_version WHERE user_id = ?', (user_id,)).fetchone()
+            return linhas, versao[0] if versao else 0
+
+        return await self.executar_leitura(consultar)
+
+    # Médias por dia (geral, últimos 7 e últimos 30 dias) em uma só passada
+    # sobre daily_totals, junto com a versão dos dados do usuário
+    async def calcular_medias_diarias(self, user_id):
+        hoje = datetime.date.today()
+        semana = (hoje - datetime.timedelta(days=7)).isoformat()
+        mes = (hoje - datetime.timedelta(days=30)).isoformat()
+        linha = await self.ler_um('''
+        SELECT
+            COUNT(*),
+            AVG(protein), AVG(carbs), AVG(fat), AVG(kcal),
+            AVG(CASE WHEN day >= :semana THEN protein END),
+            AVG(CASE WHEN day >= :semana THEN carbs END),
+            AVG(CASE WHEN day >= :semana THEN fat END),
+            AVG(CASE WHEN day >= :semana THEN kcal END),
+            AVG(CASE WHEN day >= :mes THEN protein END),
+            AVG(CASE WHEN day >= :mes THEN carbs END),
+            AVG(CASE WHEN day >= :mes THEN fat END),
+            AVG(CASE WHEN day >= :mes THEN kcal END),
+            (SELECT version FROM user_data_version WHERE user_id = :user_id)
+        FROM daily_totals
+        WHERE user_id = :user_id AND n_items > 0
+        ''', {"user_id": user_id, "semana": semana, "mes": mes})
+
+        if not linha[0]:
+            return None
+        return {
+            "geral": tuple(valor or 0 for valor in linha[1:5]),
+            "semana": tuple(valor or 0 for valor in linha[5:9]),
+            "mes": tuple(valor or 0 for valor in linha[9:13]),
+            "versao": linha[13] or 0,
+        }
+
+
+# Limites [início, fim) de um dia no formato gravado em data_hora, para que a
+# consulta use o índice em vez de aplicar DATE() em cada linha
+def intervalo_do_dia(dia):
+    inicio = datetime.date.fromisoformat(dia)
+    fim = inicio + datetime.timedelta(days=1)
+    return inicio.isoformat(), fim.isoformat()
+
+
+# Migração 1: índice por usuário e data, e totais diários por usuário
+def _migracao_totais_diarios(conexao):
+    conexao.execute('''
+    CREATE INDEX IF NOT EXISTS idx_info_nutricional_usuario_data
+    ON info_nutricional (user_id, data_hora)
+    ''')
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        user_id INTEGER,
+        day TEXT,
+        protein REAL DEFAULT 0,
+        carbs REAL DEFAULT 0,
+        fat REAL DEFAULT 0,
+        kcal REAL DEFAULT 0,
+        n_items INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID
+    ''')
+    conexao.execute('''
+    INSERT OR REPLACE INTO daily_totals (user_id, day, protein, carbs, fat, kcal, n_items)
+    SELECT user_id, DATE(data_hora), TOTAL(proteinas), TOTAL(carboidratos), TOTAL(gorduras), TOTAL(calorias), COUNT(*)
+    FROM info_nutricional
+    GROUP BY user_id, DATE(data_hora)
+    ''')
+
+
+# Migração 2: cache persistente das consultas de nutrientes
+def _migracao_cache_nutrientes(conexao):
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS cache_nutrientes (
+        chave TEXT PRIMARY KEY,
+        resposta TEXT,
+        criado_em REAL,
+        acessado_em REAL
+    )
+    ''')
+    conexao.execute('''
+    CREATE INDEX IF NOT EXISTS idx_cache_nutrientes_acesso
+    ON cache_nutrientes (acessado_em)
+    ''')
+
+
+# Migração 3: contador de versão dos dados de cada usuário, usado para
+# invalidar o que é calculado a partir do histórico (ex.: insights)
+def _migracao_versao_dados(conexao):
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS user_data_version (
+        user_id INTEGER PRIMARY KEY,
+        version INTEGER DEFAULT 0
+    )
+    ''')
+
+
+# Migração 4: user_data e estados de conversa do bot (persistencia.py)
+def _migracao_persistencia(conexao):
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS persistencia_usuarios (
+        user_id INTEGER PRIMARY KEY,
+        dados TEXT NOT NULL,
+        atualizado_em REAL
+    )
+    ''')
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS persistencia_conversas (
+        nome TEXT,
+        chave TEXT,
+        estado TEXT NOT NULL,
+        atualizado_em REAL,
+        PRIMARY KEY (nome, chave)
+    ) WITHOUT ROWID
+    ''')
+
+
+# Migração 5: totais mensais dos meses já movidos para o arquivo do histórico
+# (arquivo_historico.py)
+def _migracao_totais_mensais(conexao):
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS monthly_totals (
+        user_id INTEGER,
+        month TEXT,
+        protein REAL DEFAULT 0,
+        carbs REAL DEFAULT 0,
+        fat REAL DEFAULT 0,
+        kcal REAL DEFAULT 0,
+        n_items INTEGER DEFAULT 0,
+        n_days INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, month)
+    ) WITHOUT ROWID
+    ''')
+
+
+# Migração 6: último dia de execução de cada tarefa diária, para recuperar
+# um relatório perdido enquanto o processo reiniciava
+def _migracao_execucoes_diarias(conexao):
+    conexao.execute('''
+    CREATE TABLE IF NOT EXISTS execucoes_diarias (
+        tarefa TEXT PRIMARY KEY,
+        dia TEXT
+    )
+    ''')
+
+
+def _incrementar_versao(conexao, user_id):
+    conexao.execute('''
+    INSERT INTO user_data_version (user_id, version) VALUES (?, 1)
+    ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+    ''', (user_id,))
+
+
+MIGRACOES = [
+    _migracao_totais_diarios,
+    _migracao_cache_nutrientes,
+    _migracao_versao_dados,
+    _migracao_persistencia,
+    _migracao_totais_mensais,
+    _migracao_execucoes_diarias,
+]
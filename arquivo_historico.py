@@ -0,0 +1,219 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import logging
+import os
+import shutil
+
+from metricas import Contador, registro
+
+# Arquivo do histórico de alimentos.
+#
+# info_nutricional só guarda os meses recentes: uma vez por dia, os meses
+# inteiros anteriores à janela de retenção saem da tabela e vão para um CSV
+# comprimido por usuário e mês (<diretorio>/<user_id>/<AAAA-MM>.csv.gz), e os
+# totais do mês ficam em monthly_totals (os de cada dia continuam em
+# daily_totals). O arquivo é gravado e sincronizado em disco antes de as linhas
+# serem apagadas do banco; se o processo cair entre uma coisa e outra, a
+# próxima compactação regrava o mesmo arquivo, sem duplicar linhas (cada linha
+# leva o rowid de origem).
+#
+# A exportação junta o arquivo e a tabela em ordem cronológica, linha a linha,
+# direto no arquivo de destino. Os meses arquivados de cada usuário são os que
+# estão em monthly_totals: a linha ali é gravada na mesma transação que tira
+# as linhas da tabela, então um arquivo sem ela (compactação interrompida ou
+# desfeita por um /reset) é ignorado, e as linhas saem da tabela.
+
+logger = logging.getLogger(__name__)
+
+HISTORICO_ARQUIVADO = Contador(registro, 'macrobot_historico_arquivado_total', 'Linhas movidas de info_nutricional para o arquivo.')
+
+COLUNAS_ARQUIVO = ['rowid', 'alimento', 'proteinas', 'carboidratos', 'gorduras', 'calorias', 'data_hora']
+COLUNAS_EXPORTACAO = ['data_hora', 'alimento', 'proteinas', 'carboidratos', 'gorduras', 'calorias']
+
+
+# Primeiro dia do mês seguinte, no formato de data_hora
+def _fim_do_mes(mes):
+    ano, numero = map(int, mes.split('-'))
+    return datetime.date(ano + numero // 12, numero % 12 + 1, 1).isoformat()
+
+
+# Linha do arquivo: (rowid, alimento, proteinas, carboidratos, gorduras, calorias, data_hora)
+def _ler_arquivo(caminho):
+    with gzip.open(caminho, 'rt', encoding='utf-8', newline='') as arquivo:
+        leitor = csv.reader(arquivo)
+        next(leitor, None)
+        for rowid, alimento, proteinas, carboidratos, gorduras, calorias, data_hora in leitor:
+            yield int(rowid), alimento, float(proteinas), float(carboidratos), float(gorduras), float(calorias), data_hora
+
+
+class ArquivoHistorico:
+    def __init__(self, armazenamento, diretorio, retencao_dias=90):
+        self.armazenamento = armazenamento
+        self.diretorio = diretorio
+        self.retencao_dias = retencao_dias
+
+    def _caminho(self, user_id, mes):
+        return os.path.join(self.diretorio, str(user_id), f'{mes}.csv.gz')
+
+    # Só meses inteiros saem da tabela: tudo antes do primeiro dia do mês em
+    # que cai o início da janela de retenção
+    def limite(self, hoje=None):
+        inicio = (hoje or datetime.date.today()) - datetime.timedelta(days=self.retencao_dias)
+        return inicio.replace(day=1).isoformat()
+
+    # Move para o arquivo os meses fora da janela de retenção, um usuário e mês
+    # por vez, para não segurar o escritor nem a memória com o histórico inteiro
+    async def compactar(self, hoje=None):
+        limite = self.limite(hoje)
+        pendentes = await self.armazenamento.ler('''
+        SELECT user_id, substr(data_hora, 1, 7) AS mes
+        FROM info_nutricional
+        WHERE data_hora < ?
+        GROUP BY user_id, mes
+        ''', (limite,))
+
+        resumo = {"limite": limite, "meses": 0, "linhas": 0}
+        for user_id, mes in pendentes:
+            try:
+                resumo["linhas"] += await self._arquivar_mes(user_id, mes, limite)
+                resumo["meses"] += 1
+            except Exception:
+                logger.exception("Erro ao arquivar histórico", extra={"user_id": user_id, "mes": mes})
+        return resumo
+
+    async def _arquivar_mes(self, user_id, mes, limite):
+        fim = min(_fim_do_mes(mes), limite)
+        linhas = await self.armazenamento.ler('''
+        SELECT rowid, alimento, proteinas, carboidratos, gorduras, calorias, data_hora
+        FROM info_nutricional
+        WHERE user_id = ? AND data_hora >= ? AND data_hora < ?
+        ''', (user_id, mes, fim))
+        if not linhas:
+            return 0
+
+        caminho = self._caminho(user_id, mes)
+        loop = asyncio.get_running_loop()
+        totais = await loop.run_in_executor(None, self._gravar_arquivo, caminho, linhas)
+
+        def mover(conexao):
+            apagadas = conexao.executemany(
+                'DELETE FROM info_nutricional WHERE rowid = ? AND user_id = ? AND data_hora = ?',
+                [(linha[0], user_id, linha[6]) for linha in linhas],
+            ).rowcount
+            if apagadas != len(linhas):
+                # Um /reset apagou o histórico no meio da compactação
+                return apagadas
+            conexao.execute('''
+            INSERT OR REPLACE INTO monthly_totals (user_id, month, protein, carbs, fat, kcal, n_items, n_days)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, mes, *totais))
+            return apagadas
+
+        apagadas = await self.armazenamento.executar_escrita(mover)
+        if apagadas != len(linhas):
+            logger.warning("Histórico alterado durante o arquivamento; descartando o arquivo", extra={"user_id": user_id, "mes": mes})
+            await loop.run_in_executor(None, self._remover_arquivo, caminho)
+            return 0
+        HISTORICO_ARQUIVADO.inc(valor=apagadas)
+        return apagadas
+
+    # Junta as linhas a um arquivo já existente do mês (sem repetir rowids),
+    # grava num temporário e troca de uma vez; devolve os totais do mês
+    def _gravar_arquivo(self, caminho, linhas):
+        existentes = list(_ler_arquivo(caminho)) if os.path.exists(caminho) else []
+        rowids = {linha[0] for linha in linhas}
+        todas = sorted([linha for linha in existentes if linha[0] not in rowids] + list(linhas), key=lambda linha: (linha[6], linha[0]))
+
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = caminho + '.tmp'
+        with open(temporario, 'wb') as bruto:
+            with gzip.open(bruto, 'wt', encoding='utf-8', newline='') as arquivo:
+                escritor = csv.writer(arquivo)
+                escritor.writerow(COLUNAS_ARQUIVO)
+                escritor.writerows(todas)
+            bruto.flush()
+            os.fsync(bruto.fileno())
+        os.replace(temporario, caminho)
+
+        return (
+            sum(linha[2] or 0 for linha in todas),
+            sum(linha[3] or 0 for linha in todas),
+            sum(linha[4] or 0 for linha in todas),
+            sum(linha[5] or 0 for linha in todas),
+            len(todas),
+            len({linha[6][:10] for linha in todas}),
+        )
+
+    def _remover_arquivo(self, caminho):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+    # Apaga o arquivo do usuário (usado pelo /reset)
+    async def apagar(self, user_id):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, shutil.rmtree, os.path.join(self.diretorio, str(user_id)), True)
+
+    # Escreve em `destino` (arquivo binário) o CSV com todo o histórico do
+    # usuário, arquivado e recente, em ordem cronológica; devolve o número de linhas
+    async def exportar(self, user_id, destino):
+        return await self.armazenamento.executar_leitura(lambda conexao: self._exportar(conexao, user_id, destino))
+
+    def _exportar(self, conexao, user_id, destino):
+        # Com o cursor aberto, a lista de meses vem da mesma leitura da tabela.
+        # Um mês arquivado de novo depois disso (linhas que voltaram à tabela
+        # após uma queda) tem o arquivo trocado e aparece nos dois lados; essas
+        # linhas são filtradas pelo rowid
+        cursor = conexao.execute('''
+        SELECT rowid, alimento, proteinas, carboidratos, gorduras, calorias, data_hora
+        FROM info_nutricional
+        WHERE user_id = ?
+        ORDER BY data_hora, rowid
+        ''', (user_id,))
+        recentes = iter(cursor)
+        proxima = next(recentes, None)
+        meses = [linha[0] for linha in conexao.execute(
+            'SELECT month FROM monthly_totals WHERE user_id = ? ORDER BY month', (user_id,)
+        )]
+
+        texto = io.TextIOWrapper(destino, encoding='utf-8', newline='', write_through=True)
+        escritor = csv.writer(texto)
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        total = 0
+
+        def escrever(linha):
+            escritor.writerow((linha[6], *linha[1:6]))
+
+        try:
+            for mes in meses:
+                inicio, fim = mes, _fim_do_mes(mes)
+                while proxima is not None and proxima[6] < inicio:
+                    escrever(proxima)
+                    total += 1
+                    proxima = next(recentes, None)
+
+                arquivados = set()
+                for linha in _ler_arquivo(self._caminho(user_id, mes)):
+                    escrever(linha)
+                    arquivados.add(linha[0])
+                    total += 1
+
+                while proxima is not None and proxima[6] < fim:
+                    if proxima[0] not in arquivados:
+                        escrever(proxima)
+                        total += 1
+                    proxima = next(recentes, None)
+
+            while proxima is not None:
+                escrever(proxima)
+                total += 1
+                proxima = next(recentes, None)
+        finally:
+            cursor.close()
+            # Devolve o arquivo de destino aberto para quem chamou
+            texto.detach()
+        return total
@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import types
+
+# Benchmark offline do bot: monta a Application de criar_aplicacao() contra
+# uma Bot API falsa (em memória) e uma OpenAI falsa, com latências
+# configuráveis, reproduz tráfego sintético (alimentos em texto, áudios,
+# /totais, /insights e o relatório diário para N usuários) e imprime em JSON
+# a vazão, os percentis de latência por handler, o tempo gasto no SQLite e o
+# pico de memória (RSS).
+#
+# Exemplo:
+#   python benchmark.py --usuarios 200 --acoes-por-usuario 10 --latencia-openai 0.5
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:benchmark')
+os.environ.setdefault('METRICAS_PORTA', '')
+os.environ.setdefault('LOG_NIVEL', 'WARNING')
+
+import openai
+from telegram import Update
+from telegram.request import BaseRequest
+
+import bot_telegram
+from admissao import ADMISSAO_RECUSADAS
+from reproduzir_atualizacoes import percentil
+
+ALIMENTOS = [
+    "2 bananas", "2 pães e um copo de café com leite", "100g de arroz, feijão e 1 bife",
+    "3 ovos", "um prato de estrogonofe", "1 coxinha e 1 coca", "meia xícara de aveia",
+    "suco de caju", "x-salada com batata", "tapioca de frango com catupiry", "1 pastel de palmito",
+]
+
+
+# Bot API falsa: responde a cada método com um resultado plausível após `latencia` segundos
+class ApiTelegramFalsa(BaseRequest):
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.chamadas = {}
+        self._proxima_mensagem = 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        if self.latencia:
+            await asyncio.sleep(self.latencia)
+
+        # Download de arquivo (áudio)
+        if '/file/bot' in url:
+            self.chamadas['download'] = self.chamadas.get('download', 0) + 1
+            return 200, b'OggS' + os.urandom(4 * 1024)
+
+        metodo = url.rsplit('/', 1)[-1]
+        self.chamadas[metodo] = self.chamadas.get(metodo, 0) + 1
+        parametros = request_data.parameters if request_data else {}
+        resultado = self._resultado(metodo, parametros)
+        return 200, json.dumps({'ok': True, 'result': resultado}).encode()
+
+    def _resultado(self, metodo, parametros):
+        if metodo == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if metodo == 'getFile':
+            return {
+                'file_id': parametros.get('file_id'), 'file_unique_id': parametros.get('file_id'),
+                'file_size': 4 * 1024 + 4, 'file_path': f"voice/{parametros.get('file_id')}.ogg",
+            }
+        if metodo.startswith('send') or metodo.startswith('edit'):
+            self._proxima_mensagem += 1
+            chat_id = parametros.get('chat_id', 0)
+            mensagem = {
+                'message_id': parametros.get('message_id', self._proxima_mensagem),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': parametros.get('text', ''),
+            }
+            if metodo == 'sendPhoto':
+                mensagem['photo'] = [{'file_id': f"foto{self._proxima_mensagem}", 'file_unique_id': f"f{self._proxima_mensagem}", 'width': 1, 'height': 1}]
+            if metodo == 'sendDocument':
+                mensagem['document'] = {'file_id': f"doc{self._proxima_mensagem}", 'file_unique_id': f"d{self._proxima_mensagem}"}
+            return mensagem
+        return True
+
+
+# OpenAI falsa: substitui ChatCompletion.acreate e Audio.atranscribe
+class OpenAIFalsa:
+    def __init__(self, latencia_chat=0.5, latencia_whisper=0.8):
+        self.latencia_chat = latencia_chat
+        self.latencia_whisper = latencia_whisper
+        self.chamadas = {'chat': 0, 'whisper': 0}
+
+    def instalar(self):
+        openai.ChatCompletion.acreate = self.chat
+        openai.Audio.atranscribe = self.transcrever
+
+    async def chat(self, model=None, messages=None, stream=False, **kwargs):
+        self.chamadas['chat'] += 1
+        if stream:
+            return self._transmitir()
+        await asyncio.sleep(self.latencia_chat)
+        prompt = messages[-1]['content']
+        if 'functions' in kwargs:
+            # Consulta de nutrientes: um item por linha numerada depois de "Itens:"
+            itens = prompt.split('Itens:\n', 1)[1].splitlines()
+            argumentos = json.dumps({'itens': [
+                {'numero': numero, 'reconhecido': True, 'proteinas': 3.5, 'carboidratos': 12.0,
+                 'gorduras': 1.2, 'calorias': 150, 'confianca': 'alta'}
+                for numero in range(1, len(itens) + 1)
+            ]})
+            mensagem = {'role': 'assistant', 'content': None,
+                        'function_call': {'name': kwargs['functions'][0]['name'], 'arguments': argumentos}}
+        else:
+            mensagem = {'role': 'assistant', 'content': "📊 Sua média de proteínas está boa! 💪\n\nTente reduzir um pouco os carboidratos à noite."}
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=mensagem)])
+
+    # Resposta em streaming: o primeiro pedaço sai após um décimo da latência e o
+    # restante se espalha pelo tempo que sobra
+    async def _transmitir(self):
+        pedacos = ["📊 Sua média ", "de *proteínas* ", "está boa! 💪\n\n", "Tente reduzir ", "um pouco os ", "carboidratos à noite."]
+        await asyncio.sleep(self.latencia_chat / 10)
+        for pedaco in pedacos:
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta={'content': pedaco})])
+            await asyncio.sleep(self.latencia_chat * 0.9 / len(pedacos))
+
+    async def transcrever(self, model, file, **kwargs):
+        self.chamadas['whisper'] += 1
+        file.read()
+        await asyncio.sleep(self.latencia_whisper)
+        return {'text': random.choice(ALIMENTOS)}
+
+
+# Mede o tempo gasto nas leituras e escritas do SQLite
+def medir_banco(armazenamento):
+    tempos = {'leitura': 0.0, 'escrita': 0.0, 'operacoes': 0}
+    executar_leitura, executar_escrita = armazenamento.executar_leitura, armazenamento.executar_escrita
+
+    async def leitura(funcao):
+        inicio = time.perf_counter()
+        try:
+            return await executar_leitura(funcao)
+        finally:
+            tempos['leitura'] += time.perf_counter() - inicio
+            tempos['operacoes'] += 1
+
+    async def escrita(funcao):
+        inicio = time.perf_counter()
+        try:
+            return await executar_escrita(funcao)
+        finally:
+            tempos['escrita'] += time.perf_counter() - inicio
+            tempos['operacoes'] += 1
+
+    armazenamento.executar_leitura, armazenamento.executar_escrita = leitura, escrita
+    return tempos
+
+
+class Trafego:
+    def __init__(self, application):
+        self.application = application
+        self._proximo_update = 1
+
+    def _update(self, dados):
+        dados['update_id'] = self._proximo_update
+        self._proximo_update += 1
+        return Update.de_json(dados, self.application.bot)
+
+    def _mensagem(self, user_id, **conteudo):
+        return {
+            'message_id': self._proximo_update,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Usuario{user_id}"},
+            **conteudo,
+        }
+
+    def texto(self, user_id, texto):
+        return self._update({'message': self._mensagem(user_id, text=texto)})
+
+    def comando(self, user_id, comando):
+        return self._update({'message': self._mensagem(
+            user_id, text=comando, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(comando)}]
+        )})
+
+    def voz(self, user_id, repetir=False):
+        file_id = 'voz-repetida' if repetir else f"voz-{user_id}-{self._proximo_update}"
+        return self._update({'message': self._mensagem(
+            user_id, voice={'file_id': file_id, 'file_unique_id': file_id, 'duration': 4, 'file_size': 4 * 1024 + 4}
+        )})
+
+    def confirmar(self, user_id):
+        return self._update({'callback_query': {
+            'id': str(self._proximo_update),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Usuario{user_id}"},
+            'chat_instance': str(user_id),
+            'data': 'sim',
+            'message': self._mensagem(user_id, text='confirmação'),
+        }})
+
+
+async def popular_ontem(armazenamento, usuarios, itens_por_usuario):
+    ontem = datetime.date.today() - datetime.timedelta(days=1)
+    data_hora = f"{ontem.isoformat()} 12:00:00"
+
+    def popular(conexao):
+        conexao.executemany('INSERT OR IGNORE INTO user_preferences (user_id) VALUES (?)', [(u,) for u in usuarios])
+        conexao.executemany('''
+        INSERT INTO info_nutricional (user_id, alimento, proteinas, carboidratos, gorduras, calorias, data_hora)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(u, random.choice(ALIMENTOS), 10, 20, 5, 165, data_hora) for u in usuarios for _ in range(itens_por_usuario)])
+        conexao.executemany('''
+        INSERT OR REPLACE INTO daily_totals (user_id, day, protein, carbs, fat, kcal, n_items)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(u, ontem.isoformat(), 10 * itens_por_usuario, 20 * itens_por_usuario, 5 * itens_por_usuario,
+               165 * itens_por_usuario, itens_por_usuario) for u in usuarios])
+
+    await armazenamento.executar_escrita(popular)
+
+
+async def executar(args):
+    random.seed(args.semente)
+    diretorio = tempfile.mkdtemp(prefix='bench-macrobot-')
+    bot_telegram.armazenamento.caminho = os.path.join(diretorio, 'nutricao.db')
+
+    api = ApiTelegramFalsa(args.latencia_telegram)
+    openai_falsa = OpenAIFalsa(args.latencia_openai, args.latencia_whisper)
+    openai_falsa.instalar()
+
+    application = bot_telegram.criar_aplicacao(com_updater=False, request=api)
+    await application.initialize()
+    await application.post_init(application)
+    tempos_banco = medir_banco(bot_telegram.armazenamento)
+
+    usuarios = list(range(1000, 1000 + args.usuarios))
+    await popular_ontem(bot_telegram.armazenamento, usuarios, args.itens_ontem)
+
+    trafego = Trafego(application)
+    latencias = {}
+    erros = []
+    semaforo = asyncio.Semaphore(args.concorrencia)
+
+    async def processar(tipo, update):
+        async with semaforo:
+            inicio = time.perf_counter()
+            try:
+                await application.process_update(update)
+            except Exception as e:
+                erros.append(f"{tipo}: {e}")
+            latencias.setdefault(tipo, []).append(time.perf_counter() - inicio)
+
+    async def simular_usuario(user_id):
+        await processar('start', trafego.comando(user_id, '/start'))
+        for _ in range(args.acoes_por_usuario):
+            sorteio = random.random()
+            if sorteio < 0.45:
+                await processar('texto', trafego.texto(user_id, random.choice(ALIMENTOS)))
+                await processar('confirmacao', trafego.confirmar(user_id))
+            elif sorteio < 0.60:
+                await processar('voz', trafego.voz(user_id, repetir=random.random() < 0.2))
+                await processar('confirmacao', trafego.confirmar(user_id))
+            elif sorteio < 0.85:
+                await processar('totais', trafego.comando(user_id, '/totais'))
+            else:
+                await processar('insights', trafego.comando(user_id, '/insights'))
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(simular_usuario(user_id) for user_id in usuarios))
+    duracao_trafego = time.perf_counter() - inicio
+
+    # Relatório diário para todos os usuários populados com o consumo de ontem
+    envios_antes = api.chamadas.get('sendMessage', 0)
+    inicio = time.perf_counter()
+    await bot_telegram.enviar_relatorio_diario(types.SimpleNamespace(bot=application.bot, application=application))
+    duracao_relatorio = time.perf_counter() - inicio
+
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    total_updates = sum(len(valores) for valores in latencias.values())
+    return {
+        "parametros": vars(args),
+        "updates": total_updates,
+        "duracao_s": round(duracao_trafego, 3),
+        "mensagens_por_s": round(total_updates / duracao_trafego, 1) if duracao_trafego else 0,
+        "latencia_ms": {
+            tipo: {
+                "n": len(valores),
+                "p50": round(percentil(valores, 50) * 1000, 2),
+                "p90": round(percentil(valores, 90) * 1000, 2),
+                "p99": round(percentil(valores, 99) * 1000, 2),
+                "max": round(max(valores) * 1000, 2),
+            }
+            for tipo, valores in sorted(latencias.items())
+        },
+        "relatorio_diario": {
+            "usuarios": len(usuarios),
+            "mensagens": api.chamadas.get('sendMessage', 0) - envios_antes,
+            "duracao_s": round(duracao_relatorio, 3),
+        },
+        "banco_s": {
+            "leitura": round(tempos_banco['leitura'], 3),
+            "escrita": round(tempos_banco['escrita'], 3),
+            "operacoes": tempos_banco['operacoes'],
+        },
+        "chamadas_telegram": api.chamadas,
+        "chamadas_openai": openai_falsa.chamadas,
+        "recusadas_admissao": {'/'.join(rotulos): int(valor) for rotulos, valor in ADMISSAO_RECUSADAS._valores.items()},
+        "erros": erros[:20],
+        "pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline do bot com Telegram e OpenAI falsos.")
+    parser.add_argument('--usuarios', type=int, default=100)
+    parser.add_argument('--acoes-por-usuario', type=int, default=5)
+    parser.add_argument('--itens-ontem', type=int, default=4, help="alimentos de ontem por usuário, para o relatório diário")
+    parser.add_argument('--concorrencia', type=int, default=50, help="atualizações processadas ao mesmo tempo")
+    parser.add_argument('--latencia-telegram', type=float, default=0.02)
+    parser.add_argument('--latencia-openai', type=float, default=0.5)
+    parser.add_argument('--latencia-whisper', type=float, default=0.8)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', help="grava o resultado JSON neste arquivo além de imprimir")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(executar(args))
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+    print(texto, file=sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
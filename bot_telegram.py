@@ -1,17 +1,44 @@
 import os
+import sys
+import asyncio
+import logging
 import openai
-import sqlite3
 import datetime
 import pytz
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+import tempfile
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, JobQueue
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
-
-print("bot em execução")
+from armazenamento import Armazenamento
+from arquivo_historico import ArquivoHistorico
+from cache_memoria import CacheMemoria
+from cache_nutrientes import CacheNutrientes, normalizar_alimento
+from agrupador_consultas import AgrupadorConsultas
+from edicao_progressiva import EdicaoProgressiva
+from motor_nutrientes import MotorNutrientes, Nutrientes
+from admissao import ControleAdmissao, FilaCheia, LimiteExcedido
+from alimentos import TabelaAlimentos, separar_itens
+from graficos import desenhar_grafico, montar_serie
+from relatorios import enviar_relatorios, montar_relatorio
+from transcricao import AudioInvalido, Transcritor
+from webhook import executar_webhook
+from persistencia import PersistenciaSQLite
+from supervisor import executar_supervisor, executar_trabalhador
+from servidor_http import ServidorHTTP
+from logs_estruturados import configurar_logs
+from metricas import Medidor, RequestInstrumentado, envolver_handlers, instrumentar_handler, medir, registro, rota_metricas
 
 # Carregar variáveis de ambiente do arquivo .env
 load_dotenv()
 
+# Logs estruturados em JSON (LOG_FORMATO=texto para leitura no terminal)
+configurar_logs(os.getenv('LOG_FORMATO', 'json'), os.getenv('LOG_NIVEL', 'INFO'))
+logger = logging.getLogger('bot_telegram')
+
+logger.info("bot em execução")
+
 # Definir o fuso horário (neste caso, UTC-3, representado por "America/Sao_Paulo")
 timezone_utc_3 = pytz.timezone("America/Sao_Paulo")
 
@@ -22,38 +49,78 @@ utc_now = datetime.datetime.now(pytz.utc)
 local_time = utc_now.astimezone(timezone_utc_3)
 
 # Imprimir a hora no fuso horário específico
-print("Hora atual em UTC-3:", local_time.strftime("%Y-%m-%d %H:%M:%S"))
+logger.info(f"Hora atual em UTC-3: {local_time.strftime('%Y-%m-%d %H:%M:%S')}")
 
 # Configurações das APIs
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
-# Conectar ao banco de dados SQLite
-conn = sqlite3.connect('nutricao.db')
-cursor = conn.cursor()
-
-# Criação das tabelas se elas não existirem
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS info_nutricional (
-    user_id INTEGER,
-    alimento TEXT,
-    proteinas REAL,
-    carboidratos REAL,
-    gorduras REAL,
-    calorias REAL,
-    data_hora TEXT
+# Modo de execução: "polling" (padrão) ou "webhook"; "trabalhador" é usado pelo supervisor
+MODO_BOT = os.getenv('MODO_BOT', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORTA = int(os.getenv('WEBHOOK_PORTA', '8443'))
+WEBHOOK_CAMINHO = os.getenv('WEBHOOK_CAMINHO', '/webhook')
+WEBHOOK_SEGREDO = os.getenv('WEBHOOK_SEGREDO')
+WEBHOOK_GRAVAR = os.getenv('WEBHOOK_GRAVAR')
+
+# Quantas atualizações são processadas ao mesmo tempo, quantas delas podem usar
+# os modelos da OpenAI e quantas podem esperar na fila de admissão
+ATUALIZACOES_CONCORRENTES = int(os.getenv('ATUALIZACOES_CONCORRENTES', '16'))
+LLM_CONCORRENTES = int(os.getenv('LLM_CONCORRENTES', '4'))
+FILA_ADMISSAO = int(os.getenv('FILA_ADMISSAO', '64'))
+
+# Chamadas aos modelos por usuário (respostas da tabela local e dos caches não
+# contam): média por minuto e rajada máxima
+LIMITE_USUARIO_POR_MINUTO = float(os.getenv('LIMITE_USUARIO_POR_MINUTO', '12'))
+LIMITE_USUARIO_RAJADA = int(os.getenv('LIMITE_USUARIO_RAJADA', '5'))
+
+# Com TRABALHADORES > 1, um supervisor distribui os usuários entre vários processos
+TRABALHADORES = int(os.getenv('TRABALHADORES', '1'))
+TRABALHADOR_INDICE = int(os.getenv('TRABALHADOR_INDICE', '0'))
+
+# Endpoint de métricas no formato do Prometheus (METRICAS_PORTA vazio desliga)
+METRICAS_HOST = os.getenv('METRICAS_HOST', '127.0.0.1')
+METRICAS_PORTA = os.getenv('METRICAS_PORTA', '9464')
+
+# Banco de dados SQLite, acessado fora do event loop pela camada de armazenamento
+armazenamento = Armazenamento('nutricao.db')
+
+# Alimentos de meses inteiros anteriores aos últimos RETENCAO_DIAS dias saem
+# do banco e vão para CSVs comprimidos em ARQUIVO_HISTORICO
+arquivo_historico = ArquivoHistorico(
+    armazenamento,
+    os.getenv('ARQUIVO_HISTORICO', 'arquivo_historico'),
+    retencao_dias=int(os.getenv('RETENCAO_DIAS', '90')),
 )
-''')
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS user_preferences (
-    user_id INTEGER PRIMARY KEY,
-    receber_relatorio INTEGER DEFAULT 1
+
+# Conversas pendentes e user_data gravados no SQLite a cada PERSISTENCIA_INTERVALO
+# segundos; usuários sem mensagens há USUARIOS_TEMPO_OCIOSO segundos saem da memória
+persistencia = PersistenciaSQLite(
+    armazenamento,
+    intervalo=float(os.getenv('PERSISTENCIA_INTERVALO', '5')),
+    tempo_ocioso=float(os.getenv('USUARIOS_TEMPO_OCIOSO', '1800')),
 )
-''')
-conn.commit()
+
+# Cache das respostas de nutrientes, para não consultar o GPT-4 a cada repetição do mesmo alimento
+cache_nutrientes = CacheNutrientes(armazenamento)
+
+# Insights já gerados, por (usuário, dia, versão dos dados)
+cache_insights = CacheMemoria(capacidade=4096)
+
+# Gráficos do /grafico por (usuário, dia, período, versão dos dados): o PNG e,
+# depois do primeiro envio, o file_id da foto no Telegram
+cache_graficos = CacheMemoria(capacidade=512)
+PERIODOS_GRAFICO = (7, 30, 90)
+
+# Transcrição dos áudios com Whisper, em memória e com concorrência limitada
+transcritor = Transcritor()
+
+# Tabela local de alimentos; o ChatGPT só é consultado para os itens que não estão nela
+tabela_alimentos = TabelaAlimentos.carregar(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'alimentos_taco.csv'))
 
 # Estados para a conversa
-ADICIONAR_ALIMENTO = range(1)
+ADICIONAR_ALIMENTO, = range(1)
 
 # Mensagem de ajuda
 mensagem_ajuda = (
@@ -71,47 +138,30 @@ mensagem_help = (
     "/pararrelatorio - Pare de receber relatórios diários. Use este comando se não quiser mais receber atualizações automáticas sobre o seu consumo do dia anterior.\n\n"
     "/voltarrelatorio - Volte a receber relatórios diários. Se você parou de receber relatórios diários e quer voltar a recebê-los, use este comando.\n\n"
     "/enviarrelatorio - Solicite manualmente o envio do relatório nutricional. Isso pode ser útil para revisar seu consumo sem esperar pelo horário agendado.\n\n"
+    "/exportar - Receba um arquivo CSV com todo o seu histórico de alimentos, incluindo os meses mais antigos.\n\n"
+    "/grafico - Receba um gráfico com a evolução das calorias e dos macronutrientes por dia. Informe o período em dias: `/grafico 7`, `/grafico 30` (padrão) ou `/grafico 90`.\n\n"
     "/insights - Receba insights sobre seu desempenho na dieta, baseado nos seus dados históricos e na média dos demais usuários.\n\n"
     "/help - Exibe esta mensagem com a lista completa de comandos e descrições detalhadas sobre como usar cada funcionalidade do bot."
 )
 
 # Função para fornecer insights sobre o desempenho na dieta
-def calcular_media_geral(usuario_id):
-    cursor.execute('''
-    SELECT AVG(proteinas), AVG(carboidratos), AVG(gorduras), AVG(calorias)
-    FROM info_nutricional
-    WHERE user_id = ?
-    ''', (usuario_id,))
-    return cursor.fetchone()
-
-def calcular_media_geral(usuario_id):
-    cursor.execute('''
-    SELECT AVG(proteinas), AVG(carboidratos), AVG(gorduras), AVG(calorias)
-    FROM info_nutricional
-    WHERE user_id = ?
-    ''', (usuario_id,))
-    return cursor.fetchone()
-
-def calcular_media_periodo(usuario_id, dias):
-    cursor.execute('''
-    SELECT AVG(proteinas), AVG(carboidratos), AVG(gorduras), AVG(calorias)
-    FROM info_nutricional
-    WHERE user_id = ? AND DATE(data_hora) >= DATE('now', ? || ' days')
-    ''', (usuario_id, -dias))
-    return cursor.fetchone()
-
 async def gerar_insights(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("Analisando seu histórico...")
-    
     user_id = update.message.from_user.id
-    media_usuario = calcular_media_geral(user_id)
-    media_ultima_semana = calcular_media_periodo(user_id, 7)
-    media_ultimo_mes = calcular_media_periodo(user_id, 30)
-
-    if media_usuario and media_ultima_semana and media_ultimo_mes:
-        proteinas_user, carboidratos_user, gorduras_user, calorias_user = media_usuario
-        proteinas_semana, carboidratos_semana, gorduras_semana, calorias_semana = media_ultima_semana
-        proteinas_mes, carboidratos_mes, gorduras_mes, calorias_mes = media_ultimo_mes
+    medias = await armazenamento.calcular_medias_diarias(user_id)
+
+    if medias:
+        # O insight só muda quando o dia vira ou quando o usuário registra/reseta algo
+        chave_insight = (user_id, datetime.date.today().isoformat(), medias['versao'])
+        # Guardado como foi exibido: já cortado e com o parse_mode que o Telegram aceitou
+        insight_guardado = cache_insights.obter(chave_insight)
+        if insight_guardado is not None:
+            mensagem_insight, parse_mode = insight_guardado
+            await update.message.reply_text(mensagem_insight, parse_mode=parse_mode)
+            return
+
+        proteinas_user, carboidratos_user, gorduras_user, calorias_user = medias['geral']
+        proteinas_semana, carboidratos_semana, gorduras_semana, calorias_semana = medias['semana']
+        proteinas_mes, carboidratos_mes, gorduras_mes, calorias_mes = medias['mes']
 
         # Gerando um insight dinâmico usando a OpenAI API
         prompt = (
@@ -139,16 +189,30 @@ async def gerar_insights(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             f"Escreva o texto como se fosse uma mensagem para o whatsapp, pulando linhas para ficar mais organizado"
         )
 
-        try:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}]
-            )
-            mensagem_insight = response.choices[0].message['content'].strip()
-        except Exception as e:
-            mensagem_insight = f"Erro ao gerar o insight: {e}"
-
-        await update.message.reply_text(mensagem_insight, parse_mode='Markdown')
+        # A resposta chega em streaming e vai aparecendo na mensagem "Analisando...",
+        # editada no máximo uma vez por segundo; o Markdown entra só na última edição
+        async with controle_admissao.chamada_modelo(user_id):
+            mensagem = await update.message.reply_text("Analisando seu histórico...")
+            edicao = EdicaoProgressiva(mensagem, intervalo=1.0)
+            try:
+                async with medir('openai', 'insights'):
+                    response = await openai.ChatCompletion.acreate(
+                        model="gpt-4",
+                        messages=[{"role": "user", "content": prompt}],
+                        stream=True,
+                    )
+                    async for pedaco in response:
+                        edicao.acrescentar(pedaco.choices[0].delta.get('content') or '')
+                mensagem_insight = edicao.texto.strip()
+                gerado = True
+            except Exception as e:
+                logger.exception("Erro ao gerar o insight")
+                mensagem_insight = f"Erro ao gerar o insight: {e}"
+                gerado = False
+
+        exibido = await edicao.finalizar(mensagem_insight)
+        if gerado and exibido is not None:
+            cache_insights.guardar(chave_insight, exibido)
     else:
         await update.message.reply_text("Ainda não há dados suficientes para fornecer um insight sobre sua dieta.")
 
@@ -160,92 +224,139 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_name = update.message.from_user.first_name
     user_id = update.message.from_user.id
-    print(user_name)
+    logger.info("Novo usuário", extra={"user_id": user_id, "nome": user_name})
 
     # Adicionar usuário na tabela de preferências se ainda não estiver registrado
-    cursor.execute('INSERT OR IGNORE INTO user_preferences (user_id) VALUES (?)', (user_id,))
-    conn.commit()
+    await armazenamento.registrar_usuario(user_id)
 
     await update.message.reply_text(f"Olá, *{user_name}* {mensagem_ajuda}", parse_mode='Markdown')
 
-# Função para consultar o ChatGPT sobre macronutrientes de alimentos
-async def consultar_chatgpt_nutrientes(alimento):
-    try:
-        prompt = (
-            "Forneça apenas uma resposta numérica direta contendo os valores de proteínas, carboidratos, gorduras e calorias para o alimento informado, separados por espaços, sem qualquer outra explicação. "
-            "Por exemplo: '3.5 12.0 1.2 150' (proteínas carboidratos gorduras calorias)."
-            "Se você não reconhecer o alimento, responda com a seguinte mensagem: "
-            f"'{mensagem_ajuda}' Apenas forneça os valores de proteínas, carboidratos, gorduras e calorias para os alimentos conhecidos.\n\n"
-            f"Nutrientes para: {alimento}"
-        )
+# Escada de modelos para os nutrientes, do mais barato ao mais capaz, no formato
+# "modelo:prazo em segundos,..."; NUTRIENTES_HEDGE=0 desliga a requisição extra após o p95
+MODELOS_NUTRIENTES = [
+    (modelo, float(prazo))
+    for modelo, prazo in (degrau.split(':') for degrau in os.getenv('MODELOS_NUTRIENTES', 'gpt-3.5-turbo:8,gpt-4:20').split(','))
+]
+motor_nutrientes = MotorNutrientes(MODELOS_NUTRIENTES, hedge=os.getenv('NUTRIENTES_HEDGE', '1') == '1')
+
+# Função para gravar no cache as respostas de um lote de alimentos, uma única vez
+# por alimento, mesmo que vários usuários estejam esperando; roda depois de as
+# respostas serem entregues, e uma falha no cache só vai para o log
+async def guardar_nutrientes(alimentos, resultados):
+    respondidos = [(alimento, nutrientes) for alimento, nutrientes in zip(alimentos, resultados) if nutrientes is not None]
+    gravacoes = await asyncio.gather(
+        *(cache_nutrientes.guardar(alimento, nutrientes.como_texto()) for alimento, nutrientes in respondidos),
+        return_exceptions=True,
+    )
+    for (alimento, _), erro in zip(respondidos, gravacoes):
+        if isinstance(erro, Exception):
+            logger.error("Erro ao gravar no cache de nutrientes", exc_info=erro, extra={"alimento": alimento})
+
+# Consultas simultâneas aos modelos: iguais viram uma só e diferentes seguem em
+# lotes de até 8 alimentos reunidos em uma janela de 50 ms
+agrupador_nutrientes = AgrupadorConsultas(
+    'nutrientes', motor_nutrientes.consultar_lote, normalizar_alimento,
+    janela=0.05, tamanho_maximo=8, guardar=guardar_nutrientes,
+)
 
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-4",
-            messages=[{"role": "user", "content": prompt}]
-        )
+# Função para obter do cache os nutrientes de um alimento (ou None)
+async def nutrientes_em_cache(alimento):
+    nutrientes_response = await cache_nutrientes.obter(alimento)
+    return Nutrientes.de_texto(nutrientes_response) if nutrientes_response is not None else None
+
+# Função para calcular os nutrientes de cada item da mensagem: primeiro na
+# tabela local, depois no cache e, só para o que faltar, no ChatGPT, cobrando
+# a consulta do limite do usuário
+async def calcular_itens(mensagem, user_id):
+    partes = separar_itens(mensagem)
+    itens = [tabela_alimentos.calcular(parte) for parte in partes]
+
+    # Se nada foi reconhecido localmente, a mensagem inteira vai ao modelo, como antes
+    if not any(itens):
+        partes, itens = [mensagem], [None]
+
+    pendentes = [parte for parte, item in zip(partes, itens) if item is None]
+    respostas = dict(zip(pendentes, await asyncio.gather(*(nutrientes_em_cache(parte) for parte in pendentes))))
+    faltando = [parte for parte in pendentes if respostas[parte] is None]
+    if faltando:
+        async with controle_admissao.chamada_modelo(user_id):
+            respostas.update(zip(faltando, await asyncio.gather(*(agrupador_nutrientes.consultar(parte) for parte in faltando))))
+
+    reconhecidos, nao_reconhecidos = [], []
+    for parte, item in zip(partes, itens):
+        if item is None:
+            nutrientes = respostas[parte]
+            if nutrientes is None:
+                nao_reconhecidos.append(parte)
+                continue
+            item = nutrientes.como_item(parte)
+        reconhecidos.append(item)
+    return reconhecidos, nao_reconhecidos
+
+def somar_itens(itens):
+    return {
+        nutriente: sum(item[nutriente] for item in itens)
+        for nutriente in ("proteinas", "carboidratos", "gorduras", "calorias")
+    }
+
+# Função para mostrar os nutrientes calculados e perguntar se devem ser adicionados
+async def responder_nutrientes(update: Update, context: ContextTypes.DEFAULT_TYPE, alimento) -> int:
+    itens, nao_reconhecidos = await calcular_itens(alimento, update.message.from_user.id)
+
+    if not itens:
+        await update.message.reply_text("Uhm, não entendi, poderia me explicar melhor?")
+        return ConversationHandler.END
+
+    mensagem = f"{alimento}\n\n"
+    if len(itens) > 1:
+        for item in itens:
+            mensagem += (
+                f"- {item['alimento']}: Proteínas: {item['proteinas']:.2f} g, Carboidratos: {item['carboidratos']:.2f} g, "
+                f"Gorduras: {item['gorduras']:.2f} g, Calorias: {item['calorias']:.2f} kcal\n"
+            )
+        mensagem += "\n"
+    if nao_reconhecidos:
+        mensagem += f"Não reconheci: {', '.join(nao_reconhecidos)}\n\n"
+
+    totais = somar_itens(itens)
+    mensagem += (
+        f"Proteínas: {totais['proteinas']:.2f} g\nCarboidratos: {totais['carboidratos']:.2f} g\n"
+        f"Gorduras: {totais['gorduras']:.2f} g\nCalorias: {totais['calorias']:.2f} kcal\n\n"
+        f"Gostaria de adicionar este alimento ao total diário?"
+    )
+
+    reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton('Sim', callback_data='sim'), InlineKeyboardButton('Não', callback_data='nao')]])
+    await update.message.reply_text(mensagem, reply_markup=reply_markup)
 
-        return response.choices[0].message['content'].strip()
-    except Exception as e:
-        print(f"Erro ao consultar ChatGPT: {e}")
-        return mensagem_ajuda
-
-# Função para transcrever áudio com Whisper
-async def transcrever_audio(audio_path):
-    try:
-        with open(audio_path, "rb") as audio_file:
-            response = await openai.Audio.atranscribe("whisper-1", audio_file)
-            return response['text']
-    except Exception as e:
-        print(f"Erro ao transcrever áudio: {e}")
-        return "Erro ao transcrever áudio."
+    context.user_data['itens'] = itens
+    context.user_data['alimento'] = alimento
+    return ADICIONAR_ALIMENTO
 
 # Função para adicionar informações nutricionais dinamicamente
 async def adicionar_info_nutricional(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    user_id = update.message.from_user.id
-
     if update.message.voice:
         try:
-            # Baixa o áudio e transcreve para identificar o alimento
-            voice_file = await update.message.voice.get_file()
-            audio_path = f"{voice_file.file_id}.ogg"
-            await voice_file.download_to_drive(audio_path)
-            print("Áudio baixado para transcrição")
-
-            # Transcreve o áudio para texto
-            alimento = await transcrever_audio(audio_path)
-            print(f"Áudio transcrito: {alimento}")
-
-            nutrientes_response = await consultar_chatgpt_nutrientes(alimento)
-            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton('Sim', callback_data='sim'), InlineKeyboardButton('Não', callback_data='nao')]])
-            await update.message.reply_text(f"{alimento}\n\nProteínas: {nutrientes_response.split()[0]} g\nCarboidratos: {nutrientes_response.split()[1]} g\nGorduras: {nutrientes_response.split()[2]} g\nCalorias: {nutrientes_response.split()[3]} kcal\n\nGostaria de adicionar este alimento ao total diário?", reply_markup=reply_markup)
-            context.user_data['nutrientes_response'] = nutrientes_response
-            context.user_data['alimento'] = alimento
-            return ADICIONAR_ALIMENTO
-        except Exception as e:
-            print(f"Erro ao processar áudio: {e}")
+            # Baixa o áudio em memória e transcreve para identificar o alimento;
+            # a chamada só é cobrada do usuário se o áudio for mesmo ao Whisper
+            alimento = await transcritor.transcrever(update.message.voice, controle_admissao.chamada_modelo(update.message.from_user.id))
+            logger.info("Áudio transcrito", extra={"alimento": alimento})
+
+            return await responder_nutrientes(update, context, alimento)
+        except AudioInvalido as e:
+            await update.message.reply_text(str(e))
+        except (LimiteExcedido, FilaCheia):
+            # Respondido pela admissão
+            raise
+        except Exception:
+            logger.exception("Erro ao processar áudio")
             await update.message.reply_text("Erro ao processar o áudio.")
 
     else:
         # Processa mensagens de texto como antes
         message = update.message.text
 
-        print(message)
-        nutrientes_response = await consultar_chatgpt_nutrientes(message)
-
-        if mensagem_ajuda in nutrientes_response:
-            await update.message.reply_text("Uhm, não entendi, poderia me explicar melhor?")
-            return ConversationHandler.END
-
-        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton('Sim', callback_data='sim'), InlineKeyboardButton('Não', callback_data='nao')]])
-
-        await update.message.reply_text(
-            f"{message}\n\nProteínas: {nutrientes_response.split()[0]} g\nCarboidratos: {nutrientes_response.split()[1]} g\nGorduras: {nutrientes_response.split()[2]} g\nCalorias: {nutrientes_response.split()[3]} kcal\n\nGostaria de adicionar este alimento ao total diário?",
-            reply_markup=reply_markup
-        )
-        
-        context.user_data['nutrientes_response'] = nutrientes_response
-        context.user_data['alimento'] = message
-        return ADICIONAR_ALIMENTO
+        logger.info("Mensagem recebida", extra={"alimento": message})
+        return await responder_nutrientes(update, context, message)
 
 # Função para processar a resposta do usuário sobre adicionar alimento
 async def adicionar_ao_total(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -256,91 +367,55 @@ async def adicionar_ao_total(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     if resposta == 'sim':
         try:
-            nutrientes_response = context.user_data['nutrientes_response']
-            proteinas, carboidratos, gorduras, calorias = map(float, nutrientes_response.split())
+            itens = context.user_data['itens']
+            totais = somar_itens(itens)
 
-            # Salvar os dados no banco de dados com as calorias e a data/hora
-            salvar_info_nutricional(user_id, context.user_data['alimento'], proteinas, carboidratos, gorduras, calorias)
+            # Salvar os dados no banco de dados, um registro por item, com as calorias e a data/hora
+            await armazenamento.salvar_itens(user_id, itens)
 
             await query.edit_message_text(
                 f"✅ *{context.user_data['alimento']}* - Informação Nutricional adicionada ao total diário:\n\n"
-                f"*Proteínas*: {proteinas:.2f} g\n"
-                f"*Carboidratos*: {carboidratos:.2f} g\n"
-                f"*Gorduras*: {gorduras:.2f} g\n\n"
-                f"*Calorias*: {calorias:.2f} kcal"
+                f"*Proteínas*: {totais['proteinas']:.2f} g\n"
+                f"*Carboidratos*: {totais['carboidratos']:.2f} g\n"
+                f"*Gorduras*: {totais['gorduras']:.2f} g\n\n"
+                f"*Calorias*: {totais['calorias']:.2f} kcal"
                 , parse_mode='Markdown'
             )
-        except ValueError:
+        except KeyError:
             await query.edit_message_text("Erro ao interpretar os nutrientes. Por favor, tente novamente.")
     else:
         await query.edit_message_text("Ok, o alimento não foi adicionado ao total diário.")
 
+    # A confirmação terminou; não há por que manter os itens no user_data persistido
+    context.user_data.pop('itens', None)
+    context.user_data.pop('alimento', None)
     return ConversationHandler.END
 
 # Função para resetar informações nutricionais
 async def reset_info_nutricional(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    cursor.execute('DELETE FROM info_nutricional WHERE user_id = ?', (user_id,))
-    conn.commit()
+    await armazenamento.resetar_info_nutricional(user_id)
+    await arquivo_historico.apagar(user_id)
     await update.message.reply_text("🔄 Suas informações nutricionais foram resetadas para zero. Comece novamente!")
 
 # Função para parar de receber relatórios diários
 async def parar_relatorio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    cursor.execute('UPDATE user_preferences SET receber_relatorio = 0 WHERE user_id = ?', (user_id,))
-    conn.commit()
+    await armazenamento.definir_relatorio(user_id, False)
     await update.message.reply_text("🔕 Você não receberá mais os relatórios diários.\n\n"
                                     "Caso mude de ideia, use o comando /voltarrelatorio para voltar a receber")
 
 # Função para voltar a receber relatórios diários
 async def voltar_relatorio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
-    cursor.execute('UPDATE user_preferences SET receber_relatorio = 1 WHERE user_id = ?', (user_id,))
-    conn.commit()
+    await armazenamento.definir_relatorio(user_id, True)
     await update.message.reply_text("🔔 Você voltará a receber os relatórios diários.")
 
-# Função para consultar o total diário do usuário
-def consultar_totais_diarios(user_id, data_consulta):
-    # Consulta SQL para obter todos os alimentos consumidos na data fornecida
-    cursor.execute('''
-    SELECT alimento, proteinas, carboidratos, gorduras, calorias, data_hora
-    FROM info_nutricional
-    WHERE user_id = ? AND DATE(data_hora) = ?
-    ''', (user_id, data_consulta))
-    alimentos_consumidos = cursor.fetchall()
-
-    # Consulta SQL para somar os nutrientes consumidos na data fornecida
-    cursor.execute('''
-    SELECT SUM(proteinas), SUM(carboidratos), SUM(gorduras), SUM(calorias)
-    FROM info_nutricional
-    WHERE user_id = ? AND DATE(data_hora) = ?
-    ''', (user_id, data_consulta))
-    resultado = cursor.fetchone()
-    
-    # Se houver algum resultado, retorna os valores, caso contrário, retorna 0 para cada nutriente
-    totais = {
-        "proteinas": resultado[0] or 0,
-        "carboidratos": resultado[1] or 0,
-        "gorduras": resultado[2] or 0,
-        "calorias": resultado[3] or 0
-    }
-    
-    return alimentos_consumidos, totais
-
-# Função para salvar informações nutricionais no banco de dados
-def salvar_info_nutricional(user_id, alimento, proteinas, carboidratos, gorduras, calorias):
-    data_hora_atual = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute('''
-    INSERT INTO info_nutricional (user_id, alimento, proteinas, carboidratos, gorduras, calorias, data_hora)
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, alimento, proteinas, carboidratos, gorduras, calorias, data_hora_atual))
-    conn.commit()
-
 # Função para mostrar totais diários ao usuário
 async def mostrar_totais_diarios(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
     data_atual = datetime.datetime.now().strftime("%Y-%m-%d")
-    alimentos_consumidos, totais = consultar_totais_diarios(user_id, data_atual)
+    alimentos_consumidos, totais = await armazenamento.consultar_totais_diarios(user_id, data_atual)
 
     if alimentos_consumidos:
         mensagem_alimentos = "🍽️ Alimentos consumidos hoje:\n"
@@ -361,37 +436,92 @@ async def mostrar_totais_diarios(update: Update, context: ContextTypes.DEFAULT_T
         , parse_mode='Markdown'
     )
 
+# Função para exportar todo o histórico do usuário em CSV. O arquivo é montado
+# em disco (a partir de 1 MB) e enviado sem ser lido inteiro para a memória
+async def exportar_historico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.message.from_user.id
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as arquivo:
+        linhas = await arquivo_historico.exportar(user_id, arquivo)
+        if not linhas:
+            await update.message.reply_text("Você ainda não tem alimentos registrados para exportar.")
+            return
+        arquivo.seek(0)
+        await update.message.reply_document(
+            InputFile(arquivo, filename=f"historico_{datetime.date.today().isoformat()}.csv", read_file_handle=False),
+            caption=f"📄 Seu histórico completo: {linhas} alimentos registrados.",
+        )
+
+# Função para enviar o gráfico de tendência dos últimos 7, 30 ou 90 dias. Enquanto
+# os dados não mudam, o gráfico não é redesenhado nem reenviado: basta o file_id
+async def enviar_grafico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = update.message.from_user.id
+    periodos = {str(periodo): periodo for periodo in PERIODOS_GRAFICO}
+    dias = periodos.get(context.args[0]) if context.args else 30
+    if dias is None or len(context.args) > 1:
+        await update.message.reply_text("Use `/grafico 7`, `/grafico 30` ou `/grafico 90`.", parse_mode='Markdown')
+        return
+
+    hoje = datetime.date.today()
+    legenda = f"📈 Seus últimos {dias} dias"
+    versao = await armazenamento.versao_dados(user_id)
+    grafico = cache_graficos.obter((user_id, hoje.isoformat(), dias, versao))
+    if grafico and grafico.get("file_id"):
+        try:
+            await update.message.reply_photo(grafico["file_id"], caption=legenda)
+            return
+        except BadRequest:
+            logger.warning("file_id do gráfico recusado; reenviando a imagem")
+
+    if grafico is None:
+        linhas, versao = await armazenamento.consultar_serie_diaria(user_id, (hoje - datetime.timedelta(days=dias - 1)).isoformat())
+        if not linhas:
+            await update.message.reply_text(f"Você não registrou alimentos nos últimos {dias} dias.")
+            return
+        datas, serie = montar_serie(linhas, hoje, dias)
+        # O desenho é CPU puro; roda fora do event loop
+        png = await asyncio.get_running_loop().run_in_executor(
+            None, desenhar_grafico, datas, serie, f"Últimos {dias} dias ({datas[0]:%d/%m} a {datas[-1]:%d/%m})"
+        )
+        grafico = {"png": png}
+        cache_graficos.guardar((user_id, hoje.isoformat(), dias, versao), grafico)
+
+    mensagem = await update.message.reply_photo(grafico["png"], caption=legenda, filename=f"grafico_{dias}d.png")
+    grafico["file_id"] = mensagem.photo[-1].file_id
+
+# Função para arquivar os meses fora da janela de retenção
+async def compactar_historico(context: ContextTypes.DEFAULT_TYPE):
+    resumo = await arquivo_historico.compactar()
+    logger.info("Compactação do histórico", extra=resumo)
+
+# Horário do relatório diário
+HORARIO_RELATORIO = datetime.time(hour=8, minute=0, second=0)
+
 # Função para enviar relatório diário para todos os usuários
 async def enviar_relatorio_diario(context: ContextTypes.DEFAULT_TYPE):
+    hoje = datetime.datetime.now(timezone_utc_3).date().isoformat()
     data_anterior = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-    cursor.execute('SELECT DISTINCT user_id FROM user_preferences WHERE receber_relatorio = 1')
-    usuarios = cursor.fetchall()
-
-    for usuario in usuarios:
-        user_id = usuario[0]
-        alimentos_consumidos, totais = consultar_totais_diarios(user_id, data_anterior)
-
-        if alimentos_consumidos:
-            mensagem_alimentos = "📊 Relatório do consumo de ontem:\n"
-            for alimento in alimentos_consumidos:
-                mensagem_alimentos += (
-                    f"- {alimento[0]}: Proteínas: {alimento[1]:.2f} g, Carboidratos: {alimento[2]:.2f} g, Gorduras: {alimento[3]:.2f} g, Calorias: {alimento[4]:.2f} kcal\n"
-                )
-            await context.bot.send_message(chat_id=user_id, text=mensagem_alimentos)
-        else:
-            await context.bot.send_message(chat_id=user_id, text="Você não consumiu nenhum alimento ontem.")
-
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=(
-                f"🔢 Total consumido ontem:\n"
-                f"Proteínas: {totais['proteinas']:.2f} g\n"
-                f"Carboidratos: {totais['carboidratos']:.2f} g\n"
-                f"Gorduras: {totais['gorduras']:.2f} g\n"
-                f"Calorias: {totais['calorias']:.2f} kcal"  
-                f"Se desejar parar de receber relatórios diários, use o comando /pararrelatorio."
-            )
-        )
+    relatorios = await armazenamento.consultar_relatorios_do_dia(data_anterior)
+
+    mensagens = {
+        user_id: montar_relatorio(alimentos_consumidos, totais, "Se desejar parar de receber relatórios diários, use o comando /pararrelatorio.")
+        for user_id, (alimentos_consumidos, totais) in relatorios.items()
+    }
+    resumo = await enviar_relatorios(context.bot, mensagens)
+    await armazenamento.registrar_execucao('relatorio_diario', hoje)
+    logger.info(f"Relatório diário de {data_anterior}", extra=resumo)
+
+# Função para enviar, na subida do processo, o relatório do dia que não saiu
+# porque o processo estava parado ou reiniciando no horário agendado
+async def recuperar_relatorio_diario(context: ContextTypes.DEFAULT_TYPE):
+    agora = datetime.datetime.now(timezone_utc_3)
+    if agora.time() < HORARIO_RELATORIO:
+        return
+    ultima = await armazenamento.ultima_execucao('relatorio_diario')
+    # Sem registro (primeira subida com esta versão) não há como saber se já saiu
+    if ultima is None or ultima >= agora.date().isoformat():
+        return
+    logger.warning("Relatório diário não enviado no horário; enviando agora", extra={"ultimo_envio": ultima})
+    await enviar_relatorio_diario(context)
 
 # Função de comando para enviar o relatório manualmente
 async def enviar_relatorio_manual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -399,35 +529,89 @@ async def enviar_relatorio_manual(update: Update, context: ContextTypes.DEFAULT_
     data_anterior = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
     
     # Consultar os totais de nutrientes do usuário para o dia anterior
-    alimentos_consumidos, totais = consultar_totais_diarios(user_id, data_anterior)
-
-    if alimentos_consumidos:
-        mensagem_alimentos = "📊 Relatório do consumo de ontem:\n"
-        for alimento in alimentos_consumidos:
-            mensagem_alimentos += (
-                f"- {alimento[0]}: Proteínas: {alimento[1]:.2f} g, Carboidratos: {alimento[2]:.2f} g, Gorduras: {alimento[3]:.2f} g, Calorias: {alimento[4]:.2f} kcal\n"
-            )
-        await update.message.reply_text(mensagem_alimentos)
-    else:
-        await update.message.reply_text("Você não consumiu nenhum alimento ontem.")
-
-    await update.message.reply_text(
-        text=(
-            f"🔢 Total consumido ontem:\n"
-            f"Proteínas: {totais['proteinas']:.2f} g\n"
-            f"Carboidratos: {totais['carboidratos']:.2f} g\n"
-            f"Gorduras: {totais['gorduras']:.2f} g\n"
-            f"Calorias: {totais['calorias']:.2f} kcal"
-        )
-    )
+    alimentos_consumidos, totais = await armazenamento.consultar_totais_diarios(user_id, data_anterior)
+
+    await update.message.reply_text(montar_relatorio(alimentos_consumidos, totais))
+
+# Admissão dos handlers: vagas de execução para todos, vagas limitadas (por
+# processo) nas chamadas ao Whisper/ChatGPT e limite por usuário nessas chamadas
+controle_admissao = ControleAdmissao(
+    vagas=ATUALIZACOES_CONCORRENTES,
+    vagas_llm=LLM_CONCORRENTES,
+    limite_fila=FILA_ADMISSAO,
+    taxa_usuario=LIMITE_USUARIO_POR_MINUTO / 60,
+    capacidade_usuario=LIMITE_USUARIO_RAJADA,
+    mensagem_ocupado="⏳ Estou com muitas solicitações agora. Tente novamente em alguns instantes.",
+    mensagem_limite="⏳ Você enviou muitas mensagens seguidas. Aguarde um pouco e tente novamente.",
+)
 
-def main():
+# Função para tirar da memória os usuários ociosos
+async def despejar_usuarios_ociosos(context: ContextTypes.DEFAULT_TYPE):
+    despejados = persistencia.despejar_ociosos(context.application)
+    if despejados:
+        logger.info("Usuários ociosos removidos da memória", extra={"despejados": despejados, "em_memoria": persistencia.usuarios_em_memoria()})
+
+# Estatísticas do cache de nutrientes, atualizadas a cada leitura das métricas
+CACHE_NUTRIENTES = Medidor(registro, 'macrobot_cache_nutrientes', 'Acertos, faltas e itens do cache de nutrientes.', ['tipo'])
+USUARIOS_EM_MEMORIA = Medidor(registro, 'macrobot_usuarios_em_memoria', 'Usuários com user_data carregado em memória.')
+
+def coletar_cache_nutrientes():
+    for tipo, valor in cache_nutrientes.estatisticas().items():
+        CACHE_NUTRIENTES.definir(valor, tipo)
+    USUARIOS_EM_MEMORIA.definir(persistencia.usuarios_em_memoria())
+
+registro.ao_coletar(coletar_cache_nutrientes)
+
+servidor_metricas = None
+
+# Abre e fecha o banco e o endpoint de métricas junto com o ciclo de vida da aplicação
+async def iniciar_recursos(application: Application) -> None:
+    global servidor_metricas
+    await armazenamento.iniciar()
+    if METRICAS_PORTA:
+        servidor_metricas = ServidorHTTP({('GET', '/metrics'): rota_metricas}, METRICAS_HOST, int(METRICAS_PORTA))
+        await servidor_metricas.iniciar()
+        logger.info(f"Métricas em http://{METRICAS_HOST}:{servidor_metricas.porta}/metrics")
+
+async def fechar_recursos(application: Application) -> None:
+    logger.info("Cache de nutrientes", extra=cache_nutrientes.estatisticas())
+    if servidor_metricas:
+        await servidor_metricas.parar()
+    await armazenamento.fechar()
+
+# Cria a aplicação com os jobs e handlers do bot; sem updater quando as
+# atualizações chegam por outro caminho (webhook). `request` permite trocar
+# o cliente HTTP da Bot API (usado pelo benchmark). Com vários processos, só
+# um deles agenda o relatório diário (com a recuperação do envio perdido) e
+# a compactação do histórico
+def criar_aplicacao(com_updater=True, request=None, agendar_relatorio=True):
     # Configuração do bot
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        # A espera acontece na fila de admissão, que dá prioridade aos comandos de banco
+        .concurrent_updates(ATUALIZACOES_CONCORRENTES + FILA_ADMISSAO)
+        .post_init(iniciar_recursos)
+        .post_shutdown(fechar_recursos)
+        .persistence(persistencia)
+        # Cada chamada à Bot API é medida pelo nome do método
+        .request(RequestInstrumentado(request or HTTPXRequest(connection_pool_size=256)))
+    )
+    if not com_updater:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Agendar envio de relatório diário para todos os usuários às 8h da manhã
     job_queue = application.job_queue
-    job_queue.run_daily(enviar_relatorio_diario, time=datetime.time(hour=8, minute=0, second=0, tzinfo=timezone_utc_3))
+    if agendar_relatorio:
+        job_queue.run_daily(enviar_relatorio_diario, time=HORARIO_RELATORIO.replace(tzinfo=timezone_utc_3))
+        # E enviar logo na subida se o horário de hoje passou com o processo fora do ar
+        job_queue.run_once(recuperar_relatorio_diario, when=5)
+        # Arquivar o histórico antigo de madrugada, fora do horário de uso
+        job_queue.run_daily(compactar_historico, time=datetime.time(hour=4, minute=0, second=0, tzinfo=timezone_utc_3))
+
+    # Verificar a cada minuto os usuários ociosos em memória
+    job_queue.run_repeating(despejar_usuarios_ociosos, interval=60)
 
     # Handlers para os comandos e mensagens
     conv_handler = ConversationHandler(
@@ -436,7 +620,10 @@ def main():
         states={
             ADICIONAR_ALIMENTO: [CallbackQueryHandler(adicionar_ao_total)]
         },
-        fallbacks=[CommandHandler("reset", reset_info_nutricional)]
+        fallbacks=[CommandHandler("reset", reset_info_nutricional)],
+        # Confirmações pendentes sobrevivem a reinícios
+        name="adicionar_alimento",
+        persistent=True,
     )
 
     application.add_handler(CommandHandler("start", start))
@@ -447,10 +634,55 @@ def main():
     application.add_handler(CommandHandler("enviarrelatorio", enviar_relatorio_manual))
     application.add_handler(CommandHandler("help", help_command))  # Novo handler para o comando /help
     application.add_handler(CommandHandler("insights", gerar_insights))
+    application.add_handler(CommandHandler("exportar", exportar_historico))
+    application.add_handler(CommandHandler("grafico", enviar_grafico))
     application.add_handler(conv_handler)
 
+    # Fila de prioridade e limites de uso dos modelos na frente de cada handler
+    envolver_handlers(application, controle_admissao.envolver)
+
+    # Latência, contagem e execuções em andamento de cada handler, com o update_id nos logs
+    envolver_handlers(application, instrumentar_handler)
+
+    return application
+
+def main():
     # Inicia o bot
-    application.run_polling()
+    if MODO_BOT == 'webhook' and not WEBHOOK_SEGREDO:
+        raise SystemExit("Defina WEBHOOK_SEGREDO para usar o modo webhook.")
+
+    if MODO_BOT == 'trabalhador':
+        asyncio.run(executar_trabalhador(
+            criar_aplicacao(com_updater=False, agendar_relatorio=TRABALHADOR_INDICE == 0)
+        ))
+    elif TRABALHADORES > 1:
+        asyncio.run(executar_supervisor(
+            TELEGRAM_TOKEN,
+            TRABALHADORES,
+            [sys.executable, os.path.abspath(__file__)],
+            modo=MODO_BOT,
+            segredo=WEBHOOK_SEGREDO,
+            host=WEBHOOK_HOST,
+            porta=WEBHOOK_PORTA,
+            caminho=WEBHOOK_CAMINHO,
+            url_publica=WEBHOOK_URL,
+            arquivo_gravacao=WEBHOOK_GRAVAR,
+            metricas_host=METRICAS_HOST,
+            metricas_porta=METRICAS_PORTA,
+            armazenamento=armazenamento,
+        ))
+    elif MODO_BOT == 'webhook':
+        asyncio.run(executar_webhook(
+            criar_aplicacao(com_updater=False),
+            WEBHOOK_SEGREDO,
+            host=WEBHOOK_HOST,
+            porta=WEBHOOK_PORTA,
+            caminho=WEBHOOK_CAMINHO,
+            url_publica=WEBHOOK_URL,
+            arquivo_gravacao=WEBHOOK_GRAVAR,
+        ))
+    else:
+        criar_aplicacao().run_polling()
 
 if __name__ == '__main__':
     main()
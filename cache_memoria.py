@@ -0,0 +1,32 @@
+import time
+from collections import OrderedDict
+
+# Cache LRU em memória com expiração opcional, usado pelos caches do bot
+
+
+class CacheMemoria:
+    def __init__(self, capacidade, ttl=None):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._itens = OrderedDict()
+
+    def __len__(self):
+        return len(self._itens)
+
+    # Devolve o valor guardado ou None se não existir ou tiver expirado
+    def obter(self, chave):
+        entrada = self._itens.get(chave)
+        if entrada is None:
+            return None
+        valor, criado_em = entrada
+        if self.ttl is not None and time.time() - criado_em >= self.ttl:
+            del self._itens[chave]
+            return None
+        self._itens.move_to_end(chave)
+        return valor
+
+    def guardar(self, chave, valor, criado_em=None):
+        self._itens[chave] = (valor, time.time() if criado_em is None else criado_em)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.capacidade:
+            self._itens.popitem(last=False)
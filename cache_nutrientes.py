@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+from cache_memoria import CacheMemoria
+
+# Cache das respostas de nutrientes por descrição de alimento.
+#
+# Dois níveis: um LRU em memória na frente e a tabela cache_nutrientes no
+# SQLite atrás dele, que sobrevive a reinícios. As entradas expiram após o
+# TTL e a tabela é podada pelas mais antigas em acesso quando passa da
+# capacidade.
+
+logger = logging.getLogger(__name__)
+
+
+# Normaliza a descrição para que "2 Bananas", "2  bananas." e "2 bananas" caiam na mesma chave
+def normalizar_alimento(alimento):
+    texto = unicodedata.normalize('NFKD', alimento.casefold())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[^\w.,]+', ' ', texto)
+    texto = re.sub(r'(?<!\d)[.,]|[.,](?!\d)', ' ', texto)
+    return ' '.join(texto.split())
+
+
+class CacheNutrientes:
+    def __init__(self, armazenamento, capacidade_memoria=2048, capacidade_disco=100000, ttl=30 * 24 * 3600, poda_a_cada=200):
+        self.armazenamento = armazenamento
+        self.capacidade_disco = capacidade_disco
+        self.ttl = ttl
+        self.poda_a_cada = poda_a_cada
+        self._memoria = CacheMemoria(capacidade_memoria, ttl)
+        self._gravacoes = 0
+        self._tarefas = set()
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.faltas = 0
+
+    def estatisticas(self):
+        return {
+            "acertos_memoria": self.acertos_memoria,
+            "acertos_disco": self.acertos_disco,
+            "faltas": self.faltas,
+            "itens_memoria": len(self._memoria),
+        }
+
+    async def obter(self, alimento):
+        chave = normalizar_alimento(alimento)
+        agora = time.time()
+
+        resposta = self._memoria.obter(chave)
+        if resposta is not None:
+            self.acertos_memoria += 1
+            return resposta
+
+        linha = await self.armazenamento.ler_um(
+            'SELECT resposta, criado_em FROM cache_nutrientes WHERE chave = ? AND criado_em > ?',
+            (chave, agora - self.ttl)
+        )
+        if linha is None:
+            self.faltas += 1
+            return None
+
+        resposta, criado_em = linha
+        self.acertos_disco += 1
+        self._memoria.guardar(chave, resposta, criado_em)
+        # Atualiza o último acesso em segundo plano, sem segurar a resposta
+        self._em_segundo_plano(self.armazenamento.escrever(
+            'UPDATE cache_nutrientes SET acessado_em = ? WHERE chave = ?', (agora, chave)
+        ))
+        return resposta
+
+    async def guardar(self, alimento, resposta):
+        chave = normalizar_alimento(alimento)
+        agora = time.time()
+        self._memoria.guardar(chave, resposta, agora)
+
+        self._gravacoes += 1
+        podar = self._gravacoes % self.poda_a_cada == 0
+
+        def gravar(conexao):
+            conexao.execute('''
+            INSERT OR REPLACE INTO cache_nutrientes (chave, resposta, criado_em, acessado_em)
+            VALUES (?, ?, ?, ?)
+            ''', (chave, resposta, agora, agora))
+            if podar:
+                conexao.execute('DELETE FROM cache_nutrientes WHERE criado_em <= ?', (agora - self.ttl,))
+                conexao.execute('''
+                DELETE FROM cache_nutrientes WHERE chave IN (
+                    SELECT chave FROM cache_nutrientes ORDER BY acessado_em DESC LIMIT -1 OFFSET ?
+                )
+                ''', (self.capacidade_disco,))
+
+        await self.armazenamento.executar_escrita(gravar)
+
+    def _em_segundo_plano(self, corrotina):
+        tarefa = asyncio.ensure_future(corrotina)
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._finalizar_tarefa)
+
+    def _finalizar_tarefa(self, tarefa):
+        self._tarefas.discard(tarefa)
+        if not tarefa.cancelled() and tarefa.exception() is not None:
+            logger.error("Erro ao atualizar o cache de nutrientes", exc_info=tarefa.exception())
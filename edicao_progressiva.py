@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from utilitarios import LIMITE_MENSAGEM, segundos
+
+# Mostra um texto gerado aos poucos (ex.: resposta em streaming do ChatGPT)
+# editando uma mensagem já enviada. As edições intermediárias saem em texto
+# puro, no máximo uma a cada `intervalo` segundos e sem segurar a leitura do
+# stream; só a última aplica o Markdown, que no meio da geração costuma estar
+# incompleto (um * aberto, por exemplo) e seria recusado pelo Telegram.
+
+logger = logging.getLogger(__name__)
+
+
+def _cortar(texto):
+    return texto if len(texto) <= LIMITE_MENSAGEM else texto[:LIMITE_MENSAGEM - 1] + "…"
+
+
+class EdicaoProgressiva:
+    def __init__(self, mensagem, intervalo=1.0):
+        self.mensagem = mensagem
+        self.intervalo = intervalo
+        self.texto = ""
+        self._exibido = mensagem.text or ""
+        self._proxima_edicao = 0
+        self._pausado_ate = 0
+        self._edicao = None
+
+    # Acrescenta um pedaço do texto e agenda uma edição se já passou o intervalo
+    def acrescentar(self, pedaco):
+        self.texto += pedaco
+        if self._edicao is None and time.monotonic() >= self._proxima_edicao and self.texto.strip():
+            self._edicao = asyncio.ensure_future(self._editar(_cortar(self.texto)))
+            self._edicao.add_done_callback(self._edicao_concluida)
+
+    def _edicao_concluida(self, tarefa):
+        self._edicao = None
+        # _editar já trata os erros esperados; o que escapar fica registrado aqui
+        if not tarefa.cancelled() and tarefa.exception() is not None:
+            logger.error("Erro na edição intermediária", exc_info=tarefa.exception())
+
+    async def _editar(self, texto, parse_mode=None):
+        if texto == self._exibido and parse_mode is None:
+            return
+        self._proxima_edicao = time.monotonic() + self.intervalo
+        try:
+            await self.mensagem.edit_text(texto, parse_mode=parse_mode)
+            self._exibido = texto
+        except RetryAfter as e:
+            self._pausado_ate = time.monotonic() + segundos(e.retry_after)
+            self._proxima_edicao = max(self._proxima_edicao, self._pausado_ate)
+            if parse_mode is not None:
+                raise
+        except BadRequest as e:
+            if parse_mode is not None or 'not modified' not in str(e).lower():
+                raise
+        except TelegramError as e:
+            # Uma edição intermediária perdida não compromete a final
+            logger.warning("Erro ao editar mensagem", extra={"erro": str(e)})
+
+    # Espera a edição em andamento e aplica o texto final em Markdown, caindo
+    # para texto puro se o Telegram não conseguir interpretá-lo. A edição final
+    # não espera o intervalo, só uma pausa pedida pelo Telegram (RetryAfter).
+    # Devolve (texto, parse_mode) como ficou na mensagem, ou None se não foi possível editar
+    async def finalizar(self, texto=None, parse_mode='Markdown'):
+        if texto is not None:
+            self.texto = texto
+        if self._edicao is not None:
+            await asyncio.gather(self._edicao, return_exceptions=True)
+        espera = self._pausado_ate - time.monotonic()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+        texto = _cortar(self.texto.strip() or self._exibido)
+        for _ in range(3):
+            try:
+                await self._editar(texto, parse_mode)
+                return texto, parse_mode
+            except RetryAfter as e:
+                await asyncio.sleep(segundos(e.retry_after))
+            except BadRequest:
+                if parse_mode is None:
+                    raise
+                logger.info("Markdown recusado na edição final; enviando texto puro")
+                parse_mode = None
+        return None
@@ -0,0 +1,121 @@
+import datetime
+import io
+import math
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Gráfico de tendência do /grafico, desenhado com o Pillow: calorias por dia
+# em barras no painel de cima e proteínas, carboidratos e gorduras em linhas
+# no de baixo. A série vem pronta de daily_totals; aqui só se preenchem os
+# dias sem registro com zero.
+
+LARGURA = 1000
+ALTURA = 720
+MARGEM_ESQUERDA = 70
+MARGEM_DIREITA = 30
+
+FUNDO = (255, 255, 255)
+TEXTO = (40, 40, 40)
+GRADE = (225, 225, 225)
+CORES = {
+    "calorias": (242, 142, 43),
+    "proteinas": (78, 121, 167),
+    "carboidratos": (89, 161, 79),
+    "gorduras": (225, 87, 89),
+}
+NOMES = {"proteinas": "Proteínas (g)", "carboidratos": "Carboidratos (g)", "gorduras": "Gorduras (g)"}
+
+
+# Converte as linhas (dia, proteinas, carboidratos, gorduras, calorias) em uma
+# série de `dias` posições terminando em `fim`, com zero nos dias sem registro
+def montar_serie(linhas, fim, dias):
+    inicio = fim - datetime.timedelta(days=dias - 1)
+    serie = {nome: [0.0] * dias for nome in ("proteinas", "carboidratos", "gorduras", "calorias")}
+    for dia, proteinas, carboidratos, gorduras, calorias in linhas:
+        posicao = (datetime.date.fromisoformat(dia) - inicio).days
+        if 0 <= posicao < dias:
+            serie["proteinas"][posicao] = proteinas or 0
+            serie["carboidratos"][posicao] = carboidratos or 0
+            serie["gorduras"][posicao] = gorduras or 0
+            serie["calorias"][posicao] = calorias or 0
+    datas = [inicio + datetime.timedelta(days=posicao) for posicao in range(dias)]
+    return datas, serie
+
+
+# Teto do eixo em um valor "redondo" (1, 2 ou 5 vezes uma potência de 10) por divisão
+def _escala(maximo, divisoes=4):
+    if maximo <= 0:
+        return divisoes
+    passo = maximo / divisoes
+    potencia = 10 ** math.floor(math.log10(passo))
+    for multiplo in (1, 2, 5, 10):
+        if passo <= multiplo * potencia:
+            return multiplo * potencia * divisoes
+    return 10 * potencia * divisoes
+
+
+def _painel(desenho, fonte, topo, base, teto, datas):
+    esquerda, direita = MARGEM_ESQUERDA, LARGURA - MARGEM_DIREITA
+    for divisao in range(5):
+        y = base - (base - topo) * divisao / 4
+        desenho.line([(esquerda, y), (direita, y)], fill=GRADE)
+        desenho.text((esquerda - 8, y), f"{teto * divisao / 4:g}", fill=TEXTO, font=fonte, anchor="rm")
+
+    # Até ~10 rótulos de data no eixo horizontal
+    passo = max(1, len(datas) // 10)
+    largura_dia = (direita - esquerda) / len(datas)
+    for posicao in range(0, len(datas), passo):
+        x = esquerda + largura_dia * (posicao + 0.5)
+        desenho.text((x, base + 6), datas[posicao].strftime("%d/%m"), fill=TEXTO, font=fonte, anchor="mt")
+    return esquerda, largura_dia
+
+
+# A fonte embutida do Pillow não tem acentos; usa a DejaVu do sistema quando houver
+def _fonte(tamanho):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", tamanho)
+    except OSError:
+        return ImageFont.load_default(size=tamanho)
+
+
+def desenhar_grafico(datas, serie, titulo):
+    imagem = Image.new("RGB", (LARGURA, ALTURA), FUNDO)
+    desenho = ImageDraw.Draw(imagem)
+    fonte = _fonte(14)
+    fonte_titulo = _fonte(20)
+    desenho.text((LARGURA / 2, 24), titulo, fill=TEXTO, font=fonte_titulo, anchor="mm")
+
+    # Calorias em barras
+    topo, base = 70, 320
+    teto = _escala(max(serie["calorias"]))
+    esquerda, largura_dia = _painel(desenho, fonte, topo, base, teto, datas)
+    desenho.text((MARGEM_ESQUERDA, topo - 12), "Calorias (kcal)", fill=CORES["calorias"], font=fonte, anchor="ls")
+    folga = largura_dia * 0.15
+    for posicao, calorias in enumerate(serie["calorias"]):
+        if calorias <= 0:
+            continue
+        x = esquerda + largura_dia * posicao
+        y = base - (base - topo) * calorias / teto
+        desenho.rectangle([(x + folga, y), (x + largura_dia - folga, base)], fill=CORES["calorias"])
+
+    # Macronutrientes em linhas
+    topo, base = 400, 660
+    teto = _escala(max(max(serie[nome]) for nome in NOMES))
+    esquerda, largura_dia = _painel(desenho, fonte, topo, base, teto, datas)
+    x_legenda = MARGEM_ESQUERDA
+    for nome, rotulo in NOMES.items():
+        desenho.text((x_legenda, topo - 12), rotulo, fill=CORES[nome], font=fonte, anchor="ls")
+        x_legenda += desenho.textlength(rotulo, font=fonte) + 24
+        pontos = [
+            (esquerda + largura_dia * (posicao + 0.5), base - (base - topo) * valor / teto)
+            for posicao, valor in enumerate(serie[nome])
+        ]
+        if len(pontos) > 1:
+            desenho.line(pontos, fill=CORES[nome], width=3, joint="curve")
+        if len(pontos) <= 31:
+            for x, y in pontos:
+                desenho.ellipse([(x - 3, y - 3), (x + 3, y + 3)], fill=CORES[nome])
+
+    saida = io.BytesIO()
+    imagem.save(saida, format="PNG", optimize=True)
+    return saida.getvalue()
@@ -0,0 +1,48 @@
+import contextvars
+import datetime
+import json
+import logging
+import sys
+
+# Logs estruturados (uma linha JSON por evento) com o update_id da
+# atualização em processamento, para seguir uma requisição lenta do começo
+# ao fim. O update_id fica em uma ContextVar, definida pelo envoltório dos
+# handlers em metricas.py, e vale para tudo o que roda na mesma tarefa.
+
+update_id_atual = contextvars.ContextVar('update_id_atual', default=None)
+
+# Atributos padrão do LogRecord, que não entram como campos extras
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class FormatadorJSON(logging.Formatter):
+    def format(self, record):
+        dados = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        update_id = update_id_atual.get()
+        if update_id is not None:
+            dados["update_id"] = update_id
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO:
+                dados[chave] = valor
+        if record.exc_info:
+            dados["erro"] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+# Configura o logger raiz: "json" (padrão) ou "texto" para leitura no terminal
+def configurar_logs(formato='json', nivel='INFO'):
+    saida = logging.StreamHandler(sys.stderr)
+    if formato == 'json':
+        saida.setFormatter(FormatadorJSON())
+    else:
+        saida.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [saida]
+    raiz.setLevel(nivel)
+    # O httpx registra cada requisição em INFO, o que só gera ruído aqui
+    logging.getLogger('httpx').setLevel(logging.WARNING)
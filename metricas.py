@@ -0,0 +1,213 @@
+import contextlib
+import functools
+import logging
+import math
+import time
+
+from telegram.ext import ConversationHandler
+from telegram.request import BaseRequest
+
+from logs_estruturados import update_id_atual
+
+# Métricas do bot no formato texto do Prometheus: histogramas de latência,
+# contadores e medidores de requisições em andamento para cada handler e para
+# cada chamada externa (OpenAI, Whisper, Bot API do Telegram e SQLite).
+
+logger = logging.getLogger(__name__)
+
+BALDES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores, extra=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class _Metrica:
+    tipo = 'untyped'
+
+    def __init__(self, registro, nome, descricao, rotulos=()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        registro.registrar(self)
+
+    def linhas(self):
+        yield f'# HELP {self.nome} {self.descricao}'
+        yield f'# TYPE {self.nome} {self.tipo}'
+        for valores, valor in sorted(self._valores.items()):
+            yield f'{self.nome}{_rotulos(self.rotulos, valores)} {valor:g}'
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, *rotulos, valor=1):
+        self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+
+class Medidor(_Metrica):
+    tipo = 'gauge'
+
+    def inc(self, *rotulos, valor=1):
+        self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def dec(self, *rotulos, valor=1):
+        self.inc(*rotulos, valor=-valor)
+
+    def definir(self, valor, *rotulos):
+        self._valores[rotulos] = valor
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, registro, nome, descricao, rotulos=(), baldes=BALDES_PADRAO):
+        super().__init__(registro, nome, descricao, rotulos)
+        self.baldes = tuple(baldes) + (math.inf,)
+
+    def observar(self, valor, *rotulos):
+        contagens, soma = self._valores.get(rotulos, ([0] * len(self.baldes), 0.0))
+        for indice, limite in enumerate(self.baldes):
+            if valor <= limite:
+                contagens[indice] += 1
+                break
+        self._valores[rotulos] = (contagens, soma + valor)
+
+    def linhas(self):
+        yield f'# HELP {self.nome} {self.descricao}'
+        yield f'# TYPE {self.nome} {self.tipo}'
+        for valores, (contagens, soma) in sorted(self._valores.items()):
+            acumulado = 0
+            for limite, contagem in zip(self.baldes, contagens):
+                acumulado += contagem
+                le = 'le="+Inf"' if limite == math.inf else f'le="{limite:g}"'
+                yield f'{self.nome}_bucket{_rotulos(self.rotulos, valores, le)} {acumulado}'
+            yield f'{self.nome}_sum{_rotulos(self.rotulos, valores)} {soma:g}'
+            yield f'{self.nome}_count{_rotulos(self.rotulos, valores)} {acumulado}'
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+        self._coletores = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+
+    # Funções chamadas antes de cada exposição, para atualizar medidores derivados
+    def ao_coletar(self, funcao):
+        self._coletores.append(funcao)
+
+    def expor(self):
+        for coletor in self._coletores:
+            try:
+                coletor()
+            except Exception:
+                logger.exception("Erro ao coletar métricas")
+        linhas = [linha for metrica in self._metricas for linha in metrica.linhas()]
+        return '\n'.join(linhas) + '\n'
+
+
+registro = Registro()
+
+HANDLER_DURACAO = Histograma(registro, 'macrobot_handler_duracao_segundos', 'Duração de cada handler.', ['handler'])
+HANDLER_TOTAL = Contador(registro, 'macrobot_handler_total', 'Execuções de cada handler por resultado.', ['handler', 'resultado'])
+HANDLER_EM_ANDAMENTO = Medidor(registro, 'macrobot_handler_em_andamento', 'Handlers em execução.', ['handler'])
+EXTERNA_DURACAO = Histograma(registro, 'macrobot_chamada_externa_duracao_segundos', 'Duração das chamadas externas.', ['servico', 'operacao'])
+EXTERNA_TOTAL = Contador(registro, 'macrobot_chamada_externa_total', 'Chamadas externas por resultado.', ['servico', 'operacao', 'resultado'])
+EXTERNA_EM_ANDAMENTO = Medidor(registro, 'macrobot_chamada_externa_em_andamento', 'Chamadas externas em andamento.', ['servico'])
+
+
+# Mede uma chamada externa: `async with medir('openai', 'chat'): ...`
+@contextlib.asynccontextmanager
+async def medir(servico, operacao):
+    EXTERNA_EM_ANDAMENTO.inc(servico)
+    inicio = time.perf_counter()
+    resultado = 'ok'
+    try:
+        yield
+    except BaseException:
+        resultado = 'erro'
+        raise
+    finally:
+        duracao = time.perf_counter() - inicio
+        EXTERNA_EM_ANDAMENTO.dec(servico)
+        EXTERNA_DURACAO.observar(duracao, servico, operacao)
+        EXTERNA_TOTAL.inc(servico, operacao, resultado)
+        logger.debug("chamada externa", extra={"servico": servico, "operacao": operacao, "resultado": resultado, "duracao_ms": round(duracao * 1000, 2)})
+
+
+def instrumentar_handler(nome, callback):
+    @functools.wraps(callback)
+    async def envoltorio(update, context):
+        token = update_id_atual.set(getattr(update, 'update_id', None))
+        HANDLER_EM_ANDAMENTO.inc(nome)
+        inicio = time.perf_counter()
+        resultado = 'ok'
+        try:
+            return await callback(update, context)
+        except BaseException:
+            resultado = 'erro'
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            HANDLER_EM_ANDAMENTO.dec(nome)
+            HANDLER_DURACAO.observar(duracao, nome)
+            HANDLER_TOTAL.inc(nome, resultado)
+            logger.info("handler concluído", extra={"handler": nome, "resultado": resultado, "duracao_ms": round(duracao * 1000, 2)})
+            update_id_atual.reset(token)
+    return envoltorio
+
+
+# Percorre os handlers registrados (inclusive os de dentro de um
+# ConversationHandler) e troca o callback de cada um por `envolver(nome, callback)`
+def envolver_handlers(application, envolver):
+    def percorrer(handlers):
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                percorrer(handler.entry_points)
+                for estados in handler.states.values():
+                    percorrer(estados)
+                percorrer(handler.fallbacks)
+            else:
+                handler.callback = envolver(handler.callback.__name__, handler.callback)
+
+    for handlers in application.handlers.values():
+        percorrer(handlers)
+
+
+# Cliente da Bot API que mede cada chamada pelo nome do método (sendMessage, getFile...)
+class RequestInstrumentado(BaseRequest):
+    def __init__(self, request):
+        self._request = request
+
+    async def initialize(self):
+        await self._request.initialize()
+
+    async def shutdown(self):
+        await self._request.shutdown()
+
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        operacao = 'download' if '/file/bot' in url else url.rsplit('/', 1)[-1]
+        async with medir('telegram', operacao):
+            return await self._request.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+
+
+async def rota_metricas(requisicao):
+    return 200, registro.expor().encode(), 'text/plain; version=0.0.4; charset=utf-8'
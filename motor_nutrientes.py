@@ -0,0 +1,216 @@
+import asyncio
+import collections
+import json
+import logging
+import time
+from typing import NamedTuple
+
+import openai
+
+from metricas import Contador, medir, registro
+
+# Consulta de nutrientes nos modelos da OpenAI.
+#
+# Os modelos formam uma escada: cada lote vai primeiro ao modelo mais rápido
+# e barato, e só os itens com resposta inválida, ausente ou de baixa confiança
+# sobem para o próximo; um "não reconhecido" confiante é aceito como está.
+# Cada degrau tem um prazo próprio; estourado o prazo, os itens sobem como se
+# tivessem falhado. Opcionalmente, quando uma chamada passa do p95 das
+# latências recentes daquele modelo, uma segunda chamada igual é disparada e
+# vale a que responder primeiro.
+#
+# A resposta vem por function calling, num esquema JSON fixo, e é convertida
+# uma única vez em Nutrientes.
+
+logger = logging.getLogger(__name__)
+
+MOTOR_NUTRIENTES = Contador(registro, 'macrobot_motor_nutrientes_total', 'Eventos da escada de modelos por modelo.', ['modelo', 'evento'])
+
+
+class Nutrientes(NamedTuple):
+    proteinas: float
+    carboidratos: float
+    gorduras: float
+    calorias: float
+
+    # Formato gravado no cache de nutrientes: "3.5 12 1.2 150"
+    def como_texto(self):
+        return " ".join(f"{valor:g}" for valor in self)
+
+    @classmethod
+    def de_texto(cls, texto):
+        valores = texto.split()
+        if len(valores) != 4:
+            return None
+        try:
+            return cls(*map(float, valores))
+        except ValueError:
+            return None
+
+    def como_item(self, alimento):
+        return {"alimento": alimento, **self._asdict()}
+
+
+FUNCAO_NUTRIENTES = {
+    "name": "informar_nutrientes",
+    "description": "Informa proteínas, carboidratos e gorduras (em gramas) e calorias (kcal) de cada item, na quantidade descrita.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "itens": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "numero": {"type": "integer", "description": "Número do item na lista"},
+                        "reconhecido": {"type": "boolean", "description": "false se o item não for um alimento conhecido"},
+                        "proteinas": {"type": "number"},
+                        "carboidratos": {"type": "number"},
+                        "gorduras": {"type": "number"},
+                        "calorias": {"type": "number"},
+                        "confianca": {"type": "string", "enum": ["alta", "media", "baixa"]},
+                    },
+                    "required": ["numero", "reconhecido"],
+                },
+            },
+        },
+        "required": ["itens"],
+    },
+}
+
+
+def montar_prompt(alimentos):
+    itens = "\n".join(f"{numero}. {alimento}" for numero, alimento in enumerate(alimentos, start=1))
+    return (
+        "Para cada item numerado abaixo, informe os valores de proteínas, carboidratos, gorduras e calorias "
+        "da quantidade descrita (ou de uma porção usual, se a quantidade não for informada), "
+        "e a sua confiança nesses valores. Marque como não reconhecido o que não for um alimento.\n\n"
+        f"Itens:\n{itens}"
+    )
+
+
+# Lê os argumentos da chamada de função: {numero: (reconhecido, nutrientes, confianca)},
+# sem os itens ausentes ou malformados
+def interpretar_chamada(argumentos, quantidade):
+    try:
+        itens = json.loads(argumentos)["itens"]
+    except (ValueError, TypeError, KeyError):
+        return {}
+
+    respostas = {}
+    for item in itens if isinstance(itens, list) else []:
+        if not isinstance(item, dict):
+            continue
+        numero = item.get("numero")
+        if not isinstance(numero, int) or not 1 <= numero <= quantidade:
+            continue
+        confianca = item.get("confianca", "media")
+        if item.get("reconhecido") is False:
+            respostas[numero] = (False, None, confianca)
+            continue
+        valores = [item.get(campo) for campo in Nutrientes._fields]
+        if all(isinstance(valor, (int, float)) and not isinstance(valor, bool) and valor >= 0 for valor in valores):
+            respostas[numero] = (True, Nutrientes(*map(float, valores)), confianca)
+    return respostas
+
+
+class MotorNutrientes:
+    # `modelos` é a escada [(modelo, prazo em segundos), ...], do mais barato ao mais capaz
+    def __init__(self, modelos, hedge=True, amostras_minimas=20, amostras=200):
+        self.modelos = modelos
+        self.hedge = hedge
+        self.amostras_minimas = amostras_minimas
+        self._latencias = collections.defaultdict(lambda: collections.deque(maxlen=amostras))
+
+    def _p95(self, modelo):
+        latencias = self._latencias[modelo]
+        if len(latencias) < self.amostras_minimas:
+            return None
+        return sorted(latencias)[int(len(latencias) * 0.95)]
+
+    async def _requisitar(self, modelo, alimentos):
+        async with medir('openai', modelo):
+            response = await openai.ChatCompletion.acreate(
+                model=modelo,
+                messages=[{"role": "user", "content": montar_prompt(alimentos)}],
+                functions=[FUNCAO_NUTRIENTES],
+                function_call={"name": FUNCAO_NUTRIENTES["name"]},
+            )
+        chamada = response.choices[0].message.get("function_call") or {}
+        return interpretar_chamada(chamada.get("arguments", ""), len(alimentos))
+
+    # Faz a requisição guardando a latência. Uma requisição cancelada (pelo
+    # prazo do degrau ou porque a outra do hedge respondeu antes) entra com o
+    # tempo até o cancelamento, limitado ao prazo: sem ela, o p95 só veria as
+    # respostas rápidas. Falhas não entram
+    async def _cronometrar(self, modelo, alimentos, prazo):
+        inicio = time.monotonic()
+        try:
+            resultado = await self._requisitar(modelo, alimentos)
+        except asyncio.CancelledError:
+            self._latencias[modelo].append(min(time.monotonic() - inicio, prazo))
+            raise
+        self._latencias[modelo].append(time.monotonic() - inicio)
+        return resultado
+
+    # Faz a chamada e, se ela passar do p95 do modelo, dispara uma segunda
+    # igual; devolve a primeira que der certo e cancela a outra
+    async def _chamar(self, modelo, alimentos, prazo):
+        tarefas = {asyncio.ensure_future(self._cronometrar(modelo, alimentos, prazo))}
+        try:
+            atraso = self._p95(modelo) if self.hedge else None
+            if atraso is not None:
+                feitas, _ = await asyncio.wait(tarefas, timeout=atraso)
+                if not feitas:
+                    MOTOR_NUTRIENTES.inc(modelo, 'hedge')
+                    tarefas.add(asyncio.ensure_future(self._cronometrar(modelo, alimentos, prazo)))
+            erro = None
+            while tarefas:
+                feitas, tarefas = await asyncio.wait(tarefas, return_when=asyncio.FIRST_COMPLETED)
+                for tarefa in feitas:
+                    if tarefa.exception() is None:
+                        return tarefa.result()
+                    erro = tarefa.exception()
+            raise erro
+        finally:
+            for tarefa in tarefas:
+                tarefa.cancel()
+
+    # Devolve, na ordem dos alimentos, Nutrientes ou None para o que nenhum
+    # modelo reconheceu ou conseguiu responder a tempo
+    async def consultar_lote(self, alimentos):
+        resultados = [None] * len(alimentos)
+        pendentes = list(range(len(alimentos)))
+        for degrau, (modelo, prazo) in enumerate(self.modelos, start=1):
+            if not pendentes:
+                break
+            try:
+                respostas = await asyncio.wait_for(self._chamar(modelo, [alimentos[i] for i in pendentes], prazo), prazo)
+            except asyncio.TimeoutError:
+                MOTOR_NUTRIENTES.inc(modelo, 'prazo_esgotado')
+                logger.warning("Prazo esgotado na consulta de nutrientes", extra={"modelo": modelo, "itens": len(pendentes)})
+                continue
+            except Exception:
+                MOTOR_NUTRIENTES.inc(modelo, 'erro')
+                logger.exception("Erro na consulta de nutrientes", extra={"modelo": modelo, "itens": len(pendentes)})
+                continue
+
+            subir = []
+            for numero, indice in enumerate(pendentes, start=1):
+                if numero not in respostas:
+                    # Item ausente ou malformado na resposta
+                    subir.append(indice)
+                    continue
+                reconhecido, nutrientes, confianca = respostas[numero]
+                if reconhecido:
+                    # Com baixa confiança, fica como resposta provisória para o caso
+                    # de nenhum modelo acima fazer melhor
+                    resultados[indice] = nutrientes
+                # "Não reconhecido" com confiança é resposta final, como os valores
+                if confianca == "baixa":
+                    subir.append(indice)
+            MOTOR_NUTRIENTES.inc(modelo, 'respondido', valor=len(pendentes) - len(subir))
+            if subir and degrau < len(self.modelos):
+                MOTOR_NUTRIENTES.inc(modelo, 'escalado', valor=len(subir))
+            pendentes = subir
+        return resultados
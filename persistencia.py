@@ -0,0 +1,238 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Persistência do bot no SQLite: user_data e estados dos ConversationHandler
+# sobrevivem a reinícios, então uma confirmação Sim/Não pendente continua
+# valendo depois de um deploy.
+#
+# O user_data é carregado sob demanda, na primeira atualização de cada
+# usuário, em vez de tudo na inicialização. As alterações ficam pendentes em
+# memória e são gravadas juntas em uma única transação (write-behind), e os
+# usuários sem atividade recente saem da memória.
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenciaSQLite(BasePersistence):
+    def __init__(self, armazenamento, intervalo=5, tempo_ocioso=30 * 60, ttl_conversas=7 * 24 * 3600):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=intervalo,
+        )
+        self.armazenamento = armazenamento
+        self.tempo_ocioso = tempo_ocioso
+        self.ttl_conversas = ttl_conversas
+        # Último acesso e último JSON gravado de cada usuário carregado em memória
+        self._acessos = {}
+        self._gravados = {}
+        self._carregando = {}
+        self._usuarios_pendentes = {}
+        self._conversas_pendentes = {}
+        # Lote em gravação agora e usuários tirados da memória cujo
+        # drop_user_data ainda vai chegar da Application
+        self._usuarios_gravando = {}
+        self._despejados = set()
+        self._aplicacao = None
+        self._tarefa_gravacao = None
+
+    # Nada é carregado na inicialização; cada usuário é lido em refresh_user_data
+    async def get_user_data(self):
+        await self.armazenamento.iniciar()
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Os estados pendentes são poucos (só as confirmações em aberto) e o
+    # ConversationHandler precisa deles todos na inicialização
+    async def get_conversations(self, name):
+        await self.armazenamento.iniciar()
+        limite = time.time() - self.ttl_conversas
+        await self.armazenamento.escrever('DELETE FROM persistencia_conversas WHERE atualizado_em < ?', (limite,))
+        linhas = await self.armazenamento.ler(
+            'SELECT chave, estado FROM persistencia_conversas WHERE nome = ?', (name,)
+        )
+        return {tuple(json.loads(chave)): json.loads(estado) for chave, estado in linhas}
+
+    async def refresh_user_data(self, user_id, user_data):
+        self._acessos[user_id] = time.monotonic()
+        if user_id in self._gravados:
+            return
+
+        # Atualizações simultâneas do mesmo usuário esperam a mesma leitura
+        carregamento = self._carregando.get(user_id)
+        if carregamento is None:
+            carregamento = asyncio.ensure_future(self.armazenamento.ler_um(
+                'SELECT dados FROM persistencia_usuarios WHERE user_id = ?', (user_id,)
+            ))
+            self._carregando[user_id] = carregamento
+        try:
+            linha = await asyncio.shield(carregamento)
+        finally:
+            self._carregando.pop(user_id, None)
+
+        if user_id in self._gravados:
+            return
+        self._gravados[user_id] = linha[0] if linha else '{}'
+        if linha:
+            # O que já foi alterado em memória tem prioridade sobre o banco
+            for chave, valor in json.loads(linha[0]).items():
+                user_data.setdefault(chave, valor)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # A Application chama os update_* de todos os usuários alterados de uma vez
+    # (com cópias dos dados); aqui eles só ficam pendentes até a próxima gravação
+    async def update_user_data(self, user_id, data):
+        self._usuarios_pendentes[user_id] = data
+        self._agendar_gravacao()
+
+    async def drop_user_data(self, user_id):
+        if user_id in self._despejados:
+            # Só saiu da memória (despejar_ociosos): nada a apagar do banco. Se o
+            # usuário voltou nesse meio-tempo, a Application descartou a
+            # atualização dele nesta rodada, então ela é pedida aqui
+            self._despejados.discard(user_id)
+            dados = self._aplicacao.user_data.get(user_id) if user_id in self._acessos else None
+            if dados is not None:
+                await self.update_user_data(user_id, copy.deepcopy(dados))
+            return
+        self._usuarios_pendentes[user_id] = {}
+        self._agendar_gravacao()
+
+    async def update_conversation(self, name, key, new_state):
+        self._conversas_pendentes[(name, key)] = new_state
+        self._agendar_gravacao()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        if self._tarefa_gravacao is not None:
+            await self._tarefa_gravacao
+        await self._gravar_pendentes()
+
+    def _agendar_gravacao(self):
+        if self._tarefa_gravacao is None:
+            self._tarefa_gravacao = asyncio.ensure_future(self._gravar_depois())
+
+    async def _gravar_depois(self):
+        try:
+            # Deixa os demais update_* da mesma rodada entrarem no lote
+            await asyncio.sleep(0)
+            await self._gravar_pendentes()
+        except Exception:
+            logger.exception("Erro ao gravar a persistência")
+        finally:
+            self._tarefa_gravacao = None
+
+    async def _gravar_pendentes(self):
+        usuarios, self._usuarios_pendentes = self._usuarios_pendentes, {}
+        conversas, self._conversas_pendentes = self._conversas_pendentes, {}
+        self._usuarios_gravando = usuarios
+
+        gravar_usuarios, apagar_usuarios = [], []
+        for user_id, dados in usuarios.items():
+            try:
+                texto = json.dumps(dados, ensure_ascii=False, sort_keys=True)
+            except (TypeError, ValueError):
+                logger.exception("user_data não serializável em JSON", extra={"user_id": user_id})
+                continue
+            # Só grava quem mudou desde a última leitura/gravação
+            if texto == self._gravados.get(user_id):
+                continue
+            if texto == '{}':
+                apagar_usuarios.append((user_id,))
+            else:
+                gravar_usuarios.append((user_id, texto))
+            if user_id in self._acessos:
+                self._gravados[user_id] = texto
+
+        gravar_conversas, apagar_conversas = [], []
+        for (nome, chave), estado in conversas.items():
+            chave = json.dumps(list(chave))
+            if estado is None:
+                apagar_conversas.append((nome, chave))
+                continue
+            try:
+                gravar_conversas.append((nome, chave, json.dumps(estado)))
+            except (TypeError, ValueError):
+                logger.exception("Estado de conversa não serializável em JSON", extra={"conversa": nome})
+
+        if not (gravar_usuarios or apagar_usuarios or gravar_conversas or apagar_conversas):
+            return
+        agora = time.time()
+
+        def gravar(conexao):
+            conexao.executemany('''
+            INSERT OR REPLACE INTO persistencia_usuarios (user_id, dados, atualizado_em) VALUES (?, ?, ?)
+            ''', [(user_id, texto, agora) for user_id, texto in gravar_usuarios])
+            conexao.executemany('DELETE FROM persistencia_usuarios WHERE user_id = ?', apagar_usuarios)
+            conexao.executemany('''
+            INSERT OR REPLACE INTO persistencia_conversas (nome, chave, estado, atualizado_em) VALUES (?, ?, ?, ?)
+            ''', [(nome, chave, estado, agora) for nome, chave, estado in gravar_conversas])
+            conexao.executemany('DELETE FROM persistencia_conversas WHERE nome = ? AND chave = ?', apagar_conversas)
+
+        try:
+            await self.armazenamento.executar_escrita(gravar)
+        except Exception:
+            # O lote volta para os pendentes, sem passar por cima do que chegou
+            # durante a gravação, e sem o último JSON conhecido esses usuários
+            # são gravados de novo na próxima rodada
+            for user_id, _ in gravar_usuarios:
+                self._gravados.pop(user_id, None)
+            for (user_id,) in apagar_usuarios:
+                self._gravados.pop(user_id, None)
+            for user_id, dados in usuarios.items():
+                self._usuarios_pendentes.setdefault(user_id, dados)
+            for chave, estado in conversas.items():
+                self._conversas_pendentes.setdefault(chave, estado)
+            raise
+        finally:
+            self._usuarios_gravando = {}
+
+    # Tira da memória da aplicação os usuários sem atualizações há mais de
+    # `tempo_ocioso` segundos e sem gravação pendente; eles são recarregados
+    # do banco na próxima mensagem
+    def despejar_ociosos(self, application):
+        self._aplicacao = application
+        limite = time.monotonic() - self.tempo_ocioso
+        ociosos = [
+            user_id for user_id, acesso in self._acessos.items()
+            if acesso < limite and user_id not in self._usuarios_pendentes
+            and user_id not in self._usuarios_gravando and user_id not in self._carregando
+        ]
+        for user_id in ociosos:
+            # O drop_user_data que a Application repassa depois é ignorado
+            self._despejados.add(user_id)
+            application.drop_user_data(user_id)
+            del self._acessos[user_id]
+            self._gravados.pop(user_id, None)
+        return len(ociosos)
+
+    def usuarios_em_memoria(self):
+        return len(self._acessos)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from utilitarios import LIMITE_MENSAGEM, LimitadorTaxa, segundos
+
+# Envio do relatório diário: uma mensagem por usuário, enviadas em paralelo
+# respeitando o limite global do Telegram (~30 mensagens/s) com um token
+# bucket, pausando todos os envios quando o Telegram responde RetryAfter.
+
+logger = logging.getLogger(__name__)
+
+
+# Monta o relatório de um usuário em uma única mensagem
+def montar_relatorio(alimentos_consumidos, totais, rodape=""):
+    if alimentos_consumidos:
+        cabecalho = "📊 Relatório do consumo de ontem:\n"
+        linhas = [
+            f"- {alimento[0]}: Proteínas: {alimento[1]:.2f} g, Carboidratos: {alimento[2]:.2f} g, Gorduras: {alimento[3]:.2f} g, Calorias: {alimento[4]:.2f} kcal\n"
+            for alimento in alimentos_consumidos
+        ]
+    else:
+        cabecalho = "Você não consumiu nenhum alimento ontem.\n"
+        linhas = []
+
+    resumo = (
+        f"\n🔢 Total consumido ontem:\n"
+        f"Proteínas: {totais['proteinas']:.2f} g\n"
+        f"Carboidratos: {totais['carboidratos']:.2f} g\n"
+        f"Gorduras: {totais['gorduras']:.2f} g\n"
+        f"Calorias: {totais['calorias']:.2f} kcal"
+    )
+    if rodape:
+        resumo += f"\n\n{rodape}"
+
+    # Corta a lista de alimentos se a mensagem passar do limite do Telegram
+    espaco = LIMITE_MENSAGEM - len(cabecalho) - len(resumo) - 2
+    corpo = ""
+    for linha in linhas:
+        if len(corpo) + len(linha) > espaco:
+            corpo += "…\n"
+            break
+        corpo += linha
+    return cabecalho + corpo + resumo
+
+
+# Envia as mensagens {user_id: texto} em paralelo e devolve um resumo do envio
+async def enviar_relatorios(bot, mensagens, limitador=None, concorrencia=32, tentativas=3):
+    limitador = limitador or LimitadorTaxa()
+    resumo = {"enviados": 0, "falhas": 0, "limitados": 0}
+    inicio = time.monotonic()
+    fila = asyncio.Queue()
+    for user_id, texto in mensagens.items():
+        fila.put_nowait((user_id, texto))
+
+    async def enviar(user_id, texto):
+        for _ in range(tentativas):
+            await limitador.adquirir()
+            try:
+                await bot.send_message(chat_id=user_id, text=texto)
+                resumo["enviados"] += 1
+                return
+            except RetryAfter as e:
+                resumo["limitados"] += 1
+                limitador.pausar(segundos(e.retry_after))
+            except Forbidden as e:
+                logger.info("Usuário bloqueou o bot", extra={"user_id": user_id, "erro": str(e)})
+                break
+            except TelegramError as e:
+                logger.warning("Erro ao enviar relatório", extra={"user_id": user_id, "erro": str(e)})
+                break
+        resumo["falhas"] += 1
+
+    async def trabalhador():
+        while not fila.empty():
+            user_id, texto = fila.get_nowait()
+            try:
+                await enviar(user_id, texto)
+            except Exception:
+                # Falha inesperada de um usuário não interrompe os demais
+                logger.exception("Erro ao enviar relatório", extra={"user_id": user_id})
+                resumo["falhas"] += 1
+
+    await asyncio.gather(*(trabalhador() for _ in range(min(concorrencia, len(mensagens)))))
+    resumo["duracao"] = round(time.monotonic() - inicio, 3)
+    return resumo
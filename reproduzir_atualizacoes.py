@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+# Cliente que faz o papel do Telegram: reenvia atualizações gravadas (um JSON
+# por linha, como as gravadas com WEBHOOK_GRAVAR) para o webhook local, com o
+# segredo no cabeçalho, e mede a taxa e a latência das respostas.
+#
+# Exemplo:
+#   python reproduzir_atualizacoes.py atualizacoes.jsonl --concorrencia 50 --repeticoes 10
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+async def reproduzir(atualizacoes, url, segredo, concorrencia):
+    fila = asyncio.Queue()
+    for atualizacao in atualizacoes:
+        fila.put_nowait(atualizacao)
+
+    latencias = []
+    status = {}
+
+    async def trabalhador(cliente):
+        while not fila.empty():
+            atualizacao = fila.get_nowait()
+            inicio = time.perf_counter()
+            try:
+                resposta = await cliente.post(url, json=atualizacao, headers={'X-Telegram-Bot-Api-Secret-Token': segredo})
+                codigo = resposta.status_code
+            except httpx.HTTPError as e:
+                codigo = type(e).__name__
+            latencias.append(time.perf_counter() - inicio)
+            status[codigo] = status.get(codigo, 0) + 1
+
+    inicio = time.perf_counter()
+    limites = httpx.Limits(max_connections=concorrencia, max_keepalive_connections=concorrencia)
+    async with httpx.AsyncClient(limits=limites, timeout=30) as cliente:
+        await asyncio.gather(*(trabalhador(cliente) for _ in range(concorrencia)))
+    duracao = time.perf_counter() - inicio
+
+    return {
+        "enviadas": len(latencias),
+        "status": {str(codigo): quantidade for codigo, quantidade in status.items()},
+        "duracao_s": round(duracao, 3),
+        "atualizacoes_por_s": round(len(latencias) / duracao, 1) if duracao else 0,
+        "latencia_ms": {
+            f"p{p}": round(percentil(latencias, p) * 1000, 2) for p in (50, 90, 99)
+        },
+    }
+
+
+def carregar(caminho, repeticoes):
+    with open(caminho, encoding='utf-8') as arquivo:
+        gravadas = [json.loads(linha) for linha in arquivo if linha.strip()]
+
+    # Renumera os update_id para que cada repetição pareça uma atualização nova
+    atualizacoes = []
+    for _ in range(repeticoes):
+        for atualizacao in gravadas:
+            atualizacoes.append(dict(atualizacao, update_id=len(atualizacoes) + 1))
+    return atualizacoes
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Reenvia atualizações gravadas para o webhook local.")
+    parser.add_argument('arquivo', help="arquivo .jsonl com uma atualização do Telegram por linha")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORTA', '8443')}{os.getenv('WEBHOOK_CAMINHO', '/webhook')}")
+    parser.add_argument('--segredo', default=os.getenv('WEBHOOK_SEGREDO', ''))
+    parser.add_argument('--concorrencia', type=int, default=10)
+    parser.add_argument('--repeticoes', type=int, default=1)
+    args = parser.parse_args()
+
+    atualizacoes = carregar(args.arquivo, args.repeticoes)
+    resultado = asyncio.run(reproduzir(atualizacoes, args.url, args.segredo, args.concorrencia))
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == '__main__':
+    main()
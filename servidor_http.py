@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+# Servidor HTTP/1.1 mínimo sobre asyncio, usado para receber o webhook do
+# Telegram sem depender de um framework web. Suporta keep-alive e, ao parar,
+# deixa de aceitar conexões e espera as requisições em andamento terminarem.
+
+logger = logging.getLogger(__name__)
+
+Requisicao = namedtuple('Requisicao', 'metodo caminho cabecalhos corpo')
+
+MOTIVOS = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+# Levantada ao ler uma requisição com Content-Length acima do limite
+class CorpoGrandeDemais(Exception):
+    pass
+
+
+class ServidorHTTP:
+    # `rotas` mapeia (método, caminho) para `async def rota(requisicao) -> (status, corpo, tipo)`
+    def __init__(self, rotas, host='127.0.0.1', porta=8080, tamanho_maximo=1024 * 1024):
+        self.rotas = rotas
+        self.host = host
+        self.porta = porta
+        self.tamanho_maximo = tamanho_maximo
+        self._servidor = None
+        self._conexoes = {}
+        self._encerrando = False
+        self._em_andamento = 0
+        self._ocioso = asyncio.Event()
+        self._ocioso.set()
+
+    async def iniciar(self):
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.porta)
+        # Com porta 0 o sistema escolhe uma porta livre
+        self.porta = self._servidor.sockets[0].getsockname()[1]
+
+    # Para de aceitar conexões, fecha as ociosas e espera as requisições em andamento
+    async def parar(self, tempo_limite=30):
+        if self._servidor is None:
+            return
+        self._encerrando = True
+        self._servidor.close()
+        for tarefa, ocupada in list(self._conexoes.items()):
+            if not ocupada:
+                tarefa.cancel()
+        try:
+            await asyncio.wait_for(self._ocioso.wait(), tempo_limite)
+        except asyncio.TimeoutError:
+            logger.warning("Servidor HTTP parou com requisições em andamento", extra={"em_andamento": self._em_andamento})
+        for tarefa in list(self._conexoes):
+            tarefa.cancel()
+        await self._servidor.wait_closed()
+        self._servidor = None
+
+    async def _atender(self, leitor, escritor):
+        tarefa = asyncio.current_task()
+        self._conexoes[tarefa] = False
+        try:
+            while not self._encerrando:
+                requisicao = await self._ler_requisicao(leitor)
+                if requisicao is None:
+                    break
+                self._conexoes[tarefa] = True
+                self._em_andamento += 1
+                self._ocioso.clear()
+                try:
+                    status, corpo, tipo = await self._responder(requisicao)
+                    manter = not self._encerrando and requisicao.cabecalhos.get('connection', '').lower() != 'close'
+                    await self._escrever_resposta(escritor, status, corpo, tipo, manter)
+                finally:
+                    self._em_andamento -= 1
+                    if self._em_andamento == 0:
+                        self._ocioso.set()
+                    self._conexoes[tarefa] = False
+                if not manter:
+                    break
+        except CorpoGrandeDemais:
+            # O corpo não é lido; a conexão é fechada logo após a resposta
+            try:
+                await self._escrever_resposta(escritor, 413, b'', 'text/plain', False)
+            except ConnectionError:
+                pass
+        except (asyncio.CancelledError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._conexoes.pop(tarefa, None)
+            escritor.close()
+
+    async def _escrever_resposta(self, escritor, status, corpo, tipo, manter):
+        escritor.write(
+            f"HTTP/1.1 {status} {MOTIVOS.get(status, '')}\r\n"
+            f"Content-Type: {tipo}\r\n"
+            f"Content-Length: {len(corpo)}\r\n"
+            f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n".encode() + corpo
+        )
+        await escritor.drain()
+
+    async def _ler_requisicao(self, leitor):
+        linha = await leitor.readline()
+        if not linha:
+            return None
+        metodo, caminho, _ = linha.decode('latin-1').split(' ', 2)
+
+        cabecalhos = {}
+        while True:
+            linha = await leitor.readline()
+            if linha in (b'\r\n', b'\n', b''):
+                break
+            nome, _, valor = linha.decode('latin-1').partition(':')
+            cabecalhos[nome.strip().lower()] = valor.strip()
+
+        tamanho = int(cabecalhos.get('content-length', 0))
+        if tamanho > self.tamanho_maximo:
+            raise CorpoGrandeDemais(tamanho)
+        corpo = await leitor.readexactly(tamanho) if tamanho else b''
+        return Requisicao(metodo, caminho.split('?', 1)[0], cabecalhos, corpo)
+
+    async def _responder(self, requisicao):
+        rota = self.rotas.get((requisicao.metodo, requisicao.caminho))
+        if rota is None:
+            if any(caminho == requisicao.caminho for _, caminho in self.rotas):
+                return 405, b'', 'text/plain'
+            return 404, b'', 'text/plain'
+        try:
+            return await rota(requisicao)
+        except Exception:
+            logger.exception("Erro ao atender requisição", extra={"metodo": requisicao.metodo, "caminho": requisicao.caminho})
+            return 500, b'', 'text/plain'
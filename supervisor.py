@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from metricas import Contador, Medidor, registro, rota_metricas
+from servidor_http import ServidorHTTP
+from webhook import abrir_gravacao, aguardar_sinal_de_parada, criar_rota_webhook
+
+# Modo com vários processos: um supervisor recebe as atualizações uma única
+# vez (polling ou webhook) e as distribui entre N processos trabalhadores pelo
+# user_id, de modo que cada usuário (e o estado da sua conversa) fica sempre
+# no mesmo processo. Cada trabalhador é o próprio bot_telegram.py com
+# MODO_BOT=trabalhador, lendo as atualizações em JSON, uma por linha, da
+# entrada padrão e enviando batimentos pela saída padrão. Um trabalhador que
+# morre ou para de enviar batimentos é reiniciado; as atualizações ainda não
+# entregues a ele continuam na fila do supervisor. Os jobs diários (relatório
+# e compactação do histórico) rodam só no trabalhador 0; se ele estiver
+# reiniciando no horário, o relatório do dia é enviado quando ele voltar.
+
+logger = logging.getLogger(__name__)
+
+TRABALHADOR_VIVO = Medidor(registro, 'macrobot_trabalhador_vivo', 'Trabalhador em execução (1) ou não (0).', ['trabalhador'])
+TRABALHADOR_FILA = Medidor(registro, 'macrobot_trabalhador_fila', 'Atualizações aguardando cada trabalhador.', ['trabalhador', 'onde'])
+TRABALHADOR_RECEBIDAS = Medidor(registro, 'macrobot_trabalhador_recebidas', 'Atualizações recebidas pelo processo atual do trabalhador.', ['trabalhador'])
+TRABALHADOR_BATIMENTO = Medidor(registro, 'macrobot_trabalhador_batimento_segundos', 'Segundos desde o último batimento.', ['trabalhador'])
+TRABALHADOR_REINICIOS = Contador(registro, 'macrobot_trabalhador_reinicios_total', 'Reinícios de trabalhadores por motivo.', ['trabalhador', 'motivo'])
+
+
+# Usuário de uma atualização no formato JSON da Bot API (0 quando não há)
+def usuario_da_atualizacao(dados):
+    for chave, valor in dados.items():
+        if chave == 'update_id' or not isinstance(valor, dict):
+            continue
+        usuario = valor.get('from') or valor.get('user') or valor.get('chat') or {}
+        return usuario.get('id', 0)
+    return 0
+
+
+class Trabalhador:
+    def __init__(self, indice, comando, ambiente, limite_fila=1000):
+        self.indice = indice
+        self.comando = comando
+        self.ambiente = ambiente
+        self.fila = asyncio.Queue(limite_fila)
+        self.processo = None
+        self.iniciado_em = 0
+        self.batimento = 0
+        self.estado = {}
+        self.falhas_seguidas = 0
+        self.reiniciando = False
+        self._leitura = None
+        self._envio = None
+
+    async def iniciar(self):
+        self.processo = await asyncio.create_subprocess_exec(
+            *self.comando,
+            env=self.ambiente,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=1024 * 1024,
+        )
+        self.iniciado_em = self.batimento = time.monotonic()
+        self.estado = {}
+        self._leitura = asyncio.create_task(self._ler_batimentos(self.processo))
+        logger.info("Trabalhador iniciado", extra={"trabalhador": self.indice, "pid": self.processo.pid})
+
+    def iniciar_envio(self):
+        self._envio = asyncio.create_task(self._enviar())
+
+    def vivo(self):
+        return self.processo is not None and self.processo.returncode is None
+
+    # Escreve as atualizações da fila na entrada do processo atual. Se ele
+    # morreu, a atualização espera o reinício em vez de ser descartada
+    async def _enviar(self):
+        pendente = None
+        while True:
+            if pendente is None:
+                pendente = await self.fila.get()
+            processo = self.processo
+            if not self.vivo() or processo.stdin.is_closing():
+                await asyncio.sleep(0.5)
+                continue
+            try:
+                processo.stdin.write(pendente)
+                await processo.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                await asyncio.sleep(0.5)
+                continue
+            pendente = None
+            self.fila.task_done()
+
+    async def _ler_batimentos(self, processo):
+        while True:
+            linha = await processo.stdout.readline()
+            if not linha:
+                return
+            try:
+                self.estado = json.loads(linha)
+            except ValueError:
+                continue
+            self.batimento = time.monotonic()
+
+    async def reiniciar(self, motivo):
+        self.reiniciando = True
+        try:
+            TRABALHADOR_REINICIOS.inc(self.indice, motivo)
+            logger.error("Reiniciando trabalhador", extra={"trabalhador": self.indice, "motivo": motivo, "codigo": self.processo.returncode})
+            if self.vivo():
+                self.processo.kill()
+            await self.processo.wait()
+
+            # Quem cai logo depois de subir espera cada vez mais para voltar
+            self.falhas_seguidas = self.falhas_seguidas + 1 if time.monotonic() - self.iniciado_em < 60 else 0
+            await asyncio.sleep(min(30, 2 ** self.falhas_seguidas - 1))
+            await self.iniciar()
+        finally:
+            self.reiniciando = False
+
+    # Entrega o que falta na fila, fecha a entrada (o trabalhador termina as
+    # atualizações em andamento e sai) e espera o processo encerrar
+    async def parar(self, tempo_limite=60):
+        try:
+            await asyncio.wait_for(self.fila.join(), tempo_limite)
+        except asyncio.TimeoutError:
+            logger.warning("Atualizações não entregues ao trabalhador", extra={"trabalhador": self.indice, "pendentes": self.fila.qsize()})
+        self._envio.cancel()
+        if self.vivo():
+            self.processo.stdin.close()
+            try:
+                await asyncio.wait_for(self.processo.wait(), tempo_limite)
+            except asyncio.TimeoutError:
+                self.processo.kill()
+                await self.processo.wait()
+
+
+# Executa o supervisor até receber um sinal de parada. `comando` inicia um
+# trabalhador (ex.: [sys.executable, "bot_telegram.py"]); ele recebe o índice
+# em TRABALHADOR_INDICE e, se houver métricas, a porta METRICAS_PORTA + 1 + índice
+async def executar_supervisor(token, trabalhadores, comando, modo='polling', segredo=None, host='127.0.0.1',
+                              porta=8443, caminho='/webhook', url_publica=None, arquivo_gravacao=None,
+                              metricas_host='127.0.0.1', metricas_porta='', armazenamento=None,
+                              limite_fila=1000, tempo_limite_batimento=30):
+    # Aplica as migrações uma vez, antes de os trabalhadores abrirem o banco
+    if armazenamento is not None:
+        await armazenamento.iniciar()
+        await armazenamento.fechar()
+
+    pool = []
+    for indice in range(trabalhadores):
+        ambiente = dict(os.environ, MODO_BOT='trabalhador', TRABALHADOR_INDICE=str(indice), TRABALHADORES=str(trabalhadores))
+        ambiente['METRICAS_PORTA'] = str(int(metricas_porta) + 1 + indice) if metricas_porta else ''
+        pool.append(Trabalhador(indice, comando, ambiente, limite_fila))
+    for trabalhador in pool:
+        await trabalhador.iniciar()
+        trabalhador.iniciar_envio()
+
+    def coletar():
+        agora = time.monotonic()
+        for trabalhador in pool:
+            TRABALHADOR_VIVO.definir(int(trabalhador.vivo()), trabalhador.indice)
+            TRABALHADOR_FILA.definir(trabalhador.fila.qsize(), trabalhador.indice, 'supervisor')
+            TRABALHADOR_FILA.definir(trabalhador.estado.get('fila', 0), trabalhador.indice, 'trabalhador')
+            TRABALHADOR_RECEBIDAS.definir(trabalhador.estado.get('recebidas', 0), trabalhador.indice)
+            TRABALHADOR_BATIMENTO.definir(round(agora - trabalhador.batimento, 3), trabalhador.indice)
+
+    registro.ao_coletar(coletar)
+
+    reinicios = set()
+
+    def reiniciar(trabalhador, motivo):
+        tarefa = asyncio.create_task(trabalhador.reiniciar(motivo))
+        reinicios.add(tarefa)
+        tarefa.add_done_callback(reinicios.discard)
+
+    async def supervisionar():
+        while True:
+            await asyncio.sleep(1)
+            for trabalhador in pool:
+                if trabalhador.reiniciando:
+                    continue
+                if not trabalhador.vivo():
+                    reiniciar(trabalhador, 'saiu')
+                elif time.monotonic() - trabalhador.batimento > tempo_limite_batimento:
+                    reiniciar(trabalhador, 'sem_batimento')
+
+    async def distribuir(dados, esperar):
+        trabalhador = pool[usuario_da_atualizacao(dados) % trabalhadores]
+        linha = json.dumps(dados, ensure_ascii=False).encode() + b'\n'
+        if esperar:
+            await trabalhador.fila.put(linha)
+        elif trabalhador.fila.full():
+            return False
+        else:
+            trabalhador.fila.put_nowait(linha)
+        return True
+
+    async def entregar(dados):
+        return await distribuir(dados, esperar=False)
+
+    servidor_metricas = None
+    if metricas_porta:
+        servidor_metricas = ServidorHTTP({('GET', '/metrics'): rota_metricas}, metricas_host, int(metricas_porta))
+        await servidor_metricas.iniciar()
+
+    bot = Bot(token)
+    supervisao = asyncio.create_task(supervisionar())
+    gravacao = None
+    try:
+        if modo == 'webhook':
+            gravacao = abrir_gravacao(arquivo_gravacao)
+            servidor = ServidorHTTP({('POST', caminho): criar_rota_webhook(segredo, entregar, gravacao)}, host, porta)
+            async with bot:
+                if url_publica:
+                    await bot.set_webhook(
+                        url=url_publica.rstrip('/') + caminho,
+                        secret_token=segredo,
+                        allowed_updates=Update.ALL_TYPES,
+                    )
+                await servidor.iniciar()
+                logger.info(f"Supervisor com {trabalhadores} trabalhadores escutando em http://{host}:{servidor.porta}{caminho}")
+                await aguardar_sinal_de_parada()
+                logger.info("Encerrando o supervisor...")
+                await servidor.parar()
+        else:
+            recebidas = asyncio.Queue()
+            updater = Updater(bot, recebidas)
+
+            async def repassar():
+                while True:
+                    atualizacao = await recebidas.get()
+                    await distribuir(atualizacao.to_dict(), esperar=True)
+                    recebidas.task_done()
+
+            repasse = asyncio.create_task(repassar())
+            async with updater:
+                await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                logger.info(f"Supervisor com {trabalhadores} trabalhadores em polling")
+                await aguardar_sinal_de_parada()
+                logger.info("Encerrando o supervisor...")
+                await updater.stop()
+                await recebidas.join()
+            repasse.cancel()
+    finally:
+        supervisao.cancel()
+        for tarefa in list(reinicios):
+            tarefa.cancel()
+        await asyncio.gather(*reinicios, return_exceptions=True)
+        await asyncio.gather(*(trabalhador.parar() for trabalhador in pool))
+        if servidor_metricas:
+            await servidor_metricas.parar()
+        if gravacao:
+            gravacao.close()
+
+
+# Lado do trabalhador: lê as atualizações da entrada padrão e as coloca na fila
+# da aplicação até o fim da entrada, enviando batimentos pela saída padrão
+async def executar_trabalhador(application, intervalo_batimento=5):
+    loop = asyncio.get_running_loop()
+    leitor = asyncio.StreamReader(limit=1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(leitor), sys.stdin)
+
+    # O Ctrl+C do terminal chega a todo o grupo de processos; quem decide a
+    # parada é o supervisor, fechando a entrada. SIGTERM encerra como se a
+    # entrada tivesse acabado
+    try:
+        loop.add_signal_handler(signal.SIGINT, lambda: None)
+        loop.add_signal_handler(signal.SIGTERM, leitor.feed_eof)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    recebidas = 0
+    limite = max(2 * (application.concurrent_updates or 1), 8)
+
+    async def bater():
+        while True:
+            sys.stdout.buffer.write(json.dumps({"recebidas": recebidas, "fila": application.update_queue.qsize()}).encode() + b'\n')
+            sys.stdout.buffer.flush()
+            await asyncio.sleep(intervalo_batimento)
+
+    batimentos = asyncio.create_task(bater())
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        while True:
+            linha = await leitor.readline()
+            if not linha:
+                break
+            # Não lê além do que a aplicação consegue processar; o resto espera no supervisor
+            while application.update_queue.qsize() >= limite:
+                await asyncio.sleep(0.01)
+            await application.update_queue.put(Update.de_json(json.loads(linha), application.bot))
+            recebidas += 1
+    finally:
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        batimentos.cancel()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
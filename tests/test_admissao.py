@@ -0,0 +1,134 @@
+import asyncio
+import types
+
+from admissao import ControleAdmissao, FilaAdmissao, LimiteExcedido
+
+
+def test_chamadas_aos_modelos_nao_seguram_os_handlers():
+    async def cenario():
+        fila = FilaAdmissao(vagas=2, vagas_llm=1, limite_fila=10)
+        ordem = []
+
+        async def executar(nome, chama_modelo, liberar):
+            assert await fila.entrar(False)
+            ordem.append(nome)
+            if chama_modelo:
+                assert await fila.entrar(True)
+                ordem.append(nome + ':modelo')
+                await liberar.wait()
+                fila.sair(True)
+            fila.sair(False)
+
+        liberar = asyncio.Event()
+        tarefas = [asyncio.create_task(executar('a', True, liberar))]
+        await asyncio.sleep(0)
+        # `b` espera pela vaga de modelo, mas `c` (só banco) não espera por ela
+        tarefas.append(asyncio.create_task(executar('b', True, liberar)))
+        await asyncio.sleep(0)
+        tarefas.append(asyncio.create_task(executar('c', False, liberar)))
+        await asyncio.sleep(0)
+        ordem.append('liberar')
+        liberar.set()
+        await asyncio.gather(*tarefas)
+        return ordem, fila
+
+    ordem, fila = asyncio.run(cenario())
+    assert ordem[:3] == ['a', 'a:modelo', 'b']
+    # Com `a` e `b` executando, `c` só entra quando `a` termina
+    assert ordem.index('c') > ordem.index('liberar')
+    assert ordem.index('b:modelo') > ordem.index('liberar')
+    assert (fila._em_uso, fila._em_uso_llm, fila._espera) == (0, 0, [])
+
+
+def test_fila_cheia_recusa_e_handler_toma_lugar_da_chamada_mais_nova():
+    async def cenario():
+        fila = FilaAdmissao(vagas=1, vagas_llm=1, limite_fila=2)
+        assert await fila.entrar(False)
+        assert await fila.entrar(True)
+        llm1 = asyncio.create_task(fila.entrar(True))
+        llm2 = asyncio.create_task(fila.entrar(True))
+        await asyncio.sleep(0)
+        # Fila cheia: outra chamada ao modelo é recusada na hora
+        assert not await fila.entrar(True)
+        # Um handler toma o lugar da chamada que entrou por último
+        handler = asyncio.create_task(fila.entrar(False))
+        assert await llm2 is False
+        fila.sair(True)
+        assert await llm1
+        fila.sair(True)
+        fila.sair(False)
+        assert await handler
+        fila.sair(False)
+        return fila
+
+    fila = asyncio.run(cenario())
+    assert (fila._em_uso, fila._em_uso_llm, fila._espera) == (0, 0, [])
+
+
+def _update(user_id):
+    respostas = []
+
+    async def reply_text(texto):
+        respostas.append(texto)
+
+    mensagem = types.SimpleNamespace(reply_text=reply_text)
+    update = types.SimpleNamespace(effective_user=types.SimpleNamespace(id=user_id), effective_message=mensagem, callback_query=None)
+    return update, respostas
+
+
+def test_limite_do_usuario_so_conta_chamadas_aos_modelos():
+    controle = ControleAdmissao(taxa_usuario=0, capacidade_usuario=2, mensagem_limite="limite")
+
+    async def handler(update, context):
+        if context.chama_modelo:
+            async with controle.chamada_modelo(update.effective_user.id):
+                assert controle.fila._em_uso_llm == 1
+        return 'ok'
+
+    envoltorio = controle.envolver('handler', handler)
+    update, respostas = _update(1)
+
+    async def cenario():
+        # Respostas locais ou em cache não gastam fichas nem vagas de modelo
+        resultados = [await envoltorio(update, types.SimpleNamespace(chama_modelo=False)) for _ in range(5)]
+        resultados += [await envoltorio(update, types.SimpleNamespace(chama_modelo=True)) for _ in range(3)]
+        return resultados
+
+    assert asyncio.run(cenario()) == ['ok'] * 7 + [None]
+    assert respostas == ["limite"]
+    assert (controle.fila._em_uso, controle.fila._em_uso_llm) == (0, 0)
+
+
+def test_chamada_recusada_com_a_fila_cheia():
+    controle = ControleAdmissao(vagas_llm=1, limite_fila=0, mensagem_ocupado="ocupado")
+
+    async def handler(update, context):
+        async with controle.chamada_modelo(update.effective_user.id):
+            return 'ok'
+
+    envoltorio = controle.envolver('handler', handler)
+    update, respostas = _update(1)
+
+    async def cenario():
+        # A única vaga de modelo está ocupada e não há lugar na fila
+        assert await controle.fila.entrar(True)
+        recusado = await envoltorio(update, None)
+        controle.fila.sair(True)
+        return recusado, await envoltorio(update, None)
+
+    assert asyncio.run(cenario()) == (None, 'ok')
+    assert respostas == ["ocupado"]
+    assert (controle.fila._em_uso, controle.fila._em_uso_llm) == (0, 0)
+
+
+def test_cobrar_sem_fichas():
+    controle = ControleAdmissao(taxa_usuario=0, capacidade_usuario=1)
+    controle.cobrar(1)
+    try:
+        controle.cobrar(1)
+    except LimiteExcedido:
+        pass
+    else:
+        raise AssertionError("deveria estourar o limite")
+    # O limite é por usuário
+    controle.cobrar(2)
@@ -0,0 +1,88 @@
+import asyncio
+
+from agrupador_consultas import AgrupadorConsultas
+
+
+def test_iguais_coalescem_e_diferentes_vao_no_mesmo_lote():
+    lotes = []
+
+    async def consultar_lote(itens):
+        lotes.append(list(itens))
+        await asyncio.sleep(0.01)
+        return [item.upper() for item in itens]
+
+    async def cenario():
+        agrupador = AgrupadorConsultas('teste', consultar_lote, normalizar=str.strip, janela=0.01, tamanho_maximo=8)
+        return await asyncio.gather(*(agrupador.consultar(item) for item in ["a", " a", "b", "c"]))
+
+    assert asyncio.run(cenario()) == ["A", "A", "B", "C"]
+    assert lotes == [["a", "b", "c"]]
+
+
+def test_lote_cheio_sai_sem_esperar_a_janela():
+    lotes = []
+
+    async def consultar_lote(itens):
+        lotes.append(list(itens))
+        return itens
+
+    async def cenario():
+        agrupador = AgrupadorConsultas('teste', consultar_lote, janela=10, tamanho_maximo=2)
+        return await asyncio.wait_for(asyncio.gather(agrupador.consultar("a"), agrupador.consultar("b")), 1)
+
+    assert asyncio.run(cenario()) == ["a", "b"]
+    assert lotes == [["a", "b"]]
+
+
+def test_erro_no_lote_chega_a_todos_e_libera_a_chave():
+    chamadas = []
+
+    async def consultar_lote(itens):
+        chamadas.append(list(itens))
+        if len(chamadas) == 1:
+            raise RuntimeError("falhou")
+        return itens
+
+    async def cenario():
+        agrupador = AgrupadorConsultas('teste', consultar_lote, janela=0.01)
+        resultados = await asyncio.gather(agrupador.consultar("a"), agrupador.consultar("a"), return_exceptions=True)
+        # Depois da falha, a mesma consulta é feita de novo
+        return resultados, await agrupador.consultar("a")
+
+    resultados, novamente = asyncio.run(cenario())
+    assert all(isinstance(resultado, RuntimeError) for resultado in resultados)
+    assert novamente == "a"
+    assert chamadas == [["a"], ["a"]]
+
+
+def test_guardar_depois_de_responder_e_falha_nao_chega_a_quem_espera():
+    eventos = []
+
+    async def consultar_lote(itens):
+        return [item.upper() for item in itens]
+
+    async def guardar(itens, respostas):
+        eventos.append(('guardar', list(itens), list(respostas)))
+        await asyncio.sleep(0.01)
+        eventos.append(('falha',))
+        raise RuntimeError("cache indisponível")
+
+    async def cenario():
+        agrupador = AgrupadorConsultas('teste', consultar_lote, janela=0.01, guardar=guardar)
+
+        async def consultar(item):
+            resposta = await agrupador.consultar(item)
+            eventos.append(('resposta', resposta))
+            return resposta
+
+        resultados = await asyncio.gather(consultar("a"), consultar("b"))
+        # Enquanto a gravação não termina, o mesmo item sai da resposta pronta
+        assert await agrupador.consultar("a") == "A"
+        await asyncio.gather(*agrupador._tarefas)
+        return resultados
+
+    assert asyncio.run(cenario()) == ["A", "B"]
+    # As respostas chegam antes de a gravação terminar
+    assert eventos[0] == ('guardar', ["a", "b"], ["A", "B"])
+    assert sorted(eventos[1:3]) == [('resposta', "A"), ('resposta', "B")]
+    assert eventos[3:] == [('falha',)]
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from alimentos import TabelaAlimentos, interpretar_item, separar_itens
+
+CAMINHO_TABELA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'alimentos_taco.csv')
+
+
+@pytest.fixture(scope='module')
+def tabela():
+    return TabelaAlimentos.carregar(CAMINHO_TABELA)
+
+
+@pytest.mark.parametrize('mensagem, itens', [
+    ("2 pães e um copo de café com leite", ["2 pães", "um copo de café com leite"]),
+    ("arroz, feijão; bife + salada verde", ["arroz", "feijão", "bife", "salada verde"]),
+    ("0,5 xícara de aveia", ["0,5 xícara de aveia"]),
+    ("1,5 litro de leite, 2 ovos", ["1,5 litro de leite", "2 ovos"]),
+    ("2,5 kg de arroz e 1 banana", ["2,5 kg de arroz", "1 banana"]),
+    ("2 ovos,3 bananas", ["2 ovos", "3 bananas"]),
+])
+def test_separar_itens(mensagem, itens):
+    assert separar_itens(mensagem) == itens
+
+
+@pytest.mark.parametrize('texto, esperado', [
+    ("0,5 xícara de aveia", (0.5, 240, "aveia")),
+    ("1,5 litro de leite", (1.5, 1000, "leite")),
+    ("2,5 kg de arroz", (2.5, 1000, "arroz")),
+    ("1/2 copo de suco de laranja", (0.5, 200, "suco de laranja")),
+    ("duas bananas", (2, None, "bananas")),
+    ("ovo", (1, None, "ovo")),
+])
+def test_interpretar_item(texto, esperado):
+    assert interpretar_item(texto) == esperado
+
+
+def test_calcular_quantidade_decimal(tabela):
+    item = tabela.calcular("0,5 xícara de aveia")
+    # 120 g de aveia, não 5 xícaras
+    assert 400 < item["calorias"] < 550
+
+
+@pytest.mark.parametrize('texto, calorias', [
+    # Fatias e pedaços usam a porção do próprio alimento
+    ("2 fatias de pão de forma", 2 * 25 * 2.53),
+    ("1 fatia de pizza", 110 * 2.65),
+    ("3 fatias de presunto", 3 * 15 * 0.94),
+    ("um pedaço de bolo", 60 * 3.5),
+])
+def test_calcular_fatias_e_pedacos(tabela, texto, calorias):
+    assert tabela.calcular(texto)["calorias"] == pytest.approx(calorias, abs=0.01)
+
+
+@pytest.mark.parametrize('nome, alimento', [
+    ("arroz", "arroz branco cozido"),
+    ("ovos", "ovo cozido"),
+    ("banna", "banana"),
+    ("frango grelhado", "peito de frango grelhado"),
+    ("queijo minas", "queijo minas frescal"),
+])
+def test_buscar_encontra(tabela, nome, alimento):
+    assert tabela.buscar(nome).nome == alimento
+
+
+@pytest.mark.parametrize('nome', [
+    "feijão branco",
+    "pão de mel",
+    "pão de alho",
+    "salada",
+    "salada de frutas",
+    "suco de uva",
+    "arroz com feijão",
+])
+def test_buscar_quase_igual_vai_para_o_modelo(tabela, nome):
+    assert tabela.buscar(nome) is None
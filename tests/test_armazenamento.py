@@ -0,0 +1,195 @@
+import asyncio
+import datetime
+import sqlite3
+
+import armazenamento as armazenamento_modulo
+from armazenamento import MIGRACOES, Armazenamento
+
+
+async def _abrir(tmp_path, **opcoes):
+    armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'), **opcoes)
+    await armazenamento.iniciar()
+    return armazenamento
+
+
+def _item(alimento, proteinas, calorias):
+    return {"alimento": alimento, "proteinas": proteinas, "carboidratos": 1.0, "gorduras": 1.0, "calorias": calorias}
+
+
+def test_escritas_simultaneas_em_um_lote(tmp_path):
+    async def cenario():
+        armazenamento = await _abrir(tmp_path)
+        try:
+            lotes = []
+            executar_lote = armazenamento._executar_lote
+
+            def registrar(funcoes):
+                lotes.append(len(funcoes))
+                return executar_lote(funcoes)
+
+            armazenamento._executar_lote = registrar
+            resultados = await asyncio.gather(*(
+                armazenamento.escrever('INSERT INTO user_preferences (user_id) VALUES (?)', (user_id,))
+                for user_id in range(50)
+            ))
+            total = await armazenamento.ler_um('SELECT COUNT(*) FROM user_preferences')
+            return resultados, total, lotes
+        finally:
+            await armazenamento.fechar()
+
+    resultados, total, lotes = asyncio.run(cenario())
+    assert resultados == [1] * 50
+    assert total == (50,)
+    # As escritas que chegam juntas saem em poucos commits
+    assert sum(lotes) == 50 and len(lotes) < 50
+
+
+def test_falha_de_uma_operacao_nao_desfaz_o_lote(tmp_path):
+    async def cenario():
+        armazenamento = await _abrir(tmp_path)
+        try:
+            def falhar(conexao):
+                conexao.execute('INSERT INTO user_preferences (user_id) VALUES (2)')
+                raise ValueError("falhou")
+
+            resultados = await asyncio.gather(
+                armazenamento.escrever('INSERT INTO user_preferences (user_id) VALUES (1)'),
+                armazenamento.executar_escrita(falhar),
+                armazenamento.escrever('INSERT INTO user_preferences (user_id) VALUES (3)'),
+                return_exceptions=True,
+            )
+            usuarios = await armazenamento.ler('SELECT user_id FROM user_preferences ORDER BY user_id')
+            return resultados, usuarios
+        finally:
+            await armazenamento.fechar()
+
+    resultados, usuarios = asyncio.run(cenario())
+    assert resultados[0] == 1 and resultados[2] == 1
+    assert isinstance(resultados[1], ValueError)
+    # O que a operação com falha escreveu é desfeito no savepoint dela
+    assert usuarios == [(1,), (3,)]
+
+
+def test_leituras_somente_leitura(tmp_path):
+    async def cenario():
+        armazenamento = await _abrir(tmp_path)
+        try:
+            await armazenamento.ler('INSERT INTO user_preferences (user_id) VALUES (1)')
+        except sqlite3.OperationalError:
+            return True
+        finally:
+            await armazenamento.fechar()
+        return False
+
+    assert asyncio.run(cenario())
+
+
+def test_fechar_grava_o_que_estava_na_fila(tmp_path):
+    async def cenario():
+        armazenamento = await _abrir(tmp_path)
+        pendentes = [
+            asyncio.ensure_future(armazenamento.escrever('INSERT INTO user_preferences (user_id) VALUES (?)', (user_id,)))
+            for user_id in range(5)
+        ]
+        await asyncio.sleep(0)
+        await armazenamento.fechar()
+        await asyncio.gather(*pendentes)
+
+        conexao = sqlite3.connect(str(tmp_path / 'nutricao.db'))
+        try:
+            return conexao.execute('SELECT COUNT(*) FROM user_preferences').fetchone()
+        finally:
+            conexao.close()
+
+    assert asyncio.run(cenario()) == (5,)
+
+
+def test_totais_diarios_somados_ao_salvar(tmp_path):
+    async def cenario():
+        armazenamento = await _abrir(tmp_path)
+        try:
+            hoje = datetime.date.today().isoformat()
+            await armazenamento.salvar_itens(1, [_item("arroz", 2.5, 128), _item("feijão", 4.8, 76)])
+            await armazenamento.salvar_itens(1, [_item("banana", 1.3, 98)])
+            await armazenamento.salvar_itens(2, [_item("ovo", 13.3, 146)])
+            alimentos, totais = await armazenamento.consultar_totais_diarios(1, hoje)
+            diarios = await armazenamento.ler('SELECT user_id, day, n_items FROM daily_totals ORDER BY user_id')
+            versao = await armazenamento.versao_dados(1)
+
+            await armazenamento.resetar_info_nutricional(1)
+            depois = await armazenamento.consultar_totais_diarios(1, hoje)
+            return hoje, alimentos, totais, diarios, versao, depois, await armazenamento.versao_dados(1)
+        finally:
+            await armazenamento.fechar()
+
+    hoje, alimentos, totais, diarios, versao, depois, versao_depois = asyncio.run(cenario())
+    assert [alimento[0] for alimento in alimentos] == ["arroz", "feijão", "banana"]
+    assert totais == {"proteinas": 8.6, "carboidratos": 3.0, "gorduras": 3.0, "calorias": 302}
+    assert diarios == [(1, hoje, 3), (2, hoje, 1)]
+    assert versao == 2
+    assert depois == ([], {"proteinas": 0, "carboidratos": 0, "gorduras": 0, "calorias": 0})
+    assert versao_depois == 3
+
+
+def test_migracoes_num_banco_antigo(tmp_path):
+    caminho = str(tmp_path / 'nutricao.db')
+    # Banco da versão anterior: só o log de alimentos, sem user_version
+    conexao = sqlite3.connect(caminho)
+    conexao.execute('''
+    CREATE TABLE info_nutricional (
+        user_id INTEGER, alimento TEXT, proteinas REAL, carboidratos REAL,
+        gorduras REAL, calorias REAL, data_hora TEXT
+    )
+    ''')
+    conexao.executemany('INSERT INTO info_nutricional VALUES (?, ?, ?, ?, ?, ?, ?)', [
+        (1, "arroz", 2.5, 28.1, 0.2, 128, "2026-10-17 12:00:00"),
+        (1, "feijão", 4.8, 13.6, 0.5, 76, "2026-10-17 12:00:00"),
+        (1, "banana", 1.3, 22.8, 0.1, 98, "2026-10-18 08:00:00"),
+    ])
+    conexao.commit()
+    conexao.close()
+
+    async def cenario():
+        for _ in range(2):
+            # A segunda abertura não repete nenhuma migração
+            armazenamento = Armazenamento(caminho)
+            await armazenamento.iniciar()
+            try:
+                versao = await armazenamento.ler_um('PRAGMA user_version')
+                diarios = await armazenamento.ler('SELECT day, protein, kcal, n_items FROM daily_totals ORDER BY day')
+                indices = await armazenamento.ler("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'info_nutricional'")
+            finally:
+                await armazenamento.fechar()
+        return versao, diarios, indices
+
+    versao, diarios, indices = asyncio.run(cenario())
+    assert versao == (len(MIGRACOES),)
+    assert diarios == [("2026-10-17", 7.3, 204, 2), ("2026-10-18", 1.3, 98, 1)]
+    assert indices == [("idx_info_nutricional_usuario_data",)]
+
+
+def test_migracao_com_falha_nao_avanca_a_versao(tmp_path, monkeypatch):
+    def falhar(conexao):
+        conexao.execute('CREATE TABLE parcial (x)')
+        raise RuntimeError("migração quebrada")
+
+    monkeypatch.setattr(armazenamento_modulo, 'MIGRACOES', armazenamento_modulo.MIGRACOES[:1] + [falhar])
+
+    async def cenario():
+        armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+        try:
+            await armazenamento.iniciar()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("a migração deveria falhar")
+
+    asyncio.run(cenario())
+    conexao = sqlite3.connect(str(tmp_path / 'nutricao.db'))
+    try:
+        versao = conexao.execute('PRAGMA user_version').fetchone()
+        parcial = conexao.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'parcial'").fetchone()
+    finally:
+        conexao.close()
+    assert versao == (1,)
+    assert parcial == (0,)
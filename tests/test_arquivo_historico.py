@@ -0,0 +1,145 @@
+import asyncio
+import csv
+import datetime
+import io
+import os
+
+from armazenamento import Armazenamento
+from arquivo_historico import ArquivoHistorico, _ler_arquivo
+
+HOJE = datetime.date(2026, 10, 18)
+
+
+def _inserir(conexao, linhas):
+    conexao.executemany('''
+    INSERT INTO info_nutricional (user_id, alimento, proteinas, carboidratos, gorduras, calorias, data_hora)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', linhas)
+
+
+def _historico(user_id, dias=240):
+    inicio = datetime.datetime(2026, 3, 1, 12)
+    return [
+        (user_id, f"item {dia}", 1.0, 2.0, 3.0, 10.0 + dia, (inicio + datetime.timedelta(days=dia)).strftime("%Y-%m-%d %H:%M:%S"))
+        for dia in range(dias)
+    ]
+
+
+async def _csv(arquivo, user_id):
+    destino = io.BytesIO()
+    total = await arquivo.exportar(user_id, destino)
+    return total, list(csv.reader(io.StringIO(destino.getvalue().decode('utf-8'))))
+
+
+def test_compactar_e_exportar(tmp_path):
+    async def cenario():
+        armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+        await armazenamento.iniciar()
+        arquivo = ArquivoHistorico(armazenamento, str(tmp_path / 'arquivo'), retencao_dias=90)
+        try:
+            await armazenamento.executar_escrita(lambda conexao: _inserir(conexao, _historico(1) + _historico(2)))
+            antes = await _csv(arquivo, 1)
+
+            resumo = await arquivo.compactar(HOJE)
+            depois = await _csv(arquivo, 1)
+            restantes = await armazenamento.ler('SELECT MIN(data_hora), COUNT(*) FROM info_nutricional WHERE user_id = 1')
+            mensais = await armazenamento.ler('SELECT month, kcal, n_items, n_days FROM monthly_totals WHERE user_id = 1 ORDER BY month')
+
+            # Rodar de novo não muda nada
+            segunda = await arquivo.compactar(HOJE)
+            return antes, resumo, depois, restantes, mensais, segunda
+        finally:
+            await armazenamento.fechar()
+
+    antes, resumo, depois, restantes, mensais, segunda = asyncio.run(cenario())
+
+    # Só meses inteiros antes do mês em que começa a janela de 90 dias
+    assert resumo["limite"] == "2026-07-01"
+    assert resumo["meses"] == 8 and resumo["linhas"] == 2 * 122
+    assert restantes == [("2026-07-01 12:00:00", 240 - 122)]
+    assert sorted(os.listdir(tmp_path / 'arquivo' / '1')) == ['2026-03.csv.gz', '2026-04.csv.gz', '2026-05.csv.gz', '2026-06.csv.gz']
+    assert [mes for mes, *_ in mensais] == ['2026-03', '2026-04', '2026-05', '2026-06']
+    assert mensais[0][2:] == (31, 31)
+    assert segunda["linhas"] == 0
+
+    # A exportação é a mesma antes e depois de arquivar, em ordem cronológica
+    assert antes == depois
+    assert depois[0] == 240
+    assert depois[1][0] == ['data_hora', 'alimento', 'proteinas', 'carboidratos', 'gorduras', 'calorias']
+    datas = [linha[0] for linha in depois[1][1:]]
+    assert datas == sorted(datas) and len(datas) == 240
+
+
+def test_exportar_sem_duplicar_linha_arquivada_e_ainda_no_banco(tmp_path):
+    # Simula uma queda entre a gravação do arquivo e a remoção das linhas do banco
+    async def cenario():
+        armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+        await armazenamento.iniciar()
+        arquivo = ArquivoHistorico(armazenamento, str(tmp_path / 'arquivo'), retencao_dias=90)
+        try:
+            await armazenamento.executar_escrita(lambda conexao: _inserir(conexao, _historico(1)))
+            await arquivo.compactar(HOJE)
+            linha = next(_ler_arquivo(str(tmp_path / 'arquivo' / '1' / '2026-04.csv.gz')))
+            await armazenamento.escrever('''
+            INSERT INTO info_nutricional (rowid, user_id, alimento, proteinas, carboidratos, gorduras, calorias, data_hora)
+            VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+            ''', linha)
+            exportado = await _csv(arquivo, 1)
+
+            # A próxima compactação regrava o mês sem repetir a linha
+            await arquivo.compactar(HOJE)
+            arquivadas = list(_ler_arquivo(str(tmp_path / 'arquivo' / '1' / '2026-04.csv.gz')))
+            return exportado, arquivadas
+        finally:
+            await armazenamento.fechar()
+
+    (total, _), arquivadas = asyncio.run(cenario())
+    assert total == 240
+    assert len(arquivadas) == 30
+    assert len({linha[0] for linha in arquivadas}) == 30
+
+
+def test_reset_apaga_o_arquivo(tmp_path):
+    async def cenario():
+        armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+        await armazenamento.iniciar()
+        arquivo = ArquivoHistorico(armazenamento, str(tmp_path / 'arquivo'), retencao_dias=90)
+        try:
+            await armazenamento.executar_escrita(lambda conexao: _inserir(conexao, _historico(1)))
+            await arquivo.compactar(HOJE)
+            await armazenamento.resetar_info_nutricional(1)
+            # Antes de o arquivo sair do disco, a exportação já não o lê
+            entre = await _csv(arquivo, 1)
+            await arquivo.apagar(1)
+            mensais = await armazenamento.ler('SELECT COUNT(*) FROM monthly_totals WHERE user_id = 1')
+            return entre, await _csv(arquivo, 1), mensais
+        finally:
+            await armazenamento.fechar()
+
+    entre, (total, linhas), mensais = asyncio.run(cenario())
+    assert entre[0] == 0
+    assert total == 0 and len(linhas) == 1
+    assert mensais == [(0,)]
+    assert not os.path.exists(tmp_path / 'arquivo' / '1')
+
+
+def test_exportar_ignora_arquivo_sem_totais_do_mes(tmp_path):
+    # Simula uma queda depois de gravar o arquivo e antes de tirar as linhas da tabela
+    async def cenario():
+        armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+        await armazenamento.iniciar()
+        arquivo = ArquivoHistorico(armazenamento, str(tmp_path / 'arquivo'), retencao_dias=90)
+        try:
+            await armazenamento.executar_escrita(lambda conexao: _inserir(conexao, _historico(1, dias=40)))
+            linhas = await armazenamento.ler('''
+            SELECT rowid, alimento, proteinas, carboidratos, gorduras, calorias, data_hora
+            FROM info_nutricional WHERE data_hora < '2026-04-01'
+            ''')
+            arquivo._gravar_arquivo(arquivo._caminho(1, '2026-03'), linhas)
+            return await _csv(arquivo, 1)
+        finally:
+            await armazenamento.fechar()
+
+    total, linhas = asyncio.run(cenario())
+    assert total == 40
+    assert len(linhas) == 41
@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import os
+import types
+
+import pytest
+
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:teste')
+os.environ.setdefault('METRICAS_PORTA', '')
+os.environ.setdefault('LOG_NIVEL', 'WARNING')
+
+from telegram.error import BadRequest  # noqa: E402
+
+import bot_telegram  # noqa: E402
+from armazenamento import Armazenamento  # noqa: E402
+from cache_memoria import CacheMemoria  # noqa: E402
+from graficos import montar_serie  # noqa: E402
+
+
+class ChatFalso:
+    def __init__(self):
+        self.fotos = []
+        self.textos = []
+        self.recusar_file_id = False
+        self._proximo = 1
+
+    async def reply_photo(self, foto, caption=None, filename=None):
+        if isinstance(foto, str) and self.recusar_file_id:
+            raise BadRequest("Wrong file identifier/http url specified")
+        self.fotos.append(foto)
+        file_id = foto if isinstance(foto, str) else f"foto{self._proximo}"
+        self._proximo += 1
+        return types.SimpleNamespace(photo=[types.SimpleNamespace(file_id=file_id)])
+
+    async def reply_text(self, texto, parse_mode=None):
+        self.textos.append(texto)
+
+
+@pytest.fixture
+def grafico(tmp_path, monkeypatch):
+    desenhos = []
+    desenhar = bot_telegram.desenhar_grafico
+
+    def contar(*args):
+        desenhos.append(args[2])
+        return desenhar(*args)
+
+    armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+    monkeypatch.setattr(bot_telegram, 'armazenamento', armazenamento)
+    monkeypatch.setattr(bot_telegram, 'cache_graficos', CacheMemoria(capacidade=8))
+    monkeypatch.setattr(bot_telegram, 'desenhar_grafico', contar)
+    chat = ChatFalso()
+
+    async def pedir(*args):
+        update = types.SimpleNamespace(message=types.SimpleNamespace(from_user=types.SimpleNamespace(id=1), **{
+            'reply_photo': chat.reply_photo, 'reply_text': chat.reply_text,
+        }))
+        await bot_telegram.enviar_grafico(update, types.SimpleNamespace(args=list(args)))
+
+    return armazenamento, chat, desenhos, pedir
+
+
+def test_grafico_reaproveita_file_id_ate_os_dados_mudarem(grafico):
+    armazenamento, chat, desenhos, pedir = grafico
+    item = {"alimento": "arroz", "proteinas": 2.5, "carboidratos": 28.1, "gorduras": 0.2, "calorias": 128}
+
+    async def cenario():
+        await armazenamento.iniciar()
+        try:
+            await armazenamento.salvar_itens(1, [item])
+            await pedir('7')
+            await pedir('7')
+            # Outro período é outro gráfico
+            await pedir()
+            # Um alimento novo muda a versão dos dados e o gráfico é redesenhado
+            await armazenamento.salvar_itens(1, [item])
+            await pedir('7')
+            # file_id recusado: reenvia o PNG já desenhado
+            chat.recusar_file_id = True
+            await pedir('7')
+        finally:
+            await armazenamento.fechar()
+
+    asyncio.run(cenario())
+    assert len(desenhos) == 3
+    assert desenhos[0].startswith("Últimos 7 dias") and desenhos[1].startswith("Últimos 30 dias")
+    assert [type(foto) for foto in chat.fotos] == [bytes, str, bytes, bytes, bytes]
+    assert chat.fotos[1] == "foto1"
+    assert chat.fotos[0][:8] == b'\x89PNG\r\n\x1a\n'
+    assert chat.fotos[4] == chat.fotos[3]
+
+
+def test_grafico_periodo_invalido_e_sem_dados(grafico):
+    armazenamento, chat, desenhos, pedir = grafico
+
+    async def cenario():
+        await armazenamento.iniciar()
+        try:
+            await pedir('15')
+            await pedir('7', '30')
+            await pedir('90')
+        finally:
+            await armazenamento.fechar()
+
+    asyncio.run(cenario())
+    assert chat.textos[0] == chat.textos[1] == "Use `/grafico 7`, `/grafico 30` ou `/grafico 90`."
+    assert chat.textos[2] == "Você não registrou alimentos nos últimos 90 dias."
+    assert chat.fotos == [] and desenhos == []
+
+
+def test_montar_serie_preenche_dias_sem_registro():
+    fim = datetime.date(2026, 10, 18)
+    datas, serie = montar_serie([
+        ("2026-10-10", 1, 2, 3, 40),
+        ("2026-10-16", 4, 5, 6, 70),
+        ("2026-10-18", 7, 8, 9, None),
+    ], fim, 7)
+    assert datas[0] == datetime.date(2026, 10, 12) and datas[-1] == fim
+    assert serie["calorias"] == [0, 0, 0, 0, 70, 0, 0]
+    assert serie["proteinas"] == [0, 0, 0, 0, 4, 0, 7]
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+from motor_nutrientes import MotorNutrientes, Nutrientes, interpretar_chamada
+
+
+def _argumentos(*itens):
+    return json.dumps({"itens": list(itens)})
+
+
+def _item(numero, calorias=100, confianca="alta"):
+    return {"numero": numero, "reconhecido": True, "proteinas": 1, "carboidratos": 2,
+            "gorduras": 3, "calorias": calorias, "confianca": confianca}
+
+
+def test_interpretar_chamada():
+    respostas = interpretar_chamada(_argumentos(
+        _item(1),
+        {"numero": 2, "reconhecido": False, "confianca": "alta"},
+        {"numero": 3, "reconhecido": True, "proteinas": -1, "carboidratos": 0, "gorduras": 0, "calorias": 0},
+        _item(9),
+    ), 3)
+    assert respostas == {
+        1: (True, Nutrientes(1, 2, 3, 100), "alta"),
+        2: (False, None, "alta"),
+    }
+
+
+def test_interpretar_chamada_invalida():
+    assert interpretar_chamada("{", 2) == {}
+    assert interpretar_chamada(json.dumps({"itens": "x"}), 2) == {}
+
+
+class MotorFalso(MotorNutrientes):
+    def __init__(self, respostas):
+        super().__init__([("barato", 5), ("caro", 5)], hedge=False)
+        self.respostas = respostas
+        self.chamadas = []
+
+    async def _requisitar(self, modelo, alimentos):
+        self.chamadas.append((modelo, list(alimentos)))
+        return self.respostas[modelo](alimentos)
+
+
+def test_nao_reconhecido_nao_sobe_na_escada():
+    motor = MotorFalso({
+        "barato": lambda alimentos: interpretar_chamada(_argumentos(
+            _item(1), {"numero": 2, "reconhecido": False, "confianca": "alta"}), len(alimentos)),
+    })
+    resultados = asyncio.run(motor.consultar_lote(["banana", "pedra"]))
+    assert resultados == [Nutrientes(1, 2, 3, 100), None]
+    assert [modelo for modelo, _ in motor.chamadas] == ["barato"]
+
+
+def test_baixa_confianca_e_falha_de_esquema_sobem():
+    motor = MotorFalso({
+        "barato": lambda alimentos: interpretar_chamada(_argumentos(_item(1, confianca="baixa")), len(alimentos)),
+        "caro": lambda alimentos: interpretar_chamada(_argumentos(_item(2, calorias=200)), len(alimentos)),
+    })
+    resultados = asyncio.run(motor.consultar_lote(["feijoada", "item sem resposta"]))
+    # O item de baixa confiança mantém a resposta provisória quando o degrau de cima também falha
+    assert resultados == [Nutrientes(1, 2, 3, 100), Nutrientes(1, 2, 3, 200)]
+    assert motor.chamadas == [("barato", ["feijoada", "item sem resposta"]), ("caro", ["feijoada", "item sem resposta"])]
+
+
+def test_latencia_de_chamadas_canceladas_entra_no_p95():
+    class MotorLento(MotorNutrientes):
+        async def _requisitar(self, modelo, alimentos):
+            await asyncio.sleep(1)
+
+    motor = MotorLento([("lento", 0.02)], hedge=True, amostras_minimas=3)
+
+    async def cenario():
+        for _ in range(4):
+            assert await motor.consultar_lote(["banana"]) == [None]
+            # Deixa as requisições canceladas pelo prazo terminarem de sair
+            await asyncio.sleep(0)
+
+    asyncio.run(cenario())
+    latencias = list(motor._latencias["lento"])
+    # Todas estouraram o prazo: entram limitadas a ele e passam a alimentar o hedge
+    assert len(latencias) >= 4
+    assert all(0 < latencia <= 0.02 for latencia in latencias)
+    assert motor._p95("lento") is not None
@@ -0,0 +1,129 @@
+import asyncio
+
+from telegram.ext import Application
+
+from armazenamento import Armazenamento
+from persistencia import PersistenciaSQLite
+
+
+async def _preparar(tmp_path, **opcoes):
+    armazenamento = Armazenamento(str(tmp_path / 'nutricao.db'))
+    persistencia = PersistenciaSQLite(armazenamento, **opcoes)
+    await persistencia.get_user_data()
+    application = Application.builder().token('123:abc').persistence(persistencia).build()
+    return armazenamento, persistencia, application
+
+
+async def _gravado(armazenamento, user_id):
+    linha = await armazenamento.ler_um('SELECT dados FROM persistencia_usuarios WHERE user_id = ?', (user_id,))
+    return linha[0] if linha else None
+
+
+# Simula o que a Application faz a cada atualização: carrega, altera e persiste
+async def _atualizar(persistencia, application, user_id, **dados):
+    await persistencia.refresh_user_data(user_id, application.user_data[user_id])
+    application.user_data[user_id].update(dados)
+    application.mark_data_for_update_persistence(user_ids=user_id)
+    await application.update_persistence()
+    await persistencia.flush()
+
+
+def test_carregar_e_gravar(tmp_path):
+    async def cenario():
+        armazenamento, persistencia, application = await _preparar(tmp_path)
+        try:
+            await _atualizar(persistencia, application, 1, alimento='arroz')
+            await _atualizar(persistencia, application, 2, alimento='feijão')
+            await persistencia.update_conversation('adicionar', (1, 1), 0)
+            await persistencia.flush()
+            gravados = [await _gravado(armazenamento, 1), await _gravado(armazenamento, 2)]
+
+            # Outro processo só lê o usuário quando ele aparece
+            outra = PersistenciaSQLite(armazenamento)
+            assert await outra.get_user_data() == {}
+            assert await outra.get_conversations('adicionar') == {(1, 1): 0}
+            dados = {'alimento': 'em memória'}
+            await outra.refresh_user_data(1, dados)
+            return gravados, dados
+        finally:
+            await armazenamento.fechar()
+
+    gravados, dados = asyncio.run(cenario())
+    assert gravados == ['{"alimento": "arroz"}', '{"alimento": "feijão"}']
+    # O que já está em memória tem prioridade sobre o banco
+    assert dados == {'alimento': 'em memória'}
+
+
+def test_falha_na_gravacao_devolve_o_lote(tmp_path):
+    async def cenario():
+        armazenamento, persistencia, _ = await _preparar(tmp_path)
+        escrever = armazenamento.executar_escrita
+
+        async def falhar(funcao):
+            # Chega uma alteração mais nova de um dos usuários durante a gravação
+            await persistencia.update_user_data(1, {'alimento': 'novo'})
+            raise RuntimeError("disco cheio")
+
+        try:
+            await persistencia.update_user_data(1, {'alimento': 'velho'})
+            await persistencia.update_user_data(2, {'alimento': 'feijão'})
+            await persistencia.update_conversation('adicionar', (2, 2), 0)
+            armazenamento.executar_escrita = falhar
+            try:
+                await persistencia.flush()
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError("a falha deveria chegar a quem chamou")
+            pendentes = dict(persistencia._usuarios_pendentes), dict(persistencia._conversas_pendentes)
+
+            armazenamento.executar_escrita = escrever
+            await persistencia.flush()
+            return pendentes, await _gravado(armazenamento, 1), await _gravado(armazenamento, 2)
+        finally:
+            await armazenamento.fechar()
+
+    (usuarios, conversas), usuario1, usuario2 = asyncio.run(cenario())
+    assert usuarios == {1: {'alimento': 'novo'}, 2: {'alimento': 'feijão'}}
+    assert conversas == {('adicionar', (2, 2)): 0}
+    assert (usuario1, usuario2) == ('{"alimento": "novo"}', '{"alimento": "feijão"}')
+
+
+def test_usuario_despejado_e_recarregado_do_banco(tmp_path):
+    async def cenario():
+        armazenamento, persistencia, application = await _preparar(tmp_path, tempo_ocioso=0)
+        try:
+            await _atualizar(persistencia, application, 1, meta=2000)
+            assert persistencia.despejar_ociosos(application) == 1
+            despejado = 1 not in application.user_data
+
+            # O despejo chega à persistência como drop_user_data e não apaga o banco
+            await application.update_persistence()
+            await persistencia.flush()
+            no_banco = await _gravado(armazenamento, 1)
+
+            await persistencia.refresh_user_data(1, application.user_data[1])
+            return despejado, no_banco, dict(application.user_data[1]), persistencia.usuarios_em_memoria()
+        finally:
+            await armazenamento.fechar()
+
+    despejado, no_banco, recarregado, em_memoria = asyncio.run(cenario())
+    assert despejado
+    assert no_banco == '{"meta": 2000}'
+    assert recarregado == {'meta': 2000}
+    assert em_memoria == 1
+
+
+def test_usuario_que_volta_antes_do_drop_nao_perde_a_alteracao(tmp_path):
+    async def cenario():
+        armazenamento, persistencia, application = await _preparar(tmp_path, tempo_ocioso=0)
+        try:
+            await _atualizar(persistencia, application, 1, meta=2000)
+            persistencia.despejar_ociosos(application)
+            # Nova mensagem antes de a Application repassar o drop_user_data
+            await _atualizar(persistencia, application, 1, meta=1800)
+            return await _gravado(armazenamento, 1)
+        finally:
+            await armazenamento.fechar()
+
+    assert asyncio.run(cenario()) == '{"meta": 1800}'
@@ -0,0 +1,56 @@
+import asyncio
+import datetime
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from relatorios import enviar_relatorios, montar_relatorio
+from utilitarios import LIMITE_MENSAGEM, LimitadorTaxa
+
+
+class BotFalso:
+    def __init__(self, erros):
+        # {user_id: [exceção ou None por tentativa]}
+        self.erros = erros
+        self.enviadas = []
+
+    async def send_message(self, chat_id, text):
+        erros = self.erros.get(chat_id)
+        if erros:
+            erro = erros.pop(0)
+            if erro is not None:
+                raise erro
+        self.enviadas.append(chat_id)
+
+
+def test_enviar_relatorios():
+    bot = BotFalso({
+        2: [RetryAfter(datetime.timedelta(seconds=0.05))],
+        3: [Forbidden("bot was blocked by the user")],
+        4: [BadRequest("chat not found")],
+        5: [RetryAfter(0), RetryAfter(0), RetryAfter(0)],
+        6: [RuntimeError("inesperado")],
+    })
+    mensagens = {user_id: f"relatório {user_id}" for user_id in range(1, 9)}
+
+    async def cenario():
+        inicio = asyncio.get_running_loop().time()
+        resumo = await enviar_relatorios(bot, mensagens, limitador=LimitadorTaxa(1000, 1000), concorrencia=3)
+        return resumo, asyncio.get_running_loop().time() - inicio
+
+    resumo, duracao = asyncio.run(cenario())
+    # O RetryAfter pausa todos os envios e o usuário é tentado de novo; quem
+    # bloqueou o bot, um erro da API ou uma falha inesperada não derrubam os demais
+    assert sorted(bot.enviadas) == [1, 2, 7, 8]
+    assert (resumo["enviados"], resumo["falhas"], resumo["limitados"]) == (4, 4, 4)
+    assert duracao >= 0.05
+
+
+def test_montar_relatorio_cabe_numa_mensagem():
+    totais = {"proteinas": 1, "carboidratos": 2, "gorduras": 3, "calorias": 4}
+    alimentos = [(f"alimento {i} " + "x" * 80, 1, 2, 3, 4) for i in range(200)]
+    texto = montar_relatorio(alimentos, totais, rodape="rodapé")
+    assert len(texto) <= LIMITE_MENSAGEM
+    assert "…\n" in texto and texto.endswith("rodapé")
+
+    vazio = montar_relatorio([], totais)
+    assert vazio.startswith("Você não consumiu nenhum alimento ontem.")
@@ -0,0 +1,40 @@
+import asyncio
+
+from servidor_http import ServidorHTTP
+
+
+async def _enviar(porta, corpo, declarado=None):
+    leitor, escritor = await asyncio.open_connection('127.0.0.1', porta)
+    escritor.write(
+        f"POST /rota HTTP/1.1\r\nHost: teste\r\nConnection: close\r\n"
+        f"Content-Length: {len(corpo) if declarado is None else declarado}\r\n\r\n".encode() + corpo
+    )
+    await escritor.drain()
+    resposta = await asyncio.wait_for(leitor.read(), 1)
+    escritor.close()
+    return resposta
+
+
+def test_corpo_grande_demais_recebe_413_e_fecha():
+    recebidos = []
+
+    async def rota(requisicao):
+        recebidos.append(requisicao.corpo)
+        return 200, b'ok', 'text/plain'
+
+    async def cenario():
+        servidor = ServidorHTTP({('POST', '/rota'): rota}, porta=0, tamanho_maximo=16)
+        await servidor.iniciar()
+        try:
+            # leitor.read() só termina quando o servidor fecha a conexão
+            grande = await _enviar(servidor.porta, b'', declarado=1024)
+            pequeno = await _enviar(servidor.porta, b'{}')
+        finally:
+            await servidor.parar(tempo_limite=1)
+        return grande, pequeno
+
+    grande, pequeno = asyncio.run(cenario())
+    assert grande.startswith(b'HTTP/1.1 413 Payload Too Large\r\n')
+    assert b'Connection: close' in grande
+    assert pequeno.startswith(b'HTTP/1.1 200 OK\r\n') and pequeno.endswith(b'ok')
+    assert recebidos == [b'{}']
@@ -0,0 +1,58 @@
+import asyncio
+import contextlib
+import io
+
+import openai
+
+from cache_memoria import CacheMemoria
+from metricas import medir
+from utilitarios import segundos
+
+# Transcrição dos áudios inteiramente em memória: o arquivo de voz é baixado
+# para um BytesIO e enviado direto ao Whisper, sem passar pelo disco. Um
+# semáforo limita quantos áudios são baixados/transcritos ao mesmo tempo e as
+# transcrições ficam em cache pelo file_unique_id do Telegram. Quem chama pode
+# passar em `chamada` um gerenciador de contexto assíncrono, aberto só em
+# volta da chamada ao Whisper (ex.: ControleAdmissao.chamada_modelo).
+
+
+class AudioInvalido(Exception):
+    pass
+
+
+class Transcritor:
+    def __init__(self, tamanho_maximo=2 * 1024 * 1024, duracao_maxima=120, concorrencia=4, capacidade_cache=1024):
+        self.tamanho_maximo = tamanho_maximo
+        self.duracao_maxima = duracao_maxima
+        self._semaforo = asyncio.Semaphore(concorrencia)
+        self._cache = CacheMemoria(capacidade_cache)
+
+    # Recusa o áudio antes de baixar, pelos metadados que o Telegram já envia
+    def validar(self, voice):
+        if segundos(voice.duration) > self.duracao_maxima:
+            raise AudioInvalido(f"O áudio deve ter no máximo {self.duracao_maxima} segundos.")
+        if voice.file_size and voice.file_size > self.tamanho_maximo:
+            raise AudioInvalido("O áudio é grande demais para ser processado.")
+
+    async def transcrever(self, voice, chamada=None):
+        self.validar(voice)
+        texto = self._cache.obter(voice.file_unique_id)
+        if texto is not None:
+            return texto
+
+        async with self._semaforo:
+            voice_file = await voice.get_file()
+            audio = io.BytesIO()
+            await voice_file.download_to_memory(audio)
+            if audio.tell() > self.tamanho_maximo:
+                raise AudioInvalido("O áudio é grande demais para ser processado.")
+
+            # O cliente da OpenAI usa o nome do arquivo para identificar o formato
+            audio.seek(0)
+            audio.name = "audio.ogg"
+            async with chamada or contextlib.nullcontext(), medir('openai', 'whisper'):
+                response = await openai.Audio.atranscribe("whisper-1", audio)
+
+        texto = response['text']
+        self._cache.guardar(voice.file_unique_id, texto)
+        return texto
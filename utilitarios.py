@@ -0,0 +1,61 @@
+import asyncio
+import datetime
+import time
+
+# Utilitários usados por vários módulos do bot: o limite de tamanho das
+# mensagens do Telegram, a conversão dos intervalos da Bot API e um token
+# bucket para limitar taxas.
+
+LIMITE_MENSAGEM = 4096
+
+
+# Converte em segundos um intervalo da Bot API (retry_after, duração de áudio),
+# que o PTB entrega como timedelta ou número
+def segundos(intervalo):
+    if isinstance(intervalo, datetime.timedelta):
+        return intervalo.total_seconds()
+    return float(intervalo or 0)
+
+
+# Token bucket: `taxa` fichas por segundo, acumulando no máximo `capacidade`
+class LimitadorTaxa:
+    def __init__(self, taxa=25, capacidade=25):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._fichas = capacidade
+        self._atualizado_em = time.monotonic()
+        self._pausado_ate = 0
+        self._trava = asyncio.Lock()
+
+    def _recarregar(self, agora):
+        self._fichas = min(self.capacidade, self._fichas + (agora - self._atualizado_em) * self.taxa)
+        self._atualizado_em = agora
+
+    async def adquirir(self):
+        async with self._trava:
+            while True:
+                agora = time.monotonic()
+                if agora < self._pausado_ate:
+                    await asyncio.sleep(self._pausado_ate - agora)
+                    continue
+                self._recarregar(agora)
+                if self._fichas >= 1:
+                    self._fichas -= 1
+                    return
+                await asyncio.sleep((1 - self._fichas) / self.taxa)
+
+    # Consome uma ficha se houver, sem esperar; devolve se conseguiu
+    def tentar_adquirir(self):
+        agora = time.monotonic()
+        if agora < self._pausado_ate:
+            return False
+        self._recarregar(agora)
+        if self._fichas >= 1:
+            self._fichas -= 1
+            return True
+        return False
+
+    # Suspende todas as aquisições pelo tempo pedido (ex.: RetryAfter do Telegram)
+    def pausar(self, segundos):
+        self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+        self._fichas = 0
@@ -0,0 +1,101 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+
+from servidor_http import ServidorHTTP
+
+# Modo webhook: o Telegram entrega as atualizações por POST em um servidor
+# HTTP local, em vez do bot buscá-las com long polling.
+
+logger = logging.getLogger(__name__)
+
+
+# Abre (ou não, sem caminho) o arquivo em que as atualizações recebidas são
+# gravadas para o reproduzir_atualizacoes.py; quem abre fecha no encerramento
+def abrir_gravacao(arquivo_gravacao):
+    return open(arquivo_gravacao, 'a', encoding='utf-8') if arquivo_gravacao else None
+
+
+# Cria a rota que confere o segredo enviado pelo Telegram no cabeçalho
+# X-Telegram-Bot-Api-Secret-Token e repassa o JSON da atualização para
+# `entregar(dados)`, que devolve False quando não há espaço para recebê-la;
+# com `gravacao` (um arquivo aberto), cada atualização também é gravada nele
+def criar_rota_webhook(segredo, entregar, gravacao=None):
+    async def receber(requisicao):
+        token = requisicao.cabecalhos.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(token.encode(), segredo.encode()):
+            return 403, b'', 'text/plain'
+        try:
+            dados = json.loads(requisicao.corpo)
+        except ValueError:
+            return 400, b'', 'text/plain'
+
+        if gravacao:
+            gravacao.write(json.dumps(dados, ensure_ascii=False) + '\n')
+            gravacao.flush()
+
+        # Com 503 o Telegram reenvia a atualização mais tarde
+        if not await entregar(dados):
+            return 503, b'', 'text/plain'
+        return 200, b'', 'text/plain'
+
+    return receber
+
+
+# Espera SIGINT/SIGTERM (ou Ctrl+C onde não há sinais)
+async def aguardar_sinal_de_parada():
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sinal, parar.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await parar.wait()
+
+
+# Executa a aplicação em modo webhook até receber um sinal de parada. No
+# encerramento, o servidor para de aceitar requisições e espera as que estão
+# em andamento; depois Application.stop() processa o que ficou na fila.
+async def executar_webhook(application, segredo, host='127.0.0.1', porta=8443, caminho='/webhook',
+                           url_publica=None, limite_fila=1000, arquivo_gravacao=None):
+    async def entregar(dados):
+        if application.update_queue.qsize() >= limite_fila:
+            return False
+        await application.update_queue.put(Update.de_json(dados, application.bot))
+        return True
+
+    gravacao = abrir_gravacao(arquivo_gravacao)
+    servidor = ServidorHTTP({('POST', caminho): criar_rota_webhook(segredo, entregar, gravacao)}, host, porta)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        if url_publica:
+            await application.bot.set_webhook(
+                url=url_publica.rstrip('/') + caminho,
+                secret_token=segredo,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        await application.start()
+        await servidor.iniciar()
+        logger.info(f"Webhook escutando em http://{host}:{servidor.porta}{caminho}")
+
+        await aguardar_sinal_de_parada()
+        logger.info("Encerrando o webhook...")
+    finally:
+        await servidor.parar()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        if gravacao:
+            gravacao.close()